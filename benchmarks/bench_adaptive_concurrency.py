@@ -0,0 +1,79 @@
+'''
+Compares the AdaptiveConcurrency extension with static concurrency settings on a local mock server that gets
+slower with the number of requests in flight and rate limits with 429s:
+$ python benchmarks/bench_adaptive_concurrency.py --pages 300 --latency 0.05 --congestion 0.02 --rate-limit 40
+'''
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scraper'))
+
+import scrapy
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+
+from mock_server import MockServer
+
+
+class PagesSpider(scrapy.Spider):
+    name = 'pages'
+
+    def __init__(self, base_url, pages, *args, **kwargs):
+        super(PagesSpider, self).__init__(*args, **kwargs)
+        self.start_urls = ['%s/page/%d' % (base_url, n) for n in range(pages)]
+
+    def parse(self, response):
+        yield {'url': response.url}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pages', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--congestion', type=float, default=0.02)
+    parser.add_argument('--rate-limit', type=int, default=40)
+    parser.add_argument('--static', type=int, nargs='*', default=[2, 8, 16], help='static concurrencies to compare')
+    args = parser.parse_args()
+
+    os.environ.setdefault('SCRAPY_SETTINGS_MODULE', 'scraper.settings')
+    server = MockServer(('127.0.0.1', 0), latency=args.latency, congestion=args.congestion,
+                        rate_limit=args.rate_limit)
+    server.start_in_thread()
+    base_url = 'http://127.0.0.1:%d' % server.server_port
+
+    settings = get_project_settings()
+    settings.set('ROBOTSTXT_OBEY', False)
+    process = CrawlerProcess(settings)
+
+    # one spider class per run, each with its own concurrency settings
+    runs = [('adaptive', {'ADAPTIVE_CONCURRENCY_ENABLED': True})]
+    for concurrency in args.static:
+        runs.append(('static %d' % concurrency, {'ADAPTIVE_CONCURRENCY_ENABLED': False,
+                                                 'CONCURRENT_REQUESTS_PER_DOMAIN': concurrency}))
+    crawlers = [process.create_crawler(type('PagesSpider', (PagesSpider,), {'custom_settings': custom_settings}))
+                for _, custom_settings in runs]
+    timings = []
+
+    # run the crawls one after the other so they don't compete for the mock server
+    def crawl(_, i=0):
+        if i > 0:
+            timings.append(time.time() - timings.pop())
+        if i == len(crawlers):
+            return
+        timings.append(time.time())
+        process.crawl(crawlers[i], base_url=base_url, pages=args.pages).addBoth(crawl, i + 1)
+    crawl(None)
+    process.start()
+
+    for (name, _), crawler, elapsed in zip(runs, crawlers, timings):
+        stats = crawler.stats.get_stats()
+        print('%-10s %6.1f s %7.1f pages/s %5d 429s %4d failed  %s' % (
+            name, elapsed, stats.get('item_scraped_count', 0) / elapsed,
+            stats.get('downloader/response_status_count/429', 0), stats.get('retry/max_reached', 0),
+            dict((key, value) for key, value in stats.items() if key.startswith('adaptive_concurrency/'))))
+
+if __name__ == '__main__':
+    main()
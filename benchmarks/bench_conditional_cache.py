@@ -0,0 +1,68 @@
+'''
+Crawls the pages of a local mock server twice with the conditional cache enabled:
+$ python benchmarks/bench_conditional_cache.py --pages 200 --changed 0.1
+
+The first crawl fills the store, the second one revalidates every page. Prints the conditional_cache stats
+of both crawls.
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scraper'))
+
+import scrapy
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+
+from mock_server import MockServer
+
+
+class PagesSpider(scrapy.Spider):
+    name = 'pages'
+
+    def __init__(self, base_url, pages, *args, **kwargs):
+        super(PagesSpider, self).__init__(*args, **kwargs)
+        self.start_urls = ['%s/page/%d' % (base_url, n) for n in range(pages)]
+
+    def parse(self, response):
+        yield {'url': response.url, 'unchanged': response.meta.get('cache_unchanged', False)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--changed', type=float, default=0.1)
+    parser.add_argument('--max-bytes', type=int, default=500 * 1024 * 1024)
+    args = parser.parse_args()
+
+    os.environ.setdefault('SCRAPY_SETTINGS_MODULE', 'scraper.settings')
+    settings = get_project_settings()
+    settings.set('CONDITIONAL_CACHE_ENABLED', True)
+    settings.set('CONDITIONAL_CACHE_DIR', tempfile.mkdtemp())
+    settings.set('CONDITIONAL_CACHE_MAX_BYTES', args.max_bytes)
+    settings.set('ROBOTSTXT_OBEY', False)
+
+    server = MockServer(('127.0.0.1', 0))
+    server.start_in_thread()
+    base_url = 'http://127.0.0.1:%d' % server.server_port
+    process = CrawlerProcess(settings)
+    crawlers = [process.create_crawler(PagesSpider), process.create_crawler(PagesSpider)]
+
+    # run the crawls one after the other, between them a fraction of the pages changes
+    def second_crawl(_):
+        server.change(args.changed)
+        return process.crawl(crawlers[1], base_url=base_url, pages=args.pages)
+    process.crawl(crawlers[0], base_url=base_url, pages=args.pages).addCallback(second_crawl)
+    process.start()
+
+    for name, crawler in zip(['first crawl', 'second crawl'], crawlers):
+        stats = crawler.stats.get_stats()
+        print('%s: %s' % (name, dict((key, value) for key, value in stats.items()
+                                     if key.startswith('conditional_cache/'))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+'''
+Time to find the near-duplicate reviews among synthetic reviews with planted copies, for comparing the shingle sets
+of every pair of reviews and for the DuplicateIndex, and the time to add a day of new reviews to the index:
+$ python benchmarks/bench_duplicates.py --reviews 200000 --pairwise 3000 --new 2000
+
+A tenth of the reviews are copies of another review (at another restaurant, by the same or another reviewer) with a
+few words changed. The pairs of the index are checked against the exact Jaccard similarities of the first
+--pairwise reviews, of which the time of comparing all pairs is extrapolated to all reviews.
+'''
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scrape_save_search'))
+
+import duplicates
+
+WORDS = ('lekker eten goede bediening gezellig sfeer prima prijs kwaliteit verhouding zeker terug niet pasta vis '
+         'wijn dessert vriendelijk personeel snel langzaam duur goedkoop burger friet salade soep biefstuk terras '
+         'rustig druk aanrader teleurstellend heerlijk smaakvol ruime porties keuze menu kaart').split()
+
+
+def synthetic_review(i, rng):
+    return {'id': rng.randint(0, 5000), 'name': 'Restaurant', 'reviewer': 'Reviewer %d' % rng.randint(0, 50000),
+            'date': '2017-%02d-%02d' % (rng.randint(1, 12), rng.randint(1, 28)),
+            'comment': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(10, 80)))}
+
+
+def copy_review(review, rng):
+    words = review['comment'].split()
+    for _ in range(max(1, len(words) // 40)):
+        words[rng.randrange(len(words))] = rng.choice(WORDS)
+    return dict(review, id=rng.randint(0, 5000), comment=' '.join(words),
+                reviewer=review['reviewer'] if rng.random() < 0.5 else 'Reviewer %d' % rng.randint(0, 50000))
+
+
+def synthetic_reviews(count, rng):
+    reviews = []
+    for i in range(count):
+        if reviews and rng.random() < 0.1:
+            reviews.append(copy_review(rng.choice(reviews), rng))
+        else:
+            reviews.append(synthetic_review(i, rng))
+    return reviews
+
+
+def pairwise(reviews, shingle, threshold):
+    '''The pairs of reviews whose shingle sets are at least threshold similar, comparing every pair'''
+    sets = [set(duplicates.shingles(review['comment'], shingle)) for review in reviews]
+    pairs = set()
+    for i in range(len(sets)):
+        for j in range(i + 1, len(sets)):
+            if len(sets[i] & sets[j]) >= threshold * len(sets[i] | sets[j]):
+                pairs.add((i, j))
+    return pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--reviews', type=int, default=200000)
+    parser.add_argument('--pairwise', type=int, default=3000)
+    parser.add_argument('--new', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    reviews = synthetic_reviews(args.reviews + args.new, rng)
+    threshold = duplicates.DEFAULTS['threshold']
+    shingle = duplicates.DEFAULTS['shingle']
+
+    start = time.perf_counter()
+    expected = pairwise(reviews[:args.pairwise], shingle, threshold)
+    pairwise_seconds = time.perf_counter() - start
+    all_pairs_seconds = pairwise_seconds * (args.reviews / args.pairwise) ** 2
+
+    directory = tempfile.mkdtemp()
+    try:
+        index = duplicates.DuplicateIndex(os.path.join(directory, 'sample'))
+        index.add(reviews[:args.pairwise])
+        labels = index.labels
+        found = set((i, j) for i, j in expected if labels[i] == labels[j])
+        clustered = sum(1 for i in range(len(labels)) for j in range(i + 1, len(labels)) if labels[i] == labels[j])
+        print('%d of %d pairs at least %.0f%% similar among the first %d reviews are in a cluster, %d pairs in '
+              'clusters' % (len(found), len(expected), 100 * threshold, args.pairwise, clustered))
+
+        index = duplicates.DuplicateIndex(os.path.join(directory, 'index'))
+        start = time.perf_counter()
+        index.add(reviews[:args.reviews])
+        build_seconds = time.perf_counter() - start
+        index = duplicates.DuplicateIndex(os.path.join(directory, 'index'))
+        start = time.perf_counter()
+        added = index.add(reviews)
+        add_seconds = time.perf_counter() - start
+        clusters = index.clusters()
+        print('%d reviews in %d clusters, %d reviewers with copies at other restaurants' % (
+            len(clusters), clusters['cluster'].nunique(), len(duplicates.cross_restaurant_reviewers(clusters))))
+    finally:
+        shutil.rmtree(directory)
+
+    print('%-36s %10s' % ('', 'seconds'))
+    print('%-36s %10.1f' % ('all pairs of %d reviews (estimated)' % args.reviews, all_pairs_seconds))
+    print('%-36s %10.1f' % ('DuplicateIndex of %d reviews' % args.reviews, build_seconds))
+    print('%-36s %10.1f' % ('adding %d new reviews' % added, add_seconds))
+
+
+if __name__ == '__main__':
+    main()
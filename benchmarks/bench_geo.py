@@ -0,0 +1,107 @@
+'''
+Time of a radius query with a rating filter over synthetic restaurants around Amsterdam, for a distance per
+restaurant (the loop of plot_map in the show_and_select notebook, with geopy when it is installed and a haversine
+otherwise) and for the GeoIndex, next to its nearest and bounding box queries:
+$ python benchmarks/bench_geo.py --restaurants 20000 --queries 1000
+
+The results of the GeoIndex are checked against a haversine distance to every restaurant.
+'''
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scrape_save_search'))
+
+import numpy as np
+
+import geo
+
+TAGS = ['Frans', 'Italiaans', 'Romantisch', 'Hamburger', 'Vegetarisch', 'Terras', 'Groepen', 'Lunch', 'Vis']
+CENTER = (52.37, 4.89)
+
+
+def synthetic_restaurant(i, rng):
+    return {
+        'info': {'id': i, 'lat': CENTER[0] + rng.gauss(0, 0.05), 'lon': CENTER[1] + rng.gauss(0, 0.08),
+                 'avg_price': rng.choice([None, rng.randint(10, 80)])},
+        'reviews': {'rating': round(rng.uniform(5, 10), 1), 'rating_food': round(rng.uniform(5, 10), 1),
+                    'rating_service': None, 'rating_decor': None, 'nr_ratings': rng.randint(0, 500)},
+        'tags': rng.sample(TAGS, rng.randint(0, 4)),
+    }
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * geo.EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def distance_per_restaurant(restaurants, center, km, min_rating_food):
+    try:
+        import geopy.distance
+        distance = lambda a, b: geopy.distance.great_circle(a, b).km
+    except ImportError:
+        distance = lambda a, b: float(haversine_km(a[0], a[1], b[0], b[1]))
+    return [r['info']['id'] for r in restaurants
+            if r['reviews']['rating_food'] >= min_rating_food
+            and distance(center, (r['info']['lat'], r['info']['lon'])) <= km]
+
+
+def timed(function, queries):
+    start = time.perf_counter()
+    results = [function(query) for query in queries]
+    return (time.perf_counter() - start) / len(queries), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--restaurants', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--km', type=float, default=1.5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    restaurants = [synthetic_restaurant(i, rng) for i in range(args.restaurants)]
+    queries = [(CENTER[0] + rng.gauss(0, 0.03), CENTER[1] + rng.gauss(0, 0.05)) for _ in range(args.queries)]
+
+    start = time.perf_counter()
+    index = geo.from_restaurants(restaurants)
+    path = os.path.join(tempfile.mkdtemp(), 'restaurants.geo.npz')
+    index.save(path)
+    print('%d restaurants indexed and saved in %.3fs' % (len(index), time.perf_counter() - start))
+    start = time.perf_counter()
+    index = geo.GeoIndex.load(path)
+    print('loaded in %.3fs' % (time.perf_counter() - start))
+
+    # the loop is slow, so it gets a few of the queries
+    loop_seconds, expected = timed(lambda q: distance_per_restaurant(restaurants, q, args.km, 8), queries[:10])
+    radius_seconds, found = timed(lambda q: index.radius(q[0], q[1], args.km, min_rating_food=8)[0], queries)
+    assert all(sorted(a) == sorted(b) for a, b in zip(expected, found)), 'radius queries differ'
+    nearest_seconds, _ = timed(lambda q: index.nearest(q[0], q[1], 10, max_avg_price=30, tags=['Terras']), queries)
+    bbox_seconds, _ = timed(lambda q: index.bbox(q[0] - 0.01, q[1] - 0.02, q[0] + 0.01, q[1] + 0.02,
+                                                 min_rating=7), queries)
+
+    # nearest and bbox against a distance to every restaurant
+    lat, lon = index.lat, index.lon
+    for q in queries[:50]:
+        ids, km = index.nearest(q[0], q[1], 10, max_avg_price=30, tags=['Terras'])
+        passes = (index.columns['avg_price'] <= 30) & index.tag_mask('Terras')
+        distances = haversine_km(q[0], q[1], lat[passes], lon[passes])
+        assert np.allclose(np.sort(distances)[:10], km), 'nearest queries differ'
+        inside = (lat >= q[0] - 0.01) & (lat <= q[0] + 0.01) & (lon >= q[1] - 0.02) & (lon <= q[1] + 0.02)
+        expected = index.ids[inside & (index.columns['rating'] >= 7)]
+        assert sorted(expected) == sorted(index.bbox(q[0] - 0.01, q[1] - 0.02, q[0] + 0.01, q[1] + 0.02,
+                                                     min_rating=7)), 'bbox queries differ'
+
+    print('%-32s %12s' % ('', 'per query'))
+    for name, seconds in [('distance per restaurant, radius', loop_seconds), ('GeoIndex radius', radius_seconds),
+                          ('GeoIndex nearest 10', nearest_seconds), ('GeoIndex bbox', bbox_seconds)]:
+        print('%-32s %10.1fus' % (name, seconds * 1e6))
+
+
+if __name__ == '__main__':
+    main()
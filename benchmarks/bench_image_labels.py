@@ -0,0 +1,132 @@
+'''
+Time to label the images of a snapshot of restaurants, against a local image server and a stand-in for the Vision
+API that takes a fixed time per request plus a time per image:
+$ python benchmarks/bench_image_labels.py --restaurants 300 --images 4 --request-seconds 0.5 --new 0.1
+
+Compares one request per restaurant after each other (the loop of the vision-api notebook) with the ImageLabeler,
+for a first run with an empty cache and for a run on the next snapshot, of which a fraction --new of the images is
+new and the rest was labeled in the first run. A last run labels the next snapshot again after a fraction --new of
+its images was replaced under the same url, which have to be labeled again.
+'''
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scrape_save_search'))
+
+import pandas as pd
+
+import image_labels
+
+
+class ImageServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # paths of the images that were replaced by another image
+    replaced = set()
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        seed = self.path + ('-replaced' if self.path in self.server.replaced else '')
+        etag = '"%s"' % seed
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = random.Random(seed).getrandbits(8 * 30000).to_bytes(30000, 'little')
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SlowBackend(image_labels.MockBackend):
+    # the MockBackend, in the time a request to the Vision API would take
+
+    def __init__(self, request_seconds, image_seconds):
+        super(SlowBackend, self).__init__()
+        self.request_seconds = request_seconds
+        self.image_seconds = image_seconds
+        self.requests = 0
+
+    def label(self, contents):
+        self.requests += 1
+        time.sleep(self.request_seconds + self.image_seconds * len(contents))
+        return super(SlowBackend, self).label(contents)
+
+
+def snapshot(address, restaurants, images, new, seed):
+    '''A row per image of every restaurant, of which the fraction new has an image that isn't in the first snapshot'''
+    rng = random.Random(seed)
+    return pd.DataFrame([
+        (i, '%s/photos/%d/%d%s.jpg' % (address, i, j, '-%d' % seed if rng.random() < new else ''))
+        for i in range(restaurants) for j in range(images)
+    ], columns=['info_id', 'image_urls'])
+
+
+def serial(backend, restaurants):
+    '''One request per restaurant, waiting for each, like the notebook'''
+    for _, urls in restaurants.groupby('info_id')['image_urls']:
+        backend.label([image_labels.download(url, 30)[0] for url in list(urls)[:16]])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--restaurants', type=int, default=300)
+    parser.add_argument('--images', type=int, default=4, help='images per restaurant')
+    parser.add_argument('--request-seconds', type=float, default=0.5)
+    parser.add_argument('--image-seconds', type=float, default=0.02)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=10, help='requests per second')
+    parser.add_argument('--new', type=float, default=0.1, help='fraction of new images in the next snapshot')
+    args = parser.parse_args()
+
+    server = ImageServer(('127.0.0.1', 0), ImageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    address = 'http://127.0.0.1:%d' % server.server_port
+    first = snapshot(address, args.restaurants, args.images, 0.0, 0)
+    second = snapshot(address, args.restaurants, args.images, args.new, 1)
+    print('%d restaurants with %d images, %.2fs + %.2fs per image per request' % (
+        args.restaurants, args.images, args.request_seconds, args.image_seconds))
+
+    backend = SlowBackend(args.request_seconds, args.image_seconds)
+    start = time.perf_counter()
+    serial(backend, first)
+    print('request per restaurant:   %6.1fs  %4d requests' % (time.perf_counter() - start, backend.requests))
+
+    directory = tempfile.mkdtemp()
+    replaced = second['image_urls'].sample(frac=args.new, random_state=2)
+    for name, restaurants in [('labeler, first snapshot', first), ('labeler, next snapshot', second),
+                              ('labeler, replaced images', second)]:
+        if name == 'labeler, replaced images':
+            server.replaced.update(url[len(address):] for url in replaced)
+        backend = SlowBackend(args.request_seconds, args.image_seconds)
+        labeler = image_labels.ImageLabeler(backend, os.path.join(directory, 'labels.sqlite'), workers=args.workers,
+                                            rate=args.rate)
+        start = time.perf_counter()
+        labels = labeler.label(restaurants['image_urls'])
+        print('%-25s %6.1fs  %4d requests  %d images labeled' % (
+            name + ':', time.perf_counter() - start, backend.requests, len(labels)))
+    # the labels of the mock backend only depend on the content, so the replaced images have the labels of theirs
+    expected = backend.label([image_labels.download(url, 30)[0] for url in replaced])
+    if [labels[url] for url in replaced] != [annotations for annotations, _ in expected]:
+        sys.exit('The replaced images kept the labels of the images they replaced')
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
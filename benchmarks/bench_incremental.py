@@ -0,0 +1,140 @@
+'''
+Checks the incremental mode of the spiders against the offline fixture corpus (see record_fixtures.py):
+$ python benchmarks/bench_incremental.py
+
+Every spider crawls the fixtures with -a incremental=true, following its requests to the recorded pages. The first
+run with an empty index has to give the items of a full crawl, and a second run has to skip every restaurant. For the
+spiders that walk the review pages, a run in which a review page fails followed by a run in which nothing fails has
+to give all reviews, after which a run skips everything again. Reports the pages and items of every run, and fails
+when one of the checks does.
+'''
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scraper'))
+
+from scrapy.http import HtmlResponse, Request
+from scraper.spiders.comments_spider import CommentsSpider
+from scraper.spiders.iens_spider import IensSpider
+from scraper.spiders.restaurant_spider import RestaurantSpider
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, 'fixtures')
+
+SPIDERS = {
+    'restaurant_spider': (RestaurantSpider, {}),
+    'comments_spider': (CommentsSpider, {}),
+    'iens_spider': (IensSpider, {}),
+    'iens_spider comments=false': (IensSpider, {'comments': 'false'}),
+}
+
+# the spiders that walk the review pages of a restaurant
+WALKING_SPIDERS = ['comments_spider', 'iens_spider']
+
+
+def load_pages():
+    pages = {}
+    manifest = os.path.join(FIXTURES_DIR, 'manifest.jsonlines')
+    if not os.path.exists(manifest):
+        sys.exit('No fixture corpus in %s, record one with record_fixtures.py' % FIXTURES_DIR)
+    with open(manifest) as f:
+        for line in f:
+            page = json.loads(line)
+            with open(os.path.join(FIXTURES_DIR, page['file']), 'rb') as html:
+                pages[page['url']] = html.read()
+    return pages
+
+
+def crawl(spider, pages, failing=()):
+    '''
+    Crawls the recorded pages from the first listing page, as the engine would, and returns the items as json and the
+    number of pages parsed. Requests for the failing urls (and for pages that weren't recorded) get no response.
+    '''
+    start_url = next(url for url in pages if '/restaurant+' in url and 'page=' not in url)
+    queue = [Request(start_url, callback=spider.parse)]
+    seen = set()
+    items = []
+    nr_pages = 0
+    while queue:
+        request = queue.pop(0)
+        if request.url in seen or request.url in failing or request.url not in pages:
+            continue
+        seen.add(request.url)
+        nr_pages += 1
+        response = HtmlResponse(url=request.url, body=pages[request.url], encoding='utf-8', request=request)
+        for output in request.callback(response) or []:
+            if isinstance(output, Request):
+                queue.append(output)
+            else:
+                items.append(json.dumps(output.to_dict(), sort_keys=True, default=str))
+    spider.closed('finished')
+    return items, nr_pages
+
+
+def run_spider(name, pages, directory):
+    '''Runs the checks of a spider, returns a list of (run, pages, items, seconds) and the checks that failed'''
+    spider_class, arguments = SPIDERS[name]
+    runs = []
+    failures = []
+
+    def run(label, index, failing=()):
+        start = time.perf_counter()
+        if index is None:
+            spider = spider_class(placename='diemen', **arguments)
+        else:
+            spider = spider_class(placename='diemen', incremental='true', index=os.path.join(directory, index),
+                                  **arguments)
+        items, nr_pages = crawl(spider, pages, failing)
+        runs.append((label, nr_pages, len(items), time.perf_counter() - start))
+        return items
+
+    full = run('full crawl', None)
+    if not full:
+        failures.append('the full crawl gave no items')
+    first = run('first run', name + '.sqlite')
+    if sorted(first) != sorted(full):
+        failures.append('the first run gave %d items instead of the %d of the full crawl' % (len(first), len(full)))
+    again = run('second run', name + '.sqlite')
+    if again:
+        failures.append('the second run gave %d items instead of none' % len(again))
+
+    if name in WALKING_SPIDERS:
+        # the second page of reviews of the first restaurant that has one fails
+        failing = [sorted(url for url in pages if '?page=' in url and '/restaurant/' in url)[0]]
+        index = name + '_failing.sqlite'
+        failed = run('run with %s failing' % failing[0].split('/')[-1], index, failing)
+        retried = run('run after the failure', index)
+        if set(full) - set(failed + retried):
+            failures.append('%d items are lost after a failed review page' % len(set(full) - set(failed + retried)))
+        again = run('run after that', index)
+        if again:
+            failures.append('the run after the retry gave %d items instead of none' % len(again))
+    return runs, failures
+
+
+def main():
+    pages = load_pages()
+    directory = tempfile.mkdtemp()
+    failed = False
+    try:
+        print('%-28s %-36s %6s %6s %8s' % ('spider', 'run', 'pages', 'items', 'seconds'))
+        for name in SPIDERS:
+            runs, failures = run_spider(name, pages, directory)
+            for label, nr_pages, nr_items, seconds in runs:
+                print('%-28s %-36s %6d %6d %8.3f' % (name, label, nr_pages, nr_items, seconds))
+            for failure in failures:
+                print('%s: %s' % (name, failure))
+            failed = failed or bool(failures)
+    finally:
+        shutil.rmtree(directory)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
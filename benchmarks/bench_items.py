@@ -0,0 +1,91 @@
+'''
+Memory per restaurant item, for the nested dicts the spiders used to yield, the records of items.py and the
+ColumnStore the ParquetExportPipeline collects them in, and the time to turn a batch of items into an Arrow table
+from a list of dicts and from the ColumnStore:
+$ python benchmarks/bench_items.py --items 50000
+'''
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scraper'))
+
+import pyarrow as pa
+
+from bench_parquet_export import synthetic_item
+from scraper.items import Restaurant, RestaurantInfo, RestaurantReviews
+from scraper.schemas import coerce_value, table_schema, to_arrow_schema
+from scraper.store import ColumnStore
+
+
+def to_record(item):
+    return Restaurant(info=RestaurantInfo(**item['info']), reviews=RestaurantReviews(**item['reviews']),
+                      tags=item['tags'], image_urls=item['image_urls'])
+
+
+def measure(create):
+    '''Bytes allocated by what create returns, and the result'''
+    gc.collect()
+    tracemalloc.start()
+    result = create()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, result
+
+
+def dicts_to_arrow(items, schema, arrow_schema):
+    # the rows of dicts of the schema fields that the ParquetExportPipeline used to buffer
+    def coerce(value, field):
+        if field.get('mode', '').lower() == 'repeated':
+            return [coerce(v, dict(field, mode='nullable')) for v in value or []]
+        if field['type'] == 'record' and value is not None:
+            return dict((f['name'], coerce(value.get(f['name']), f)) for f in field['fields'])
+        return coerce_value(value, field)
+    rows = [dict((field['name'], coerce(item.get(field['name']), field)) for field in schema) for item in items]
+    columns = [pa.array([row[field.name] for row in rows], type=field.type) for field in arrow_schema]
+    return pa.Table.from_arrays(columns, schema=arrow_schema)
+
+
+def fill_store(items, schema):
+    store = ColumnStore(schema)
+    for item in items:
+        store.append(item)
+    return store
+
+
+def store_to_arrow(items, schema, arrow_schema):
+    return fill_store(items, schema).to_arrow(arrow_schema)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=50000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    items = [synthetic_item(i, rng) for i in range(args.items)]
+    schema = table_schema('iens')
+    arrow_schema = to_arrow_schema(schema)
+
+    # the tags and image url strings are shared by all three, so they only count the containers
+    dict_size, dicts = measure(lambda: [dict(item, info=dict(item['info']), reviews=dict(item['reviews']))
+                                        for item in items])
+    record_size, records = measure(lambda: [to_record(item) for item in items])
+    store_size, store = measure(lambda: fill_store(records, schema))
+    print('%-12s %12s' % ('', 'bytes/item'))
+    for name, size in [('dicts', dict_size), ('records', record_size), ('ColumnStore', store_size)]:
+        print('%-12s %12.0f' % (name, size / args.items))
+
+    for name, to_arrow, batch in [('dicts', dicts_to_arrow, dicts), ('ColumnStore', store_to_arrow, records)]:
+        start = time.perf_counter()
+        table = to_arrow(batch, schema, arrow_schema)
+        print('%-12s %8.3fs to an Arrow table of %d rows' % (name, time.perf_counter() - start, table.num_rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+'''
+Compares the Parquet export with the jsonlines feed on synthetic restaurant items: file size, and the time to
+load the file into pandas.
+$ python benchmarks/bench_parquet_export.py --items 50000
+'''
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scraper'))
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from scraper.pipelines import ParquetExportPipeline
+
+TAGS = ['Frans', 'Italiaans', 'Romantisch', 'Hamburger', 'Vegetarisch', 'Terras', 'Groepen', 'Lunch', 'Vis']
+
+
+class Spider(object):
+    name = 'restaurant_spider'
+
+
+def synthetic_item(i, rng):
+    tags = rng.sample(TAGS, rng.randint(0, 5))
+    image_urls = ['https://u.tfstatic.com/restaurant_photos/%d/%d.jpg' % (i, n) for n in range(rng.randint(0, 16))]
+    return {
+        'info': {'id': i, 'name': 'Restaurant %d' % i, 'lat': 52.3 + rng.random() / 10, 'lon': 4.9 + rng.random() / 10,
+                 'street': 'Straat%d' % rng.randint(1, 500), 'house_number': str(rng.randint(1, 200)),
+                 'postal_code': '10%02dAB' % rng.randint(0, 99), 'city': 'Amsterdam', 'country': 'Nederland',
+                 'avg_price': rng.randint(10, 80), 'nr_tags': len(tags), 'nr_images': len(image_urls)},
+        'reviews': {'distinction': rng.choice(['', 'Top 100']), 'rating': round(rng.uniform(5, 10), 1),
+                    'nr_ratings': rng.randint(0, 1000), 'nr_10ratings': rng.randint(0, 100),
+                    'nr_9ratings': rng.randint(0, 100), 'nr_8ratings': rng.randint(0, 100),
+                    'nr_7ratings': rng.randint(0, 100), 'nr_7min_ratings': rng.randint(0, 100),
+                    'rating_food': round(rng.uniform(5, 10), 1), 'rating_service': round(rng.uniform(5, 10), 1),
+                    'rating_decor': round(rng.uniform(5, 10), 1), 'price_quality': rng.choice(['Goed', 'Redelijk']),
+                    'noise_level': rng.choice(['Rustig', 'Gemiddeld', 'Luid']), 'waiting_time': 'Kort'},
+        'tags': tags,
+        'image_urls': image_urls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=50000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    directory = tempfile.mkdtemp()
+    jsonlines_path = os.path.join(directory, 'items.jsonlines')
+    parquet_path = os.path.join(directory, 'items.parquet')
+
+    pipeline = ParquetExportPipeline(parquet_path, args.batch_size)
+    pipeline.open_spider(Spider())
+    with open(jsonlines_path, 'w') as f:
+        for i in range(args.items):
+            item = synthetic_item(i, rng)
+            f.write(json.dumps(item) + '\n')
+            pipeline.process_item(item, Spider())
+    pipeline.close_spider(Spider())
+
+    start = time.perf_counter()
+    pd.read_json(jsonlines_path, lines=True)
+    jsonlines_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    pq.read_table(parquet_path).to_pandas()
+    parquet_seconds = time.perf_counter() - start
+
+    print('%-10s %10s %10s' % ('', 'size (MB)', 'load (s)'))
+    for name, path, seconds in [('jsonlines', jsonlines_path, jsonlines_seconds),
+                                ('parquet', parquet_path, parquet_seconds)]:
+        print('%-10s %10.1f %10.3f' % (name, os.path.getsize(path) / 1e6, seconds))
+
+
+if __name__ == '__main__':
+    main()
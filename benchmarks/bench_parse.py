@@ -0,0 +1,152 @@
+'''
+Parse-throughput benchmark of the spiders over the offline fixture corpus (see record_fixtures.py):
+$ python benchmarks/bench_parse.py
+$ python benchmarks/bench_parse.py --update-golden
+
+Every recorded page is fed to the spider callbacks as a HtmlResponse. Reports pages/s and items/s per callback,
+the time spent in the extraction functions of the spider modules, and the peak RSS of the process. The items and
+followed urls are compared with the golden jsonlines files, and the benchmark fails when they drift.
+'''
+
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import resource
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scraper'))
+
+from scrapy.http import HtmlResponse, Request
+from scraper.spiders.comments_spider import CommentsSpider
+from scraper.spiders.iens_spider import IensSpider
+from scraper.spiders.restaurant_spider import RestaurantSpider
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, 'fixtures')
+GOLDEN_DIR = os.path.join(BENCHMARKS_DIR, 'golden')
+
+SPIDERS = {
+    'restaurant_spider': lambda: RestaurantSpider(placename='amsterdam'),
+    'comments_spider': lambda: CommentsSpider(placename='amsterdam'),
+    'iens_spider': lambda: IensSpider(placename='amsterdam'),
+}
+
+# callbacks that get the pages of each kind of fixture
+CALLBACKS = {
+    'listing': [('restaurant_spider', 'parse'), ('comments_spider', 'parse'), ('iens_spider', 'parse')],
+    'restaurant': [('restaurant_spider', 'parse_restaurant'), ('comments_spider', 'parse_restaurant'),
+                   ('iens_spider', 'parse_restaurant')],
+    'reviews': [('comments_spider', 'parse_reviews'), ('iens_spider', 'parse_reviews')],
+}
+
+
+def load_fixtures():
+    fixtures = []
+    manifest = os.path.join(FIXTURES_DIR, 'manifest.jsonlines')
+    if not os.path.exists(manifest):
+        sys.exit('No fixture corpus in %s, record one with record_fixtures.py' % FIXTURES_DIR)
+    with open(manifest) as f:
+        for line in f:
+            page = json.loads(line)
+            with open(os.path.join(FIXTURES_DIR, page['file']), 'rb') as html:
+                page['response'] = HtmlResponse(url=page['url'], body=html.read(), encoding='utf-8')
+            fixtures.append(page)
+    return fixtures
+
+
+def to_record(page, spider_name, callback, output):
+    record = {'file': page['file'], 'spider': spider_name, 'callback': callback}
+    if isinstance(output, Request):
+        record['request'] = output.url
+    else:
+        record['item'] = output.to_dict()
+    return json.dumps(record, sort_keys=True, default=str)
+
+
+def run(fixtures, repeat):
+    spiders = {name: create() for name, create in SPIDERS.items()}
+    records = {kind: [] for kind in CALLBACKS}
+    timings = {}
+    for kind, callbacks in CALLBACKS.items():
+        pages = [page for page in fixtures if page['kind'] == kind]
+        for spider_name, callback in callbacks:
+            parse = getattr(spiders[spider_name], callback)
+            nr_items = 0
+            start = time.perf_counter()
+            for i in range(repeat):
+                for page in pages:
+                    for output in parse(page['response']):
+                        if i == 0:
+                            records[kind].append(to_record(page, spider_name, callback, output))
+                        nr_items += not isinstance(output, Request)
+            timings[(spider_name, callback, kind)] = (len(pages) * repeat, nr_items, time.perf_counter() - start)
+    return records, timings
+
+
+def compare_golden(records, update):
+    drifted = False
+    for kind, lines in records.items():
+        path = os.path.join(GOLDEN_DIR, kind + '.jsonlines')
+        if update:
+            with open(path, 'w') as f:
+                f.writelines(line + '\n' for line in lines)
+            continue
+        # without a golden file there is nothing to compare with, which is a failure rather than a pass
+        if not os.path.exists(path):
+            print('No golden file for %s, run with --update-golden' % kind)
+            drifted = True
+            continue
+        with open(path) as f:
+            golden = [line.rstrip('\n') for line in f]
+        if golden != lines:
+            drifted = True
+            diff = next((i for i, (a, b) in enumerate(zip(golden, lines)) if a != b), min(len(golden), len(lines)))
+            print('Output for %s drifted from golden at record %d (%d golden, %d now):' %
+                  (kind, diff, len(golden), len(lines)))
+            print('  golden: %s' % (golden[diff] if diff < len(golden) else None))
+            print('  now:    %s' % (lines[diff] if diff < len(lines) else None))
+    return drifted
+
+
+def print_report(timings, profile):
+    print('%-20s %-18s %-11s %8s %10s %10s' % ('spider', 'callback', 'fixtures', 'pages', 'pages/s', 'items/s'))
+    for (spider_name, callback, kind), (nr_pages, nr_items, seconds) in timings.items():
+        if nr_pages:
+            print('%-20s %-18s %-11s %8d %10.1f %10.1f' %
+                  (spider_name, callback, kind, nr_pages, nr_pages / seconds, nr_items / seconds))
+
+    print('\nextraction time per function (cumulative):')
+    stats = pstats.Stats(profile).stats
+    spider_functions = [(cumtime, ncalls, name) for (path, _, name), (_, ncalls, _, cumtime, _) in stats.items()
+                        if os.sep + 'spiders' + os.sep in path]
+    for cumtime, ncalls, name in sorted(spider_functions, reverse=True):
+        print('  %-28s %9d calls %9.3f s' % (name, ncalls, cumtime))
+
+    # ru_maxrss is in kilobytes on Linux
+    print('\npeak RSS: %.1f MB' % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--update-golden', action='store_true', help='overwrite the golden files with this output')
+    args = parser.parse_args()
+
+    fixtures = load_fixtures()
+    records, timings = run(fixtures, args.repeat)
+    # profile a separate pass so the profiler overhead doesn't end up in the throughput numbers
+    profile = cProfile.Profile()
+    profile.enable()
+    run(fixtures, 1)
+    profile.disable()
+
+    print_report(timings, profile)
+    if compare_golden(records, args.update_golden):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
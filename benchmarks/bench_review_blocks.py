@@ -0,0 +1,80 @@
+'''
+Micro-benchmark for parsing the review blocks of saved restaurant pages.
+Compares the old per-field parsing of CommentsSpider.parse_reviews with parse_review_block:
+$ python benchmarks/bench_review_blocks.py benchmarks/fixtures/reviews
+'''
+
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scraper'))
+
+from scrapy.http import HtmlResponse
+from scraper.spiders.comments_spider import (parse_review_block, get_comment, is_certified, get_date, get_reviewer,
+                                             get_rating)
+
+REVIEW_BLOCKS = '//div[@class="reviewItem reviewItem--mainCustomer"]'
+
+
+def legacy_parse_review_block(comment_block, restaurant_id, restaurant_name):
+    # the parsing as it was done before parse_review_block, kept as a baseline
+    comment = get_comment(comment_block.extract())
+    comment = re.sub('\n', ' ', comment)
+    comment = re.sub('<br>', ' ', comment).strip()
+    certified = is_certified(comment_block.extract())
+    date = get_date(comment_block.extract())
+    reviewer = get_reviewer(comment_block.extract()).strip()
+    rating = float(get_rating(comment_block.extract()).replace(',', '.'))
+    return {'id': restaurant_id, 'name': restaurant_name, 'comment': comment,
+            'reviewer': reviewer, 'date': date, 'reserved_online': certified, 'rating': rating,
+            'rating_food': int(comment_block.xpath('descendant::span[contains(text(), "Eten")]/' +
+                                                   'following::*/@data-score').extract_first()),
+            'rating_service': int(comment_block.xpath('descendant::span[contains(text(), "Service")]/' +
+                                                      'following::*/@data-score').extract_first()),
+            'rating_decor': int(comment_block.xpath('descendant::span[contains(text(), "Decor")]/' +
+                                                    'following::*/@data-score').extract_first())}
+
+
+def load_blocks(directory):
+    blocks = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.html'))):
+        with open(path, 'rb') as f:
+            response = HtmlResponse(url='https://www.iens.nl/restaurant/0', body=f.read(), encoding='utf-8')
+        blocks.extend(response.xpath(REVIEW_BLOCKS))
+    return blocks
+
+
+def time_parser(parser, blocks, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for block in blocks:
+            parser(block, 0, 'name')
+    return len(blocks) * repeat / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('directory', help='directory with saved restaurant pages (*.html)')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    blocks = load_blocks(args.directory)
+    if not blocks:
+        sys.exit('No review blocks found in %s' % args.directory)
+    for block in blocks:
+        if parse_review_block(block, 0, 'name') != legacy_parse_review_block(block, 0, 'name'):
+            sys.exit('Output differs for block:\n%s' % block.extract())
+
+    before = time_parser(legacy_parse_review_block, blocks, args.repeat)
+    after = time_parser(parse_review_block, blocks, args.repeat)
+    print('%d review blocks' % len(blocks))
+    print('before: %10.0f blocks/s' % before)
+    print('after:  %10.0f blocks/s (%.1fx)' % (after, after / before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+'''
+Wall-clock time of crawling a batch of cities with the scheduler (scraper/scraper/scheduler.py) for a number of
+processes, against a local stand-in for iens.nl with a fixed latency per page:
+$ python benchmarks/bench_scheduler.py --cities 8 --restaurants 40 --processes 1 2 4 8 --concurrency 16
+
+Every crawl runs with a small per-process concurrency, so the time goes down with the number of processes until
+the shared politeness budget (--concurrency requests in flight over all processes) is reached. The most requests
+the site had in flight at once is reported as well, which should never be more than the budget.
+'''
+
+import argparse
+import os
+import shutil
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scraper'))
+
+import scrapy
+from scraper import scheduler
+from scraper.spiders.iens_spider import IensSpider
+
+RESTAURANT_PAGE = '''<html><body><h1 class="restaurantSummary-name">Restaurant %(id)d</h1>
+<span class="reviewsCount">12 reviews</span>
+<div class="restaurant-map"><div data-gps-lat="52.37" data-gps-lng="4.89"></div></div>
+<ul id="restaurantTagContainer"><li>Frans</li><li>...</li></ul>
+<div class="rating rating--big"><span class="rating-ratingValue">8,2</span></div>
+</body></html>'''
+
+
+class MockSite(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, restaurants, latency):
+        HTTPServer.__init__(self, address, MockSiteHandler)
+        self.restaurants = restaurants
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def enter(self):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+
+class MockSiteHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.enter()
+        try:
+            time.sleep(self.server.latency)
+            if self.path.startswith('/restaurant+'):
+                city = sum(map(ord, self.path))
+                body = '<html><body><ul>%s</ul></body></html>' % ''.join(
+                    '<li class="resultItem"><div><h3><a href="/restaurant/%d">r</a></h3></div></li>' %
+                    (city * 1000 + i) for i in range(self.server.restaurants))
+            else:
+                body = RESTAURANT_PAGE % {'id': int(self.path.split('/')[-1])}
+            body = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            self.server.leave()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockSiteSpider(IensSpider):
+    # iens_spider, starting at the listing page of its city on the mock site of which the address is in MOCK_SITE
+
+    def start_requests(self):
+        yield scrapy.Request('%s/restaurant+%s' % (self.settings.get('MOCK_SITE'), self.placename))
+
+    async def start(self):
+        for request in self.start_requests():
+            yield request
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cities', type=int, default=8)
+    parser.add_argument('--restaurants', type=int, default=40, help='restaurants per city')
+    parser.add_argument('--latency', type=float, default=0.1, help='seconds per page')
+    parser.add_argument('--per-process', type=int, default=2, help='concurrency of each crawl')
+    parser.add_argument('--processes', type=int, nargs='*', default=[1, 2, 4, 8])
+    parser.add_argument('--concurrency', type=int, default=16, help='politeness budget over all processes')
+    args = parser.parse_args()
+
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scraper'))
+
+    site = MockSite(('127.0.0.1', 0), args.restaurants, args.latency)
+    threading.Thread(target=site.serve_forever, daemon=True).start()
+    settings = {
+        'MOCK_SITE': 'http://127.0.0.1:%d' % site.server_port,
+        'ROBOTSTXT_OBEY': False,
+        'ADAPTIVE_CONCURRENCY_ENABLED': False,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': args.per_process,
+        'PARQUET_EXPORT_URI': None,
+    }
+    cities = ['city%d' % i for i in range(args.cities)]
+    print('%d cities of %d restaurants, %.2fs per page, %d requests per process, budget of %d' % (
+        args.cities, args.restaurants, args.latency, args.per_process, args.concurrency))
+    for processes in args.processes:
+        output = tempfile.mkdtemp()
+        site.max_in_flight = 0
+        start = time.perf_counter()
+        job_state = scheduler.run(cities, output, '20180101', processes, args.concurrency, spider=MockSiteSpider,
+                                  spider_args={'comments': 'false'}, settings=settings)
+        duration = time.perf_counter() - start
+        items = sum(job_state.cities[city].get('items', 0) for city in cities)
+        failed = [city for city in cities if job_state.cities[city]['status'] != 'done']
+        print('%2d processes: %6.1fs  %5d items  at most %2d requests in flight%s' % (
+            processes, duration, items, site.max_in_flight, '  failed: %s' % failed if failed else ''))
+        shutil.rmtree(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+'''
+Benchmark for the search index of scrape_save_search/search.py on a synthetic comments feed.
+Compares term and phrase queries with scanning the comments like search_for_word of the analysis notebook does:
+$ python benchmarks/bench_search.py --reviews 1000000
+'''
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scrape_save_search'))
+
+import search
+
+WORDS = ('lekker eten goed bediening vriendelijk burger hamburgers friet saus vlees vis wijn prijs kwaliteit sfeer '
+         'gezellig druk rustig slecht koud warm personeel toetje voorgerecht hoofdgerecht zeker terug aanrader '
+         'ober café crème brûlée zalm biefstuk salade soep brood kip à-la-carte chef\'s keuken').split()
+FILLER = 'de het een en was niet van we zijn heel erg ook maar wel'.split()
+QUERIES = ['burger', 'slecht', 'crème brûlée', 'lekker eten', 'niet lekker']
+
+
+def write_comments(path, n, seed=0):
+    rng = np.random.RandomState(seed)
+    vocabulary = np.array(WORDS + FILLER, dtype=object)
+    weights = np.concatenate([np.full(len(WORDS), 1.0), np.full(len(FILLER), 4.0)])
+    weights /= weights.sum()
+    with open(path, 'w') as f:
+        for i in range(n):
+            comment = ' '.join(vocabulary[rng.choice(len(vocabulary), rng.randint(5, 60), p=weights)])
+            f.write(json.dumps({'id': int(rng.randint(1, n // 20 + 2)), 'name': 'restaurant', 'comment': comment,
+                                'reviewer': 'reviewer %d' % rng.randint(n), 'date': '2018-01-01',
+                                'rating': float(rng.randint(1, 11))}) + '\n')
+
+
+def scan(comments, query, phrase):
+    # a search the way the analysis notebook does it, over the analyzed comments so the results are comparable
+    if phrase:
+        terms = list(search.analyze(query))
+        first = terms[0][0]
+        pattern = [(position - first, term) for position, term in terms]
+        def matches(comment):
+            positions = {}
+            for position, term in search.analyze(comment):
+                positions.setdefault(term, set()).add(position)
+            return any(all(start + offset in positions.get(term, ()) for offset, term in pattern)
+                       for start in positions.get(terms[0][1], ()))
+    else:
+        query_terms = {term for _, term in search.analyze(query)}
+        def matches(comment):
+            return any(term in query_terms for _, term in search.analyze(comment))
+    return np.flatnonzero(comments['comment'].apply(matches).values)
+
+
+def time_query(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--reviews', type=int, default=200000)
+    parser.add_argument('--ngrams', action='store_true', help='also build and query the n-gram index')
+    parser.add_argument('--scan', type=int, default=50000, help='number of reviews to compare the results on')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    comments_path = os.path.join(directory, 'comments.jsonlines')
+    write_comments(comments_path, args.reviews)
+
+    start = time.perf_counter()
+    search.build_index(comments_path, os.path.join(directory, 'index'), ngrams=args.ngrams)
+    print('%d reviews (%.1f MB), index built in %.1fs (%.1f MB)' % (
+        args.reviews, os.path.getsize(comments_path) / 1e6, time.perf_counter() - start,
+        directory_size(os.path.join(directory, 'index')) / 1e6))
+    start = time.perf_counter()
+    index = search.SearchIndex(os.path.join(directory, 'index'))
+    print('index opened in %.1fms' % ((time.perf_counter() - start) * 1e3))
+
+    comments = pd.read_json(comments_path, lines=True, nrows=args.scan)
+    for query in QUERIES:
+        for phrase in (False, True):
+            duration, (docs, scores) = time_query(
+                lambda: index.phrase(query) if phrase else index.match(query), args.repeat)
+            scan_duration, expected = time_query(lambda: scan(comments, query, phrase), 1)
+            if not np.array_equal(docs[docs < args.scan], expected):
+                sys.exit('Results differ for %r (phrase=%s)' % (query, phrase))
+            print('%-14r phrase=%-5s %7d hits  index: %7.2fms  scan of %d reviews: %7.0fms' % (
+                query, phrase, len(docs), duration * 1e3, args.scan, scan_duration * 1e3))
+
+    duration, results = time_query(lambda: index.search('burger', size=10), args.repeat)
+    print('top 10 reviews for \'burger\' in %.2fms' % (duration * 1e3))
+    if args.ngrams:
+        duration, (docs, scores) = time_query(lambda: index.match('burger', ngrams=True), args.repeat)
+        print('n-gram match for \'burger\': %d hits in %.2fms' % (len(docs), duration * 1e3))
+
+
+if __name__ == '__main__':
+    main()
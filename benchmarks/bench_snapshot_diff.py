@@ -0,0 +1,145 @@
+'''
+Time and peak memory of the diff between two synthetic daily snapshots of restaurants and their reviews, for both
+snapshots in memory as dicts by key and for snapshot_diff with a range of partitions, and the size of the delta
+against that of the new snapshot:
+$ python benchmarks/bench_snapshot_diff.py --restaurants 20000 --reviews 20 --partitions 1 16 64
+
+Between the snapshots --changed of the restaurants get a new rating and number of ratings, and --removed and
+--added of them go and come with their reviews. The new snapshot is rebuilt from the old one and the delta with
+apply_delta, and checked to have the records of the new snapshot.
+'''
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scrape_save_search'))
+
+import snapshot_diff
+
+TAGS = ['Frans', 'Italiaans', 'Romantisch', 'Hamburger', 'Vegetarisch', 'Terras', 'Groepen', 'Lunch', 'Vis']
+WORDS = 'lekker eten goede bediening gezellig sfeer prima prijs kwaliteit verhouding zeker terug niet'.split()
+
+
+def synthetic_restaurant(i, rng):
+    return {
+        'info': {'id': i, 'name': 'Restaurant %d' % i, 'lat': 52.3 + rng.random() / 10, 'lon': 4.9 + rng.random() / 10,
+                 'street': 'Straat%d' % rng.randint(1, 500), 'city': 'Amsterdam', 'avg_price': rng.randint(10, 80)},
+        'reviews': {'rating': round(rng.uniform(5, 10), 1), 'nr_ratings': rng.randint(0, 1000),
+                    'rating_food': round(rng.uniform(5, 10), 1), 'rating_service': round(rng.uniform(5, 10), 1)},
+        'tags': rng.sample(TAGS, rng.randint(0, 5)),
+        'image_urls': ['https://u.tfstatic.com/restaurant_photos/%d/%d.jpg' % (i, n) for n in range(rng.randint(0, 8))],
+    }
+
+
+def synthetic_reviews(i, count, rng):
+    return [{'id': i, 'name': 'Restaurant %d' % i, 'reviewer': 'Reviewer %d' % rng.randint(0, 10 * count),
+             'date': '2017-%02d-%02d' % (rng.randint(1, 12), rng.randint(1, 28)),
+             'comment': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 60))),
+             'reserved_online': rng.random() < 0.5, 'rating': round(rng.uniform(5, 10), 1)}
+            for _ in range(count)]
+
+
+def write_snapshot(path, restaurants, reviews):
+    with open(path, 'w') as f:
+        for i in sorted(restaurants):
+            f.write(json.dumps(restaurants[i]) + '\n')
+            for review in reviews[i]:
+                f.write(json.dumps(review) + '\n')
+
+
+def snapshots(directory, args):
+    rng = random.Random(0)
+    restaurants = dict((i, synthetic_restaurant(i, rng)) for i in range(args.restaurants))
+    reviews = dict((i, synthetic_reviews(i, rng.randint(0, 2 * args.reviews), rng)) for i in restaurants)
+    old_path = os.path.join(directory, 'old.jsonlines')
+    write_snapshot(old_path, restaurants, reviews)
+
+    ids = list(restaurants)
+    rng.shuffle(ids)
+    removed = ids[:int(args.removed * len(ids))]
+    changed = ids[len(removed):len(removed) + int(args.changed * len(ids))]
+    for i in removed:
+        del restaurants[i], reviews[i]
+    for i in changed:
+        restaurants[i]['reviews']['nr_ratings'] += 1
+        restaurants[i]['reviews']['rating'] = round(rng.uniform(5, 10), 1)
+        reviews[i].extend(synthetic_reviews(i, 1, rng))
+    for i in range(args.restaurants, args.restaurants + int(args.added * args.restaurants)):
+        restaurants[i] = synthetic_restaurant(i, rng)
+        reviews[i] = synthetic_reviews(i, rng.randint(0, 2 * args.reviews), rng)
+    new_path = os.path.join(directory, 'new.jsonlines')
+    write_snapshot(new_path, restaurants, reviews)
+    return old_path, new_path
+
+
+def in_memory_diff(old_path, new_path):
+    # both snapshots as dicts of key to record, the changed keys of which are compared field by field
+    def read(path):
+        records = {}
+        for record in snapshot_diff.read_snapshot(path):
+            table = snapshot_diff.record_table(record)
+            records[(table, snapshot_diff.to_json(snapshot_diff.record_key(table, record)))] = record
+        return records
+    old, new = read(old_path), read(new_path)
+    return (len(set(new) - set(old)), len(set(old) - set(new)),
+            sum(1 for key in set(old) & set(new) if snapshot_diff.changes(old[key], new[key])))
+
+
+def measure(function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, result
+
+
+def read_lines(path):
+    with open(path) as f:
+        return sorted(snapshot_diff.to_json(json.loads(line)) for line in f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--restaurants', type=int, default=20000)
+    parser.add_argument('--reviews', type=int, default=20, help='average number of reviews per restaurant')
+    parser.add_argument('--changed', type=float, default=0.05)
+    parser.add_argument('--removed', type=float, default=0.01)
+    parser.add_argument('--added', type=float, default=0.01)
+    parser.add_argument('--partitions', type=int, nargs='+', default=[1, 16, 64])
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        old_path, new_path = snapshots(directory, args)
+        print('snapshots of %.1f MB and %.1f MB' % (os.path.getsize(old_path) / 1e6, os.path.getsize(new_path) / 1e6))
+        print('%-24s %9s %12s %26s' % ('', 'seconds', 'peak MB', 'added/removed/changed'))
+        seconds, peak, counts = measure(lambda: in_memory_diff(old_path, new_path))
+        print('%-24s %9.2f %12.1f %26s' % ('in memory', seconds, peak / 1e6, '%d/%d/%d' % counts))
+
+        delta_path = os.path.join(directory, 'delta.jsonlines')
+        for partitions in args.partitions:
+            seconds, peak, counts = measure(lambda: snapshot_diff.diff(old_path, new_path, delta_path, partitions))
+            print('%-24s %9.2f %12.1f %26s' % ('%d partitions' % partitions, seconds, peak / 1e6,
+                                               '%d/%d/%d' % (counts['added'], counts['removed'], counts['changed'])))
+        print('delta of %.2f MB' % (os.path.getsize(delta_path) / 1e6))
+
+        applied_path = os.path.join(directory, 'applied.jsonlines')
+        start = time.perf_counter()
+        snapshot_diff.apply_delta(old_path, delta_path, applied_path)
+        print('delta applied in %.2fs' % (time.perf_counter() - start))
+        assert read_lines(applied_path) == read_lines(new_path), 'the delta applied differs from the new snapshot'
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+'''
+Startup time of the scrape_save_search cli, against importing load_data (what a script that loads the tables
+starts with), and a check that the commands don't import heavy modules they don't use:
+$ python benchmarks/bench_startup.py --repeat 5 --max-seconds 0.5
+
+Fails when a command takes longer than --max-seconds (the best of --repeat runs) or imports one of HEAVY_MODULES,
+none of which these commands need, so a module level import of pandas or BigQuery in the cli shows up as a failure.
+'''
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRAPE_SAVE_SEARCH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scrape_save_search')
+
+HEAVY_MODULES = ['numpy', 'pandas', 'scipy', 'pyarrow', 'duckdb', 'pandas_gbq', 'google']
+
+# runs a command in a fresh interpreter and prints the heavy modules it imported
+RUN = '''
+import json, sys
+sys.path.insert(0, %r)
+import cli
+try:
+    cli.main(%r)
+except SystemExit:
+    pass
+sys.stdout = sys.__stdout__
+print(json.dumps([name for name in %r if name in sys.modules]))
+'''
+
+
+def run(code):
+    '''Seconds a fresh interpreter takes to run code, and the last line it printed'''
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            check=True).stdout
+    lines = output.decode('utf-8').strip().splitlines()
+    return time.perf_counter() - start, lines[-1] if lines else None
+
+
+def best(code, repeat):
+    results = [run(code) for _ in range(repeat)]
+    return min(seconds for seconds, _ in results), results[0][1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=0.5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        snapshot = os.path.join(directory, 'snapshot.jsonlines')
+        with open(snapshot, 'w') as f:
+            f.write(json.dumps({'id': 1, 'reviewer': 'a', 'date': '2018-01-23', 'comment': 'lekker'}) + '\n')
+        commands = [
+            ('--help', ['--help']),
+            ('load --help', ['load', '--help']),
+            ('search --help', ['search', '--help']),
+            ('diff', ['diff', snapshot, snapshot, os.path.join(directory, 'delta.jsonlines')]),
+        ]
+        empty, _ = best('pass', args.repeat)
+        load_data, _ = best('import sys; sys.path.insert(0, %r); import load_data' % SCRAPE_SAVE_SEARCH, args.repeat)
+        print('%-24s %9s   %s' % ('', 'seconds', 'heavy modules imported'))
+        print('%-24s %9.3f' % ('python', empty))
+        print('%-24s %9.3f' % ('import load_data', load_data))
+        failures = []
+        for name, argv in commands:
+            seconds, imported = best(RUN % (SCRAPE_SAVE_SEARCH, argv, HEAVY_MODULES), args.repeat)
+            imported = json.loads(imported)
+            print('%-24s %9.3f   %s' % ('cli ' + name, seconds, ', '.join(imported) or '-'))
+            if seconds > args.max_seconds:
+                failures.append('cli %s took %.3fs' % (name, seconds))
+            if imported:
+                failures.append('cli %s imported %s' % (name, ', '.join(imported)))
+    finally:
+        shutil.rmtree(directory)
+    if failures:
+        sys.exit('\n'.join(failures))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+'''
+Benchmark for deduplicating and tagging the restaurants in load_data on a synthetic frame with one row per tag,
+as it comes out of BigQuery. Compares the old groupby/makelist implementation with the vectorized one:
+$ python benchmarks/bench_tagging.py --restaurants 100000
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scrape_save_search'))
+
+import load_data
+
+TAGS = ['Hamburger', 'Frans', 'Italiaans', 'Aziatisch', 'Vegetarisch', 'Vis', 'Steakhouse', 'Thais', 'Grieks',
+        'Indonesisch', 'Japans', 'Mexicaans']
+
+
+def legacy_deduplicate_and_tag(restaurants, rename_cols):
+    # the tagging as it was done before it was vectorized, kept as a baseline
+    elastic_tag_ids = pd.read_csv(load_data.ELASTIC_TAGS, header=None).iloc[:, 0]
+    image_tag_ids = pd.read_csv(load_data.IMAGE_TAGS, header=None).iloc[:, 0]
+    existing_tag_ids = restaurants.loc[lambda r: r['tags'] == 'Hamburger'].index
+    tag_list = restaurants.groupby('info_id').agg({'tags': lambda x: list(x)})
+    restaurants = (
+        restaurants
+        .assign(tags=tag_list)
+        .assign(existing=lambda x: x.index.isin(existing_tag_ids))
+        .assign(elastic=lambda x: x.index.isin(elastic_tag_ids))
+        .assign(image=lambda x: x.index.isin(image_tag_ids))
+    )
+    if rename_cols:
+        restaurants = (
+            restaurants
+            .rename(columns={'info_name': 'Name',
+                             'reviews_rating_food': 'Food rating',
+                             'reviews_price_quality': 'Price quality',
+                             'reviews_noise_level': 'Noise level',
+                             'reviews_waiting_time': 'Waiting time'})
+            .sort_values('Food rating', ascending=False)
+        )
+    return (
+        restaurants
+        .drop('tags', axis=1)
+        .drop_duplicates()
+    ), existing_tag_ids, elastic_tag_ids, image_tag_ids
+
+
+def synthetic_restaurants(n, seed=0):
+    '''n restaurants with 0 to 4 distinct tags each, one row per tag (a single row with a missing tag when untagged)'''
+    rng = np.random.RandomState(seed)
+    ids = np.arange(1, n + 1)
+    restaurants = pd.DataFrame({
+        'info_id': ids,
+        'info_name': ['restaurant %d' % i for i in ids],
+        'info_avg_price': rng.randint(10, 80, n).astype(float),
+        'reviews_rating_food': rng.randint(50, 100, n) / 10.0,
+        'reviews_price_quality': rng.randint(50, 100, n) / 10.0,
+        'reviews_noise_level': rng.choice(['Rustig', 'Normaal', 'Luid'], n),
+        'reviews_waiting_time': rng.choice(['Kort', 'Redelijk', 'Lang'], n),
+    })
+    nr_tags = rng.randint(0, 5, n)
+    rows = np.repeat(np.arange(n), np.maximum(nr_tags, 1))
+    # consecutive tags from a random first one, so a restaurant doesn't get a tag twice
+    position = np.arange(len(rows)) - np.repeat(np.cumsum(np.maximum(nr_tags, 1)) - np.maximum(nr_tags, 1),
+                                                np.maximum(nr_tags, 1))
+    tags = np.array(TAGS, dtype=object)[(rng.randint(0, len(TAGS), n)[rows] + position) % len(TAGS)]
+    tags[np.repeat(nr_tags == 0, np.maximum(nr_tags, 1))] = None
+    return restaurants.iloc[rows].assign(tags=tags).set_index('info_id')
+
+
+def write_ids(path, ids):
+    pd.Series(ids).to_csv(path, header=False, index=False)
+
+
+def same_result(before, after, rename_cols):
+    for old, new in zip(before[1:], after[1:]):
+        if not old.equals(new):
+            return False
+    if rename_cols:
+        # the old quicksort didn't keep the order of restaurants with the same rating, so compare them by id
+        if not after[0]['Food rating'].is_monotonic_decreasing:
+            return False
+        return before[0].sort_index().equals(after[0].sort_index())
+    return before[0].equals(after[0])
+
+
+def time_function(function, restaurants, rename_cols, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(restaurants, rename_cols)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--restaurants', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    restaurants = synthetic_restaurants(args.restaurants)
+    ids = restaurants.index.unique().values
+    directory = tempfile.mkdtemp()
+    load_data.ELASTIC_TAGS = os.path.join(directory, 'elasticsearch_burger_tags.csv')
+    load_data.IMAGE_TAGS = os.path.join(directory, 'image_tags.csv')
+    write_ids(load_data.ELASTIC_TAGS, ids[::7])
+    write_ids(load_data.IMAGE_TAGS, ids[::11])
+
+    print('%d restaurants, %d rows' % (args.restaurants, len(restaurants)))
+    for rename_cols in (False, True):
+        before, old = time_function(legacy_deduplicate_and_tag, restaurants, rename_cols, args.repeat)
+        after, new = time_function(load_data.deduplicate_and_tag, restaurants, rename_cols, args.repeat)
+        if not same_result(old, new, rename_cols):
+            sys.exit('Output differs with rename_cols=%s' % rename_cols)
+        print('rename_cols=%-5s before: %6.2fs  after: %6.3fs (%.0fx)' % (rename_cols, before, after, before / after))
+
+    start = time.perf_counter()
+    matrix, restaurant_ids, tag_names = load_data.tag_matrix(restaurants)
+    print('tag matrix: %d x %d, %d tags in %.3fs' % (matrix.shape[0], matrix.shape[1], matrix.nnz,
+                                                     time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
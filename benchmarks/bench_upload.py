@@ -0,0 +1,124 @@
+'''
+Time from the end of a crawl until all of its items are uploaded, for loading the whole feed at once after the crawl
+(as entrypoint.sh did with bq load) and for the UploadPipeline, with a stand-in for BigQuery that takes a fixed time
+per load job plus a time per MB:
+$ python benchmarks/bench_upload.py --items 20000 --crawl-seconds 10 --job-seconds 2 --seconds-per-mb 0.5
+
+The items are given to the pipeline at an even pace over --crawl-seconds, as a crawl would. Half of the loads of
+the stand-in fail with --failures 0.5, to see what the retries cost.
+'''
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scraper'))
+
+from scrapy.settings import Settings
+from twisted.internet import defer, reactor, task
+
+from scraper import settings as project_settings
+from scraper.pipelines import UploadPipeline
+from scraper.uploads import FileSink
+
+
+class SlowSink(FileSink):
+    # writes the batches to files like the FileSink, in the time BigQuery would take to load them
+
+    def __init__(self, settings):
+        super(SlowSink, self).__init__(settings)
+        self.job_seconds = settings.getfloat('JOB_SECONDS')
+        self.seconds_per_mb = settings.getfloat('SECONDS_PER_MB')
+        self.failures = settings.getfloat('FAILURES')
+
+    def upload(self, table, batch, data, schema):
+        time.sleep(self.job_seconds + self.seconds_per_mb * len(data) / 1e6)
+        if random.random() < self.failures:
+            raise IOError('load job failed')
+        super(SlowSink, self).upload(table, batch, data, schema)
+
+
+class Stats(dict):
+
+    def inc_value(self, key, count=1):
+        self[key] = self.get(key, 0) + count
+
+
+class Spider(object):
+    name = 'iens_spider'
+
+    def __init__(self):
+        self.placename = 'amsterdam'
+
+
+def comment(i):
+    return {'id': i // 30, 'name': 'Restaurant %d' % (i // 30), 'comment': 'Heerlijk gegeten, ' * 20,
+            'reviewer': 'Reviewer %d' % i, 'date': '2018-01-%02d' % (i % 28 + 1), 'reserved_online': i % 2 == 0,
+            'rating': 8.5, 'rating_food': 9, 'rating_service': 8, 'rating_decor': 8}
+
+
+@defer.inlineCallbacks
+def crawl(pipeline, items, crawl_seconds):
+    '''Gives the items to the pipeline over crawl_seconds and returns the seconds from then until they are uploaded'''
+    spider = Spider()
+    pipeline.open_spider(spider)
+    start = time.time()
+    for i in range(items):
+        yield pipeline.process_item(comment(i), spider)
+        wait = start + crawl_seconds * (i + 1) / items - time.time()
+        if wait > 0:
+            yield task.deferLater(reactor, wait, lambda: None)
+    crawl_end = time.time()
+    yield pipeline.close_spider(spider)
+    defer.returnValue(time.time() - crawl_end)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--crawl-seconds', type=float, default=10)
+    parser.add_argument('--job-seconds', type=float, default=2, help='seconds per load job')
+    parser.add_argument('--seconds-per-mb', type=float, default=0.5)
+    parser.add_argument('--failures', type=float, default=0.0, help='fraction of the load jobs that fail')
+    args = parser.parse_args()
+
+    output = tempfile.mkdtemp()
+    settings = Settings()
+    settings.setmodule(project_settings)
+    settings.setdict({'UPLOAD_TABLE': 'iens.%(table)s_%(placename)s', 'UPLOAD_FILE_DIR': output,
+                      'UPLOAD_FAILED_DIR': os.path.join(output, 'failed'), 'UPLOAD_RETRY_DELAY': 0.1,
+                      'JOB_SECONDS': args.job_seconds, 'SECONDS_PER_MB': args.seconds_per_mb,
+                      'FAILURES': args.failures})
+    sink = SlowSink(settings)
+
+    data = b''.join(UploadPipeline(sink, '', None, settings).encoder.encode(comment(i)).encode('utf-8') + b'\n'
+                    for i in range(args.items))
+    print('%d items (%.1f MB) crawled in %.0fs' % (args.items, len(data) / 1e6, args.crawl_seconds))
+
+    start = time.time()
+    while True:
+        try:
+            sink.upload('iens.feed', 'feed_%f' % start, data, None)
+            break
+        except IOError:
+            continue
+    print('one load after the crawl: %6.1fs after the crawl' % (time.time() - start))
+
+    stats = Stats()
+    pipeline = UploadPipeline(sink, settings.get('UPLOAD_TABLE'), stats, settings)
+
+    def report(seconds):
+        print('UploadPipeline:           %6.1fs after the crawl (%d batches, %d retries, %d failed)' % (
+            seconds, stats.get('upload/batches', 0), stats.get('upload/retries', 0),
+            stats.get('upload/failed_batches', 0)))
+        reactor.stop()
+
+    crawl(pipeline, args.items, args.crawl_seconds).addCallback(report)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+'''
+Benchmark for counting words in the comments with scrape_save_search/word_counts.py on synthetic comments.
+Compares it with the regex per row of search_for_word in the analysis notebook:
+$ python benchmarks/bench_word_counts.py --reviews 200000 --words 100
+'''
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scrape_save_search'))
+
+from word_counts import WordCounts
+
+WORDS = ('lekker eten goed bediening vriendelijk burger hamburgers friet saus vlees vis wijn prijs kwaliteit sfeer '
+         'gezellig druk rustig slecht Slecht koud warm personeel toetje voorgerecht hoofdgerecht zeker terug aanrader '
+         'ober café crème brûlée zalm biefstuk salade soep brood kip chef keuken de het een en was niet van we zijn '
+         'heel erg ook maar wel').split()
+
+
+def synthetic_comments(n, seed=0):
+    rng = np.random.RandomState(seed)
+    vocabulary = np.array(WORDS + ['woord%d' % i for i in range(2000)], dtype=object)
+    return pd.DataFrame({
+        'id': rng.randint(1, n // 20 + 2, n),
+        'comment': [' '.join(vocabulary[rng.randint(0, len(vocabulary), rng.randint(5, 60))]) + '.'
+                    for _ in range(n)],
+        'rating': rng.randint(1, 11, n).astype(float),
+    })
+
+
+def regex_count(comments, word):
+    # the count of search_for_word in the analysis notebook
+    return comments.apply(lambda x: sum(1 for match in re.finditer(r"\b" + re.escape(word) + r"\b", x.comment)),
+                          axis='columns').values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--reviews', type=int, default=200000)
+    parser.add_argument('--words', type=int, default=100, help='number of keywords to count')
+    parser.add_argument('--regex-words', type=int, default=3, help='number of keywords to time the regex on')
+    args = parser.parse_args()
+
+    comments = synthetic_comments(args.reviews)
+    keywords = (WORDS + ['woord%d' % i for i in range(args.words)])[:args.words]
+
+    start = time.perf_counter()
+    for word in keywords[:args.regex_words]:
+        expected = regex_count(comments, word)
+    regex = (time.perf_counter() - start) / args.regex_words
+
+    cache = os.path.join(tempfile.mkdtemp(), 'word_counts.npz')
+    start = time.perf_counter()
+    word_counts = WordCounts(comments, cache=cache)
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    WordCounts(comments, cache=cache)
+    cached = time.perf_counter() - start
+
+    start = time.perf_counter()
+    counts = word_counts.counts(keywords)
+    lookup = time.perf_counter() - start
+    if not np.array_equal(counts[keywords[args.regex_words - 1]].values, expected):
+        sys.exit('Counts differ for %r' % keywords[args.regex_words - 1])
+    start = time.perf_counter()
+    word_counts.restaurant_counts(keywords, minimum_number_of_occurences=2)
+    restaurants = time.perf_counter() - start
+
+    print('%d reviews, %d keywords' % (args.reviews, args.words))
+    print('regex per row:        %8.2fs per keyword, %.0fs for all' % (regex, regex * args.words))
+    print('document-term matrix: %8.2fs to build, %.2fs from the cache' % (build, cached))
+    print('counts:               %8.3fs for all keywords' % lookup)
+    print('restaurant counts:    %8.3fs for all keywords' % restaurants)
+
+
+if __name__ == '__main__':
+    main()
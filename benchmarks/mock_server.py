@@ -0,0 +1,129 @@
+'''
+Local HTTP stand-in for iens.nl to test the downloader middlewares against:
+$ python benchmarks/mock_server.py --port 8000 --changed 0.1 --latency 0.05 --congestion 0.01 --rate-limit 20
+
+Serves /page/<n> with an ETag and Last-Modified, and answers conditional GETs with a 304 when the page didn't change.
+Every time the server starts, the given fraction of the pages gets new content.
+
+Responses take `latency` seconds plus `congestion` seconds for every other request in flight, and requests over
+`rate_limit` per second get a 429.
+'''
+
+import argparse
+import hashlib
+import random
+import socketserver
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+class MockServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, changed=0.0, latency=0.0, congestion=0.0, rate_limit=None):
+        HTTPServer.__init__(self, address, MockHandler)
+        self.changed = 0.0
+        self.version = 0
+        self.last_modified = None
+        self.change(changed)
+        self.latency = latency
+        self.congestion = congestion
+        self.rate_limit = rate_limit
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.recent_requests = []
+
+    def admit(self):
+        '''Registers a request, returns False when it goes over the rate limit'''
+        with self.lock:
+            now = time.time()
+            self.recent_requests = [t for t in self.recent_requests if t > now - 1]
+            if self.rate_limit is not None and len(self.recent_requests) >= self.rate_limit:
+                return False
+            self.recent_requests.append(now)
+            self.in_flight += 1
+            return True
+
+    def delay(self):
+        with self.lock:
+            others = self.in_flight - 1
+        time.sleep(self.latency + self.congestion * others)
+
+    def done(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def change(self, changed):
+        '''Gives the `changed` fraction of the pages new content'''
+        self.changed = changed
+        self.version += 1
+        self.last_modified = formatdate(usegmt=True)
+
+    def page(self, n):
+        # the version of a page only changes for the `changed` fraction of the pages
+        version = self.version if random.Random(n).random() < self.changed else 1
+        body = ('<html><body><h1>page %d</h1><p>version %s</p>%s</body></html>' %
+                (n, version, '<p>filler</p>' * 500)).encode('utf-8')
+        return body, '"%s"' % hashlib.sha1(body).hexdigest()
+
+    def start_in_thread(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+class MockHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'page' or not parts[1].isdigit():
+            self.send_error(404)
+            return
+        if not self.server.admit():
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        try:
+            self.server.delay()
+            self.send_page(int(parts[1]))
+        finally:
+            self.server.done()
+
+    def send_page(self, n):
+        body, etag = self.server.page(n)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', self.server.last_modified)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--changed', type=float, default=0.0, help='fraction of the pages that changed')
+    parser.add_argument('--latency', type=float, default=0.0, help='base latency in seconds')
+    parser.add_argument('--congestion', type=float, default=0.0, help='extra latency per request in flight')
+    parser.add_argument('--rate-limit', type=int, default=None, help='requests per second before 429s')
+    args = parser.parse_args()
+    MockServer(('127.0.0.1', args.port), changed=args.changed, latency=args.latency, congestion=args.congestion,
+               rate_limit=args.rate_limit).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
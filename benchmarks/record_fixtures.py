@@ -0,0 +1,75 @@
+'''
+Records an offline fixture corpus of iens.nl pages for the parse benchmarks:
+$ python benchmarks/record_fixtures.py diemen --restaurants 20 --review-pages 3
+
+Pages are saved per kind (listing, restaurant, reviews) in benchmarks/fixtures, together with a
+manifest.jsonlines that keeps the url of every page so the spiders can follow links from the replayed responses.
+Recording replaces the corpus that was there, after which the golden files have to be written again.
+'''
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+import urllib.request
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scraper'))
+
+from scrapy.http import HtmlResponse
+from scraper.settings import USER_AGENT
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def fetch(url, delay):
+    time.sleep(delay)
+    request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+    with urllib.request.urlopen(request) as f:
+        return HtmlResponse(url=f.geturl(), body=f.read(), encoding='utf-8')
+
+
+def save(response, kind, manifest):
+    directory = os.path.join(FIXTURES_DIR, kind)
+    os.makedirs(directory, exist_ok=True)
+    file_name = '%s/%03d.html' % (kind, len(os.listdir(directory)))
+    with open(os.path.join(FIXTURES_DIR, file_name), 'wb') as f:
+        f.write(response.body)
+    manifest.write(json.dumps({'file': file_name, 'url': response.url, 'kind': kind}) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('placename')
+    parser.add_argument('--listing-pages', type=int, default=2)
+    parser.add_argument('--restaurants', type=int, default=20)
+    parser.add_argument('--review-pages', type=int, default=3, help='extra review pages per restaurant')
+    parser.add_argument('--delay', type=float, default=1.0, help='seconds between requests')
+    args = parser.parse_args()
+
+    for kind in ['listing', 'restaurant', 'reviews']:
+        shutil.rmtree(os.path.join(FIXTURES_DIR, kind), ignore_errors=True)
+    with open(os.path.join(FIXTURES_DIR, 'manifest.jsonlines'), 'w') as manifest:
+        restaurant_urls = []
+        url = 'https://www.iens.nl/restaurant+%s' % args.placename
+        for _ in range(args.listing_pages):
+            listing = fetch(url, args.delay)
+            save(listing, 'listing', manifest)
+            restaurant_urls += [listing.urljoin(href) for href in
+                                listing.xpath('//li[@class="resultItem"]/div/h3/a/@href').extract()]
+            next_page = listing.xpath('//div[@class="pagination"]/ul/li[@class="next"]/a/@href').extract_first()
+            if next_page is None:
+                break
+            url = listing.urljoin(next_page)
+
+        for url in restaurant_urls[:args.restaurants]:
+            restaurant = fetch(url, args.delay)
+            save(restaurant, 'restaurant', manifest)
+            review_pages = restaurant.xpath('//ul[@class="pagination oneline text_right"]/li/a/@href').extract()
+            for href in review_pages[:args.review_pages]:
+                save(fetch(restaurant.urljoin(href), args.delay), 'reviews', manifest)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,9 +3,16 @@
 # get current date
 dt=$(date +%Y%m%d)
 
-# run crawler
-scrapy crawl iens -a placename=${CITY} -o dockeroutput/iens_${CITY}_${dt}.jsonlines \
-    -s LOG_FILE=dockeroutput/iens_${CITY}_${dt}.log
+# run the crawler for every city in CITIES (defaults to CITY), which scrapes the restaurants and (if wanted) their
+# comments in one crawl per city into a file each: dockeroutput/iens_<city>_${dt}.jsonlines and
+# dockeroutput/iens_comments_<city>_${dt}.jsonlines. The cities are crawled in parallel by a pool of processes.
+# The items are uploaded to the BigQuery tables iens.iens_<city>_${dt} and iens.iens_comments_<city>_${dt} in
+# batches while crawling.
+CITIES=${CITIES:-${CITY}}
+python -m scraper.scheduler ${CITIES} --output dockeroutput --date ${dt} \
+    --comments ${SCRAPE_COMMENTS} --incremental ${INCREMENTAL} \
+    -s UPLOAD_SINK=scraper.uploads.BigQuerySink -s "UPLOAD_TABLE=iens.%(table)s_%(placename)s_${dt}" \
+    -s UPLOAD_FAILED_DIR=dockeroutput/failed_uploads -s SCHEMA_DIR=/app
 
 # get email of service account from credentials
 export EMAIL=`jq '.client_email' gsdk-credentials.json`
@@ -13,15 +20,13 @@ export EMAIL=`jq '.client_email' gsdk-credentials.json`
 # authenticate to Google Cloud
 gcloud auth activate-service-account ${EMAIL//\"/} --key-file=${GOOGLE_APPLICATION_CREDENTIALS}
 
-# upload output to google bigquery
-bq load --source_format=NEWLINE_DELIMITED_JSON --schema=iens_schema.json \
-    iens.iens_${CITY}_${dt} dockeroutput/iens_${CITY}_${dt}.jsonlines
-
-# scrape comments if wanted
-if ${SCRAPE_COMMENTS} ; then
-    scrapy crawl iens_comments -a placename=${CITY} -o dockeroutput/iens_comments_${CITY}_${dt}.jsonlines \
-        -s LOG_FILE=dockeroutput/iens_comments_${CITY}_${dt}.log
-
-    bq load --autodetect --source_format=NEWLINE_DELIMITED_JSON \
-        iens.iens_comments_${CITY}_${dt} dockeroutput/iens_comments_${CITY}_${dt}.jsonlines
-fi
\ No newline at end of file
+# upload the batches that couldn't be uploaded while crawling, which are in a folder per table
+for batch in dockeroutput/failed_uploads/*/*.jsonlines ; do
+    [ -e "${batch}" ] || continue
+    table=$(basename $(dirname ${batch}))
+    schema=iens_schema.json
+    if [[ ${table} == iens.iens_comments_* ]] ; then
+        schema=iens_comments_schema.json
+    fi
+    bq load --source_format=NEWLINE_DELIMITED_JSON --schema=${schema} ${table} ${batch} && rm ${batch}
+done
\ No newline at end of file
@@ -0,0 +1,163 @@
+'''
+Command line for the tasks of scrape_save_search, for cron jobs and other short scheduled tasks:
+
+    $ python scrape_save_search/cli.py load restaurants --columns info_name reviews_rating_food --limit 10
+    $ python scrape_save_search/cli.py --backend local export comments comments.parquet --where "rating < 6"
+    $ python scrape_save_search/cli.py tag --output burgers.csv
+    $ python scrape_save_search/cli.py index dockeroutput/iens_comments_amsterdam_20180123.jsonlines search_index
+    $ python scrape_save_search/cli.py search search_index "niet lekker" --phrase
+    $ python scrape_save_search/cli.py diff OLD NEW DELTA
+    $ python scrape_save_search/cli.py duplicates duplicates_index COMMENTS_FEED
+
+A command only imports what it needs when it runs, so starting one (or asking for --help) doesn't pay for pandas,
+BigQuery or the credentials of the tasks it doesn't run. benchmarks/bench_startup.py checks that it stays that way.
+Tables are written as csv to stdout, or to --output / the export file as csv, jsonlines or Parquet by its extension.
+'''
+
+import argparse
+import os
+import sys
+
+
+def write_table(frame, output=None, index=True):
+    '''Writes a dataframe to stdout as csv, or to a csv, jsonlines or Parquet file'''
+    if output is None:
+        frame.to_csv(sys.stdout, index=index)
+    elif output.endswith('.parquet'):
+        frame.to_parquet(output)
+    elif output.endswith('.jsonlines') or output.endswith('.jsonl'):
+        frame.reset_index().to_json(output, orient='records', lines=True, force_ascii=False)
+    else:
+        frame.to_csv(output, index=index)
+
+
+def load_table(args):
+    import load_data
+    load_data.BACKEND = args.backend
+    if args.data_dir is not None:
+        load_data.LOCAL_DATA_DIR = args.data_dir
+    if args.table == 'restaurants':
+        restaurants = load_data.load_restaurants(rename_cols=False, columns=args.columns, where=args.where)[0]
+        return restaurants.drop(['existing', 'elastic', 'image'], axis=1)
+    return load_data.load_comments(args.columns, args.where)
+
+
+def load(args):
+    frame = load_table(args)
+    write_table(frame.head(args.limit) if args.limit is not None else frame, args.output,
+                index=args.table == 'restaurants')
+
+
+def export(args):
+    write_table(load_table(args), args.output, index=args.table == 'restaurants')
+
+
+def tag(args):
+    import load_data
+    load_data.BACKEND = args.backend
+    if args.data_dir is not None:
+        load_data.LOCAL_DATA_DIR = args.data_dir
+    restaurants = load_data.load_restaurants(rename_cols=False, columns=['info_name'])[0]
+    flags = ['existing', 'elastic', 'image']
+    if not args.all:
+        restaurants = restaurants[restaurants[flags].any(axis=1)]
+    write_table(restaurants[['info_name'] + flags], args.output)
+
+
+def index(args):
+    import search
+    search.build_index(args.feed, args.directory, ngrams=args.ngrams)
+
+
+def search_comments(args):
+    import search
+    results = search.SearchIndex(args.directory).search(args.query, size=args.size, phrase=args.phrase,
+                                                        ngrams=args.ngrams)
+    write_table(results, args.output, index=False)
+
+
+def diff(args):
+    import snapshot_diff
+    counts = snapshot_diff.diff(args.old, args.new, args.delta, args.partitions)
+    print(', '.join('%d %s' % (counts[op], op) for op in ['added', 'removed', 'changed']))
+
+
+def find_duplicates(args):
+    import duplicates
+    index = duplicates.DuplicateIndex(args.directory)
+    for feed in args.feeds:
+        index.add_feed(feed)
+    clusters = index.clusters()
+    write_table(duplicates.cross_restaurant_reviewers(clusters) if args.reviewers else clusters, args.output,
+                index=args.reviewers)
+
+
+def parser():
+    parser = argparse.ArgumentParser(description='Tasks of scrape_save_search')
+    parser.add_argument('--backend', choices=['bigquery', 'local'], default=os.environ.get('IENS_BACKEND', 'bigquery'),
+                        help='where load, export and tag read the tables (default $IENS_BACKEND or bigquery)')
+    parser.add_argument('--data-dir', help='crawl output folder of the local backend (default $IENS_DATA_DIR)')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    for name, function, help in [('load', load, 'print the first rows of a table'),
+                                 ('export', export, 'write a table to a csv, jsonlines or Parquet file')]:
+        command = commands.add_parser(name, help=help)
+        command.add_argument('table', choices=['restaurants', 'comments'])
+        if name == 'export':
+            command.add_argument('output', help='file to write, csv, jsonlines or Parquet by its extension')
+        else:
+            command.add_argument('--limit', type=int, default=10, help='number of rows, all of them with 0')
+            command.add_argument('--output', help='file to write instead of stdout')
+        command.add_argument('--columns', nargs='+', help='columns to read, e.g. info_name reviews_rating_food')
+        command.add_argument('--where', help="condition on the rows, e.g. 'info.avg_price < 30'")
+        command.set_defaults(function=function)
+
+    command = commands.add_parser('tag', help='the restaurants with a hamburger tag, from their tags, '
+                                              'elasticsearch and the vision api')
+    command.add_argument('--all', action='store_true', help='all restaurants, not only the tagged ones')
+    command.add_argument('--output', help='file to write instead of stdout')
+    command.set_defaults(function=tag)
+
+    command = commands.add_parser('index', help='build the search index of a comments feed')
+    command.add_argument('feed', help='comments jsonlines feed')
+    command.add_argument('directory', help='directory to write the index to')
+    command.add_argument('--ngrams', action='store_true', help='build the n-gram index as well')
+    command.set_defaults(function=index)
+
+    command = commands.add_parser('search', help='search the comments in a search index')
+    command.add_argument('directory', help='directory of the index')
+    command.add_argument('query')
+    command.add_argument('--size', type=int, default=10, help='number of results')
+    command.add_argument('--phrase', action='store_true', help='only the comments with the query as a phrase')
+    command.add_argument('--ngrams', action='store_true', help='match n-grams (partial words)')
+    command.add_argument('--output', help='file to write instead of stdout')
+    command.set_defaults(function=search_comments)
+
+    command = commands.add_parser('diff', help='write the delta between two snapshots of a table')
+    command.add_argument('old', help='jsonlines or Parquet file of the old snapshot')
+    command.add_argument('new', help='jsonlines or Parquet file of the new snapshot')
+    command.add_argument('delta', help='jsonlines file to write the delta to')
+    command.add_argument('--partitions', type=int, default=64)
+    command.set_defaults(function=diff)
+
+    command = commands.add_parser('duplicates', help='add comments feeds to a near-duplicate index and write the '
+                                                     'clusters of near-duplicate reviews')
+    command.add_argument('directory', help='directory of the index, created when it doesn\'t exist')
+    command.add_argument('feeds', nargs='*', help='comments jsonlines feeds to add')
+    command.add_argument('--reviewers', action='store_true',
+                         help='the reviewers with near duplicates at other restaurants instead of the clusters')
+    command.add_argument('--output', help='file to write instead of stdout')
+    command.set_defaults(function=find_duplicates)
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    if getattr(args, 'limit', None) == 0:
+        args.limit = None
+    args.function(args)
+
+
+if __name__ == '__main__':
+    main()
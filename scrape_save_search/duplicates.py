@@ -0,0 +1,359 @@
+'''
+Near-duplicate reviews: the same comment, or nearly the same, posted more than once, like copy-pasted or templated
+reviews across restaurants, found with MinHash and locality-sensitive hashing instead of comparing every pair.
+
+A comment is the set of its shingles, the runs of `shingle` consecutive lowercased words. Its MinHash signature
+holds the smallest hash of its shingles under `num_perm` random hash functions, and two signatures agree on a hash
+function with a probability equal to the Jaccard similarity of the shingle sets. The signature is cut into `bands`,
+and reviews with the same values in a band land in the same bucket. Reviews that share a bucket are compared to the
+first review of the bucket, and the ones whose signatures agree on at least `threshold` of the hash functions are
+near duplicates. The clusters are the connected components of the near duplicates. Reviews that are at least 70%
+similar (with the defaults) share a bucket with a probability of 99%, and finding them takes time linear in the
+number of reviews.
+
+The index is a directory with the signatures, the band values, the buckets, the clusters and the reviews (restaurant
+id, name, reviewer and date). Adding the reviews of a new snapshot skips the reviews that are in the index already,
+by a fingerprint like the one of the crawl index, so only the new reviews are hashed, and only their band values are
+looked up in the sorted buckets. The clusters are kept as a union-find, to which the new near duplicates are added.
+
+    index = duplicates.DuplicateIndex('../duplicates_index')
+    index.add_feed('../dockeroutput/iens_comments_amsterdam_20180123.jsonlines')
+    clusters = index.clusters()
+    duplicates.cross_restaurant_reviewers(clusters)
+    index.similar('Heerlijk gegeten, goede bediening en een leuke sfeer. Wij komen zeker terug!')
+
+add() takes reviews as dicts, e.g. load_data.load_comments().to_dict('records').
+'''
+
+import hashlib
+import json
+import os
+import re
+import zlib
+
+import numpy as np
+import pandas as pd
+
+TOKEN = re.compile(r'\w+')
+# the hash functions are (a * x + b) mod PRIME of the crc32 x of a shingle, which fits in 64 bits
+PRIME = (1 << 31) - 1
+
+DEFAULTS = {'num_perm': 64, 'bands': 16, 'shingle': 3, 'threshold': 0.7, 'seed': 1}
+
+
+def shingles(comment, size):
+    '''crc32 hashes of the runs of size consecutive words of a comment, or of all words when there are fewer'''
+    words = TOKEN.findall((comment or '').lower())
+    if not words:
+        return []
+    return [zlib.crc32(' '.join(words[i:i + size]).encode('utf-8')) for i in range(max(1, len(words) - size + 1))]
+
+
+def review_fingerprint(review):
+    '''Fingerprint of a review, as 64 bits of the sha1 of its restaurant id, reviewer, date and comment'''
+    key = '\x1f'.join([str(review['id']), review['reviewer'] or '', date_string(review['date']),
+                       review['comment'] or ''])
+    return int.from_bytes(hashlib.sha1(key.encode('utf-8')).digest()[:8], 'little')
+
+
+def date_string(date):
+    # a date of a feed, or a timestamp of a dataframe
+    return date.isoformat()[:10] if hasattr(date, 'isoformat') else str(date or '')
+
+
+class MinHash(object):
+    '''The hash functions of the signatures, drawn from seed'''
+
+    def __init__(self, num_perm, seed):
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, PRIME, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, PRIME, size=num_perm).astype(np.uint64)
+
+    def signatures(self, hashes, starts):
+        '''Signatures of the documents of which the shingle hashes start at starts (every document has shingles)'''
+        signatures = np.empty((len(starts), len(self.a)), dtype=np.uint32)
+        for i in range(len(self.a)):
+            values = (self.a[i] * hashes + self.b[i]) % np.uint64(PRIME)
+            signatures[:, i] = np.minimum.reduceat(values, starts)
+        return signatures
+
+
+def band_keys(signatures, bands):
+    '''A 64 bit hash of the values of each band of the signatures'''
+    rows = signatures.shape[1] // bands
+    keys = np.zeros((len(signatures), bands), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for row in range(rows):
+            keys = keys * np.uint64(1000003) ^ signatures[:, row::rows][:, :bands].astype(np.uint64)
+    return keys
+
+
+def find(parents, position):
+    '''The root of the cluster of a position in a union-find of parents, halving the path to it on the way'''
+    while parents[position] != position:
+        parents[position] = parents[parents[position]]
+        position = parents[position]
+    return position
+
+
+class DuplicateIndex(object):
+    # The signatures, band keys and fingerprints of the reviews are appended to signatures.bin, band_keys.bin and
+    # fingerprints.bin, and their restaurant id, name, reviewer and date to reviews.jsonlines. meta.json holds the
+    # number of reviews (and the bytes of reviews.jsonlines) that count, so the rows an add that didn't finish wrote
+    # after them are ignored, and cut off by the next add.
+    #
+    # The buckets of a band are its sorted band keys with the position of the first review that has the key, in
+    # bucket_keys.<generation>.npy and bucket_firsts.<generation>.npy (the bands one after the other, from the offsets
+    # in meta['buckets']). The label of a review is the position of the first review of its cluster, in
+    # labels.<generation>.npy. Every add writes these as a new generation, from temp files that are renamed, and
+    # writes meta.json, which points to the generation, last (also from a temp file). An add that is killed leaves
+    # the index as it was before.
+
+    def __init__(self, directory, **params):
+        '''
+        Opens the index in directory, or a new empty one with the given num_perm, bands, shingle, threshold and seed
+        (see DEFAULTS). Of an existing index only the threshold can be changed, the rest is what its signatures are.
+        '''
+        self.directory = directory
+        path = os.path.join(directory, 'meta.json')
+        if os.path.exists(path):
+            with open(path) as f:
+                self.meta = json.load(f)
+            for name, value in params.items():
+                if name != 'threshold' and value != self.meta[name]:
+                    raise ValueError('The index was built with %s=%s' % (name, self.meta[name]))
+            self.meta.update(params)
+            rows = self.meta['reviews']
+            self.signatures = self.read_rows('signatures', np.uint32, rows, self.meta['num_perm'])
+            self.band_keys = self.read_rows('band_keys', np.uint64, rows, self.meta['bands'])
+            self.fingerprints = self.read_rows('fingerprints', np.uint64, rows, 1)[:, 0]
+            load = lambda name: np.load(self.generation_path(name, self.meta['generation']))
+            self.labels = load('labels')
+            self.bucket_keys = load('bucket_keys')
+            self.bucket_firsts = load('bucket_firsts')
+        else:
+            self.meta = dict(DEFAULTS, reviews=0, reviews_bytes=0, generation=0, **params)
+            if self.meta['num_perm'] % self.meta['bands']:
+                raise ValueError('num_perm has to be a multiple of bands')
+            self.meta['buckets'] = [0] * (self.meta['bands'] + 1)
+            self.signatures = np.zeros((0, self.meta['num_perm']), dtype=np.uint32)
+            self.band_keys = np.zeros((0, self.meta['bands']), dtype=np.uint64)
+            self.fingerprints = np.zeros(0, dtype=np.uint64)
+            self.labels = np.zeros(0, dtype=np.int64)
+            self.bucket_keys = np.zeros(0, dtype=np.uint64)
+            self.bucket_firsts = np.zeros(0, dtype=np.int64)
+        self.minhash = MinHash(self.meta['num_perm'], self.meta['seed'])
+        self.reviews = None
+
+    def __len__(self):
+        return self.meta['reviews']
+
+    def read_rows(self, name, dtype, rows, width):
+        '''The first rows of an appended file, as an array of rows of width values'''
+        values = np.fromfile(os.path.join(self.directory, name + '.bin'), dtype=dtype, count=rows * width)
+        return values.reshape(rows, width)
+
+    def generation_path(self, name, generation):
+        return os.path.join(self.directory, '%s.%d.npy' % (name, generation))
+
+    def read_reviews(self):
+        '''The restaurant id, name, reviewer and date of the reviews in the index, as a dataframe'''
+        if self.reviews is None:
+            rows = []
+            path = os.path.join(self.directory, 'reviews.jsonlines')
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    for line, _ in zip(f, range(len(self))):
+                        rows.append(json.loads(line))
+            self.reviews = pd.DataFrame(rows, columns=['id', 'name', 'reviewer', 'date'])
+        return self.reviews
+
+    def hash_reviews(self, reviews):
+        '''Signatures of the reviews with words in their comment, and the positions of those reviews'''
+        hashes = []
+        starts = []
+        positions = []
+        for position, review in enumerate(reviews):
+            review_hashes = shingles(review['comment'], self.meta['shingle'])
+            if review_hashes:
+                starts.append(len(hashes))
+                hashes.extend(review_hashes)
+                positions.append(position)
+        if not positions:
+            return np.zeros((0, self.meta['num_perm']), dtype=np.uint32), positions
+        return self.minhash.signatures(np.array(hashes, dtype=np.uint64), np.array(starts, dtype=np.int64)), positions
+
+    def candidates(self, keys):
+        '''
+        Pairs of a new review and the first review of a bucket it shares, from the band keys of the new reviews, which
+        come after the reviews in the index, and the buckets with the new keys added. Only the new keys are looked up
+        in the buckets.
+        '''
+        new = len(self)
+        members = np.arange(new, new + len(keys))
+        pairs = []
+        bucket_keys, bucket_firsts, offsets = [], [], [0]
+        for band in range(keys.shape[1]):
+            start, end = self.meta['buckets'][band], self.meta['buckets'][band + 1]
+            band_buckets = self.bucket_keys[start:end]
+            band_firsts = self.bucket_firsts[start:end]
+            unique, first_index, inverse = np.unique(keys[:, band], return_index=True, return_inverse=True)
+            at = np.searchsorted(band_buckets, unique)
+            found = at < len(band_buckets)
+            found[found] = band_buckets[at[found]] == unique[found]
+            # the first of a bucket is its oldest review, the first new review with the key for a new bucket
+            firsts = new + first_index
+            firsts[found] = band_firsts[at[found]]
+            first = firsts[inverse]
+            pairs.append(np.stack([first, members], axis=1)[first != members])
+            bucket_keys.append(np.insert(band_buckets, at[~found], unique[~found]))
+            bucket_firsts.append(np.insert(band_firsts, at[~found], firsts[~found]))
+            offsets.append(offsets[-1] + len(bucket_keys[-1]))
+        pairs = np.concatenate(pairs)
+        pairs = np.unique(pairs, axis=0) if len(pairs) else pairs
+        return pairs[:, 0], pairs[:, 1], (np.concatenate(bucket_keys), np.concatenate(bucket_firsts), offsets)
+
+    def similarity(self, signatures, firsts, members):
+        '''Estimated Jaccard similarity of pairs of reviews, the fraction of the hash functions they agree on'''
+        return (signatures[firsts] == signatures[members]).mean(axis=1) if len(firsts) else np.zeros(0)
+
+    def add(self, reviews):
+        '''
+        Adds the reviews (dicts with id, name, reviewer, date and comment) that aren't in the index yet and writes the
+        index, returns the number of reviews that were added
+        '''
+        seen = set(self.fingerprints.tolist())
+        new_reviews = []
+        new_fingerprints = []
+        for review in reviews:
+            fingerprint = review_fingerprint(review)
+            if fingerprint not in seen:
+                seen.add(fingerprint)
+                new_reviews.append(review)
+                new_fingerprints.append(fingerprint)
+        # reviews without words have no signature and aren't kept
+        signatures, positions = self.hash_reviews(new_reviews)
+        if not positions:
+            return 0
+        hashed = [new_reviews[i] for i in positions]
+        fingerprints = np.array([new_fingerprints[i] for i in positions], dtype=np.uint64)
+        keys = band_keys(signatures, self.meta['bands'])
+
+        firsts, members, buckets = self.candidates(keys)
+        all_signatures = np.concatenate([self.signatures, signatures])
+        similar = self.similarity(all_signatures, firsts, members) >= self.meta['threshold']
+
+        # union-find of the clusters, of which the root is the first review, so the labels stay the same over adds
+        parents = np.concatenate([self.labels, np.arange(len(self), len(all_signatures))])
+        for first, member in zip(firsts[similar].tolist(), members[similar].tolist()):
+            first, member = find(parents, first), find(parents, member)
+            if first != member:
+                parents[max(first, member)] = min(first, member)
+        while True:
+            grandparents = parents[parents]
+            if (grandparents == parents).all():
+                break
+            parents = grandparents
+
+        self.write(hashed, signatures, keys, fingerprints, parents, buckets)
+        self.signatures = all_signatures
+        self.band_keys = np.concatenate([self.band_keys, keys])
+        self.fingerprints = np.concatenate([self.fingerprints, fingerprints])
+        self.labels = parents
+        self.bucket_keys, self.bucket_firsts, _ = buckets
+        return len(hashed)
+
+    def add_feed(self, comments):
+        '''Adds the reviews of a comments jsonlines feed'''
+        with open(comments, encoding='utf-8') as f:
+            return self.add(json.loads(line) for line in f if line.strip())
+
+    def append(self, name, size, data):
+        '''Appends data to a file, after cutting it back to size, returns the size of the file'''
+        with open(os.path.join(self.directory, name), 'ab') as f:
+            f.truncate(size)
+            f.seek(size)
+            f.write(data)
+            return f.tell()
+
+    def write(self, new_reviews, signatures, keys, fingerprints, labels, buckets):
+        '''Appends the new reviews, writes the labels and buckets as a new generation, and then meta.json'''
+        os.makedirs(self.directory, exist_ok=True)
+        rows = len(self)
+        self.append('signatures.bin', rows * signatures.shape[1] * 4, signatures.tobytes())
+        self.append('band_keys.bin', rows * keys.shape[1] * 8, keys.tobytes())
+        self.append('fingerprints.bin', rows * 8, fingerprints.tobytes())
+        reviews_bytes = self.append('reviews.jsonlines', self.meta['reviews_bytes'], b''.join(
+            (json.dumps({'id': int(review['id']), 'name': review.get('name'), 'reviewer': review['reviewer'],
+                         'date': date_string(review['date'])}, ensure_ascii=False) + '\n').encode('utf-8')
+            for review in new_reviews))
+
+        old_generation = self.meta['generation']
+        generation = old_generation + 1
+        bucket_keys, bucket_firsts, offsets = buckets
+        for name, array in [('labels', labels), ('bucket_keys', bucket_keys), ('bucket_firsts', bucket_firsts)]:
+            path = self.generation_path(name, generation)
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, array)
+            os.replace(path + '.tmp', path)
+        meta = dict(self.meta, reviews=rows + len(new_reviews), reviews_bytes=reviews_bytes, generation=generation,
+                    buckets=offsets)
+        path = os.path.join(self.directory, 'meta.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(path + '.tmp', path)
+        self.meta = meta
+        self.reviews = None
+        for name in ['labels', 'bucket_keys', 'bucket_firsts']:
+            try:
+                os.remove(self.generation_path(name, old_generation))
+            except FileNotFoundError:
+                pass
+
+    def clusters(self, min_size=2):
+        '''
+        The reviews of the clusters of at least min_size near duplicates, as a dataframe with the cluster, its size,
+        and the restaurant id, name, reviewer and date of each review, the largest clusters first
+        '''
+        sizes = np.bincount(self.labels, minlength=1)
+        positions = np.flatnonzero(sizes[self.labels] >= min_size)
+        return (
+            self.read_reviews()
+            .iloc[positions]
+            .assign(cluster=self.labels[positions], size=sizes[self.labels[positions]])
+            .sort_values(['size', 'cluster'], ascending=[False, True], kind='mergesort')
+            [['cluster', 'size', 'id', 'name', 'reviewer', 'date']]
+            .reset_index(drop=True)
+        )
+
+    def similar(self, comment, threshold=None):
+        '''The reviews in the index that are near duplicates of a comment, with their estimated similarity'''
+        signatures, positions = self.hash_reviews([{'comment': comment}])
+        if not positions:
+            return self.read_reviews().iloc[:0].assign(similarity=[])
+        keys = band_keys(signatures, self.meta['bands'])[0]
+        positions = np.flatnonzero((self.band_keys == keys).any(axis=1))
+        similarity = (self.signatures[positions] == signatures[0]).mean(axis=1)
+        keep = similarity >= (self.meta['threshold'] if threshold is None else threshold)
+        order = np.argsort(-similarity[keep], kind='mergesort')
+        return (
+            self.read_reviews()
+            .iloc[positions[keep][order]]
+            .assign(similarity=similarity[keep][order])
+            .reset_index(drop=True)
+        )
+
+
+def cross_restaurant_reviewers(clusters):
+    '''
+    The reviewers that posted near duplicates of their own review at more than one restaurant, with the number of
+    such clusters, and the restaurants and reviews in them, from the clusters of DuplicateIndex.clusters()
+    '''
+    restaurants = clusters.groupby(['cluster', 'reviewer'])['id'].transform('nunique')
+    return (
+        clusters[restaurants > 1]
+        .groupby('reviewer')
+        .agg({'cluster': 'nunique', 'id': 'nunique', 'date': 'size'})
+        .rename(columns={'cluster': 'clusters', 'id': 'restaurants', 'date': 'reviews'})
+        .sort_values(['restaurants', 'reviews'], ascending=False, kind='mergesort')
+    )
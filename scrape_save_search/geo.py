@@ -0,0 +1,212 @@
+'''
+Spatial index of the restaurants, for the restaurants within a radius of a point, the nearest restaurants and the
+restaurants within a bounding box, combined with filters on their ratings, price and tags.
+
+The restaurants are points on the unit sphere in a KD-tree (scipy's cKDTree), in which the straight line (chord)
+distance between two points only depends on their great circle distance. A radius query is a ball query of the
+chord of the radius, and k nearest by chord are k nearest by great circle distance, so a query takes microseconds
+instead of a geodesic distance per restaurant. Distances are on a sphere with the mean radius of the earth, within
+0.5% of the geodesic distances of geopy.
+
+build_index() reads a restaurants jsonlines feed and saves the index next to it, from where GeoIndex.load() reads it:
+
+    geo.build_index('../dockeroutput/iens_amsterdam_20180123.jsonlines')
+    index = geo.GeoIndex.load('../dockeroutput/iens_amsterdam_20180123.geo.npz')
+    ids, km = index.radius(52.352379, 4.912933, 1.5, min_rating_food=8, tags=['Hamburger'])
+    ids, km = index.nearest(52.352379, 4.912933, 10, max_avg_price=30)
+    ids = index.bbox(52.35, 4.88, 52.38, 4.92)
+
+A filter is min_<column> or max_<column> for the numeric columns (rating, rating_food, rating_service,
+rating_decor, avg_price and nr_ratings of a feed), and tags, of which a restaurant has to have all.
+GeoIndex.from_frame() indexes a dataframe of restaurants, like the ones of load_data.
+'''
+
+import json
+import os
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_KM = 6371.0088
+
+# (column, record, field) of the numeric columns that build_index takes from a feed
+FEED_COLUMNS = [
+    ('rating', 'reviews', 'rating'),
+    ('rating_food', 'reviews', 'rating_food'),
+    ('rating_service', 'reviews', 'rating_service'),
+    ('rating_decor', 'reviews', 'rating_decor'),
+    ('nr_ratings', 'reviews', 'nr_ratings'),
+    ('avg_price', 'info', 'avg_price'),
+]
+
+
+def to_unit_vectors(lat, lon):
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(np.asarray(chord) / 2, 1.0))
+
+
+def km_to_chord(km):
+    return 2 * np.sin(min(km / EARTH_RADIUS_KM, np.pi) / 2)
+
+
+class GeoIndex(object):
+
+    def __init__(self, ids, lat, lon, columns=None, tag_indptr=None, tag_indices=None, tag_names=()):
+        '''
+        Index of the restaurants with the given ids and coordinates. The columns are a dict of name to an array of
+        values for the filters (NaN for missing), the tags a list of tag names and the tags of restaurant i the
+        tag_indices[tag_indptr[i]:tag_indptr[i + 1]] of the names, like the rows of a CSR matrix.
+        '''
+        self.ids = np.asarray(ids)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.columns = dict((name, np.asarray(values, dtype=np.float64)) for name, values in (columns or {}).items())
+        self.tag_indptr = np.zeros(len(self.ids) + 1, dtype=np.int64) if tag_indptr is None else np.asarray(tag_indptr)
+        self.tag_indices = np.zeros(0, dtype=np.int32) if tag_indices is None else np.asarray(tag_indices)
+        self.tag_names = list(tag_names)
+        self.tag_masks = {}
+        self.tree = cKDTree(to_unit_vectors(self.lat, self.lon))
+        # positions by latitude, for the latitude range of a bounding box
+        self.by_lat = np.argsort(self.lat, kind='mergesort')
+        self.sorted_lat = self.lat[self.by_lat]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_frame(cls, restaurants, columns=None, lat='info_lat', lon='info_lon'):
+        '''
+        Index of a dataframe of restaurants with their id as index (one row per restaurant), with the dataframe
+        columns as filter columns by a dict of filter name to column, e.g. {'rating_food': 'Food rating'}
+        '''
+        return cls(restaurants.index.values, restaurants[lat].values, restaurants[lon].values,
+                   dict((name, restaurants[column].values) for name, column in (columns or {}).items()))
+
+    def tag_mask(self, tag):
+        '''Boolean array of the restaurants that have the tag'''
+        if tag not in self.tag_masks:
+            mask = np.zeros(len(self.ids), dtype=bool)
+            if tag in self.tag_names:
+                rows = np.repeat(np.arange(len(self.ids)), np.diff(self.tag_indptr))
+                mask[rows[self.tag_indices == self.tag_names.index(tag)]] = True
+            self.tag_masks[tag] = mask
+        return self.tag_masks[tag]
+
+    def matches(self, positions, filters):
+        '''Boolean array of which of the positions pass the filters'''
+        keep = np.ones(len(positions), dtype=bool)
+        for name, value in filters.items():
+            if name == 'tags':
+                for tag in value:
+                    keep &= self.tag_mask(tag)[positions]
+            elif name.startswith('min_'):
+                keep &= self.column(name[4:])[positions] >= value
+            elif name.startswith('max_'):
+                keep &= self.column(name[4:])[positions] <= value
+            else:
+                raise TypeError('Unknown filter %s' % name)
+        return keep
+
+    def column(self, name):
+        if name not in self.columns:
+            raise KeyError('No column %s to filter on, only %s' % (name, ', '.join(sorted(self.columns))))
+        return self.columns[name]
+
+    def radius(self, lat, lon, km, **filters):
+        '''Ids and distances in km of the restaurants within km of a point that pass the filters, nearest first'''
+        center = to_unit_vectors([lat], [lon])[0]
+        positions = np.asarray(self.tree.query_ball_point(center, km_to_chord(km)), dtype=np.int64)
+        positions = positions[self.matches(positions, filters)]
+        distances = chord_to_km(np.sqrt(((self.tree.data[positions] - center) ** 2).sum(axis=1)))
+        order = np.argsort(distances, kind='mergesort')
+        return self.ids[positions[order]], distances[order]
+
+    def nearest(self, lat, lon, k, **filters):
+        '''Ids and distances in km of the k nearest restaurants to a point that pass the filters'''
+        center = to_unit_vectors([lat], [lon])[0]
+        candidates = k
+        while True:
+            # fewer than k pass the filters: look further until there are k or all restaurants are looked at
+            candidates = min(candidates, len(self.ids))
+            chords, positions = self.tree.query(center, candidates)
+            chords, positions = np.atleast_1d(chords), np.atleast_1d(positions)
+            keep = self.matches(positions, filters)
+            if keep.sum() >= k or candidates == len(self.ids):
+                positions, chords = positions[keep][:k], chords[keep][:k]
+                return self.ids[positions], chord_to_km(chords)
+            candidates *= 4
+
+    def bbox(self, south, west, north, east, **filters):
+        '''Ids of the restaurants within a bounding box that pass the filters, from south to north'''
+        positions = self.by_lat[np.searchsorted(self.sorted_lat, south, side='left'):
+                                np.searchsorted(self.sorted_lat, north, side='right')]
+        lon = self.lon[positions]
+        # a box across the antimeridian has west > east
+        inside = (lon >= west) & (lon <= east) if west <= east else (lon >= west) | (lon <= east)
+        positions = positions[inside]
+        return self.ids[positions[self.matches(positions, filters)]]
+
+    def save(self, path):
+        np.savez(path, ids=self.ids, lat=self.lat, lon=self.lon, tag_indptr=self.tag_indptr,
+                 tag_indices=self.tag_indices, tag_names=np.array(self.tag_names, dtype=str),
+                 **dict(('column_' + name, values) for name, values in self.columns.items()))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            columns = dict((name[len('column_'):], data[name]) for name in data.files if name.startswith('column_'))
+            return cls(data['ids'], data['lat'], data['lon'], columns, data['tag_indptr'], data['tag_indices'],
+                       [str(name) for name in data['tag_names']])
+
+
+def read_feed(path):
+    '''The restaurants of a jsonlines feed, the last one of an id that occurs more than once'''
+    restaurants = {}
+    with open(path) as f:
+        for line in f:
+            restaurant = json.loads(line)
+            restaurants[restaurant['info']['id']] = restaurant
+    return list(restaurants.values())
+
+
+def from_restaurants(restaurants):
+    '''Index of restaurant items (nested dicts like the feed) that have a location'''
+    restaurants = [r for r in restaurants if r['info'].get('lat') is not None and r['info'].get('lon') is not None]
+    tag_names = {}
+    tag_indptr = [0]
+    tag_indices = []
+    for restaurant in restaurants:
+        for tag in dict.fromkeys(restaurant.get('tags') or []):
+            tag_indices.append(tag_names.setdefault(tag, len(tag_names)))
+        tag_indptr.append(len(tag_indices))
+
+    def values(record, field):
+        # None and the -1 of feeds from before the missing values were None are missing
+        return [np.nan if r[record].get(field) in (None, -1) else r[record][field] for r in restaurants]
+
+    return GeoIndex(
+        [r['info']['id'] for r in restaurants],
+        [r['info']['lat'] for r in restaurants],
+        [r['info']['lon'] for r in restaurants],
+        dict((name, values(record, field)) for name, record, field in FEED_COLUMNS),
+        np.array(tag_indptr, dtype=np.int64),
+        np.array(tag_indices, dtype=np.int32),
+        list(tag_names),
+    )
+
+
+def index_path(feed):
+    '''Path of the index of a feed: iens_amsterdam_20180123.jsonlines has iens_amsterdam_20180123.geo.npz'''
+    return os.path.splitext(feed)[0] + '.geo.npz'
+
+
+def build_index(feed, path=None):
+    '''Builds the index of the restaurants of a jsonlines feed and saves it next to the feed, or at path'''
+    index = from_restaurants(read_feed(feed))
+    index.save(path or index_path(feed))
+    return index
@@ -0,0 +1,280 @@
+'''
+Labels of the restaurant images from the Google Vision API, to find the restaurants with a burger on their pictures
+(see the vision-api notebook).
+
+Every image is labeled only once. A SQLite cache keeps the sha1 of the content of every image url with its ETag and
+Last-Modified, and the labels of every content hash. A new snapshot checks the images of the urls that were seen
+before with a conditional GET, so only new and replaced images are downloaded (an image without an ETag or
+Last-Modified is downloaded and compared by its content hash), and only the ones with new content (not the same
+picture under another url) are sent to the API. The new images are labeled in requests of up to 16 images, the
+maximum of the API, packed over all restaurants. A pool of threads downloads and sends them, at most `rate` requests
+per second (retries included), and tries a failed request again. Images that couldn't be downloaded or labeled are
+tried again in the next run.
+
+    labeler = image_labels.ImageLabeler(image_labels.VisionBackend(APIKEY), cache='../image_labels.sqlite')
+    labels = labeler.label(df['image_urls'])
+    image_labels.restaurant_images(df, labels)
+
+which gives the rows of the iens_images table: the info_id and the images with their image_url and
+label_annotations. The MockBackend stands in for the API to try this offline.
+'''
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+# the maximum number of images and size of a request to the Vision API
+MAX_BATCH = 16
+MAX_BATCH_BYTES = 8 * 1024 * 1024
+
+
+class LabelCache(object):
+    '''Content hash, validators and labels of every image url that was labeled, in a SQLite file'''
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS images (
+                url TEXT PRIMARY KEY,
+                content_hash TEXT,
+                error TEXT,
+                etag TEXT,
+                last_modified TEXT
+            );
+            CREATE TABLE IF NOT EXISTS labels (
+                content_hash TEXT PRIMARY KEY,
+                labels TEXT
+            );
+        ''')
+        # caches of before the validators were kept
+        columns = set(row[1] for row in self.connection.execute('PRAGMA table_info(images)'))
+        for column in ['etag', 'last_modified']:
+            if column not in columns:
+                self.connection.execute('ALTER TABLE images ADD COLUMN %s TEXT' % column)
+
+    def labeled(self, urls):
+        '''The content hash, ETag and Last-Modified of the urls that have labels, as a dict by url'''
+        found = dict((row[0], row[1:]) for row in self.connection.execute(
+            'SELECT url, content_hash, etag, last_modified FROM images JOIN labels USING (content_hash)'))
+        return dict((url, found[url]) for url in urls if url in found)
+
+    def labeled_hashes(self):
+        return set(content_hash for content_hash, in self.connection.execute('SELECT content_hash FROM labels'))
+
+    def add(self, url, content_hash, labels=None, error=None, etag=None, last_modified=None):
+        self.connection.execute('INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?)',
+                                (url, content_hash, error, etag, last_modified))
+        if labels is not None:
+            self.connection.execute('INSERT OR REPLACE INTO labels VALUES (?, ?)', (content_hash, json.dumps(labels)))
+
+    def labels(self, urls):
+        '''Labels of the urls that have them, as a dict of url to list of label annotations'''
+        found = dict((url, json.loads(labels)) for url, labels in self.connection.execute(
+            'SELECT url, labels FROM images JOIN labels USING (content_hash)'))
+        return dict((url, found[url]) for url in urls if url in found)
+
+    def commit(self):
+        self.connection.commit()
+
+
+class RateLimiter(object):
+    '''Spaces calls of wait() from any thread at least 1 / rate seconds apart'''
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class VisionBackend(object):
+    '''Label detection of the Google Vision API, with an API key'''
+
+    def __init__(self, api_key, max_results=10):
+        self.api_key = api_key
+        self.max_results = max_results
+        self.local = threading.local()
+
+    def service(self):
+        # a service per thread, as its http connection isn't thread safe
+        if not hasattr(self.local, 'images'):
+            from googleapiclient.discovery import build
+            self.local.images = build('vision', 'v1', developerKey=self.api_key).images()
+        return self.local.images
+
+    def label(self, contents):
+        '''Labels of each image, as a list of (label annotations, None) or (None, error message)'''
+        requests = [{'image': {'content': base64.b64encode(content).decode('ascii')},
+                     'features': [{'type': 'LABEL_DETECTION', 'maxResults': self.max_results}]}
+                    for content in contents]
+        responses = self.service().annotate(body={'requests': requests}).execute()['responses']
+        return [(None, response['error'].get('message')) if 'error' in response
+                else (response.get('labelAnnotations', []), None) for response in responses]
+
+
+class MockBackend(object):
+    '''Stand-in for the Vision API, of which the labels only depend on the content of the image'''
+
+    def __init__(self, descriptions=('food', 'dish', 'hamburger', 'restaurant', 'drink')):
+        self.descriptions = descriptions
+
+    def label(self, contents):
+        results = []
+        for content in contents:
+            digest = hashlib.sha1(content).digest()
+            results.append(([{'description': self.descriptions[b % len(self.descriptions)], 'score': b / 255.0}
+                             for b in digest[:3]], None))
+        return results
+
+
+def download(url, timeout, etag=None, last_modified=None):
+    '''
+    Downloads an image, returns its content, ETag and Last-Modified. Given the ETag or Last-Modified of an earlier
+    download, the content is None when the image didn't change since.
+    '''
+    request = urllib.request.Request(url)
+    if etag:
+        request.add_header('If-None-Match', etag)
+    if last_modified:
+        request.add_header('If-Modified-Since', last_modified)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.read(), response.headers.get('ETag'), response.headers.get('Last-Modified')
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and (etag or last_modified):
+            return None, etag, last_modified
+        raise
+
+
+def pack(images, max_images=MAX_BATCH, max_bytes=MAX_BATCH_BYTES):
+    '''Splits a list of (key, content) into batches of at most max_images images and max_bytes bytes'''
+    batch, size = [], 0
+    for key, content in images:
+        if batch and (len(batch) == max_images or size + len(content) > max_bytes):
+            yield batch
+            batch, size = [], 0
+        batch.append((key, content))
+        size += len(content)
+    if batch:
+        yield batch
+
+
+class ImageLabeler(object):
+
+    def __init__(self, backend, cache, workers=8, rate=10, retries=3, retry_delay=1.0, timeout=30):
+        '''
+        Labels images with the backend (VisionBackend or MockBackend), caching the labels in the SQLite file cache.
+        At most `workers` requests are in flight, and at most `rate` requests per second are sent to the backend.
+        '''
+        self.backend = backend
+        self.cache = LabelCache(cache)
+        self.workers = workers
+        self.rate_limiter = RateLimiter(rate)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+
+    def retry(self, function, *args):
+        for attempt in range(self.retries + 1):
+            try:
+                return function(*args)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning('%s failed (%r), trying again', function.__name__, e)
+                time.sleep(self.retry_delay * 2 ** attempt)
+
+    def label_images(self, contents):
+        # every try takes its turn of the rate limit, so retries don't go over it
+        self.rate_limiter.wait()
+        return self.backend.label(contents)
+
+    def label_batch(self, urls, labeled, labeled_hashes):
+        '''
+        Downloads a batch of urls (the labeled ones only when they changed) and labels the images with new content,
+        returns a (url, hash, labels, error, etag, last_modified) each
+        '''
+        results, images = [], {}
+        for url in urls:
+            content_hash, etag, last_modified = labeled.get(url, (None, None, None))
+            try:
+                content, etag, last_modified = self.retry(download, url, self.timeout, etag, last_modified)
+            except Exception as e:
+                # an image that was labeled before keeps its labels
+                results.append((url, content_hash, None, 'download failed: %r' % e, etag, last_modified))
+                continue
+            if content is not None:
+                content_hash = hashlib.sha1(content).hexdigest()
+            if content is None or content_hash in labeled_hashes:
+                results.append((url, content_hash, None, None, etag, last_modified))
+            else:
+                images.setdefault(content_hash, (content, []))[1].append((url, etag, last_modified))
+        for batch in pack((content_hash, content) for content_hash, (content, _) in images.items()):
+            try:
+                labels = self.retry(self.label_images, [content for _, content in batch])
+            except Exception as e:
+                labels = [(None, 'labeling failed: %r' % e)] * len(batch)
+            for (content_hash, _), (annotations, error) in zip(batch, labels):
+                for url, etag, last_modified in images[content_hash][1]:
+                    results.append((url, content_hash, annotations, error, etag, last_modified))
+        return results
+
+    def label(self, urls):
+        '''
+        Labels the images of the urls that weren't labeled before or changed since, returns a dict of url to label
+        annotations for all urls that have labels (not the ones that couldn't be downloaded or labeled).
+        '''
+        urls = list(dict.fromkeys(url for url in urls if isinstance(url, str)))
+        labeled = self.cache.labeled(urls)
+        labeled_hashes = self.cache.labeled_hashes()
+        logger.info('Labeling %d new images, checking %d labeled ones for changes', len(urls) - len(labeled),
+                    len(labeled))
+        # the new urls in batches of their own, as only images with new content are packed into a request
+        ordered = [url for url in urls if url not in labeled] + [url for url in urls if url in labeled]
+        batches = [ordered[i:i + MAX_BATCH] for i in range(0, len(ordered), MAX_BATCH)]
+        with ThreadPoolExecutor(self.workers) as executor:
+            futures = [executor.submit(self.label_batch, batch, labeled, labeled_hashes) for batch in batches]
+            for future in as_completed(futures):
+                for url, content_hash, labels, error, etag, last_modified in future.result():
+                    self.cache.add(url, content_hash, labels, error, etag, last_modified)
+                # what is labeled is kept, also when the run is interrupted
+                self.cache.commit()
+        return self.cache.labels(urls)
+
+
+def restaurant_images(restaurants, labels):
+    '''
+    The images of each restaurant with their labels, the rows of the iens_images table. The restaurants are a
+    dataframe with an info_id and an image_urls column, with a row per image url.
+    '''
+    rows = []
+    for restaurant_id, image_urls in restaurants.groupby('info_id')['image_urls']:
+        images = []
+        for url in image_urls:
+            image = {'image_url': url}
+            # images without labels are left without label_annotations, like in the notebook
+            if url in labels:
+                image['label_annotations'] = labels[url]
+            images.append(image)
+        rows.append({'info_id': restaurant_id, 'images': images})
+    return rows
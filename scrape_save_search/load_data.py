@@ -1,29 +1,146 @@
-import pandas_gbq as gbq
+import numpy as np
 import pandas as pd
+import datetime as dt
 import json
-
-
-PRIVATE_KEY = '../google-credentials/gsdk-credentials.json'
-PROJECT_ID = json.load(open(PRIVATE_KEY))['project_id']
-
-
-def load_comments():
+import os
+
+
+# relative to the repository rather than the working directory, so the notebooks and the cli find the same files
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PRIVATE_KEY = os.path.join(ROOT, 'google-credentials', 'gsdk-credentials.json')
+SCHEMA = os.path.join(ROOT, 'data', 'iens_schema.json')
+COMMENTS_SCHEMA = os.path.join(ROOT, 'data', 'iens_comments_schema.json')
+ELASTIC_TAGS = os.path.join(ROOT, 'data', 'elasticsearch_burger_tags.csv')
+IMAGE_TAGS = os.path.join(ROOT, 'data', 'image_tags.csv')
+
+# 'bigquery' to query the tables in BigQuery, 'local' to read them from the crawl output files in LOCAL_DATA_DIR
+BACKEND = os.environ.get('IENS_BACKEND', 'bigquery')
+LOCAL_DATA_DIR = os.environ.get('IENS_DATA_DIR', os.path.join(ROOT, 'dockeroutput'))
+
+
+class BigQueryBackend(object):
+    '''Queries the tables in BigQuery'''
+
+    def __init__(self, private_key=None):
+        self.private_key = private_key or PRIVATE_KEY
+        self.project_id = None
+
+    def read(self, table, select, where=None):
+        import pandas_gbq as gbq
+        # the credentials are only read by the first query
+        if self.project_id is None:
+            with open(self.private_key) as f:
+                self.project_id = json.load(f)['project_id']
+        query = "SELECT {} FROM {}".format(', '.join(select), table)
+        if where is not None:
+            query += " WHERE {}".format(where)
+        return gbq.read_gbq(query, project_id=self.project_id, private_key=self.private_key)
+
+
+def arrow_type(field):
+    '''Arrow type of a field of a BigQuery schema, as the Parquet export of the crawl writes it'''
+    import pyarrow as pa
+    if field['type'] == 'record':
+        value_type = pa.struct([pa.field(f['name'], arrow_type(f)) for f in field['fields']])
+    else:
+        value_type = {'integer': pa.int64(), 'float': pa.float64(), 'string': pa.string(), 'boolean': pa.bool_(),
+                      'date': pa.date32()}[field['type']]
+    return pa.list_(value_type) if field.get('mode', '').lower() == 'repeated' else value_type
+
+
+def read_feed(path, schema):
+    '''
+    Reads a jsonlines feed into an Arrow table with the types of its BigQuery schema, for DuckDB 0.3 that can't read
+    json itself. Unlike Parquet the whole feed is read, so this is the slow way to query a crawl.
+    '''
+    import pyarrow as pa
+    with open(path, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    columns = []
+    for field in schema:
+        values = [record.get(field['name']) for record in records]
+        if field['type'] == 'date':
+            values = [dt.datetime.strptime(value, '%Y-%m-%d').date() if value else None for value in values]
+        columns.append(pa.array(values, type=arrow_type(field)))
+    return pa.Table.from_arrays(columns, schema=pa.schema([pa.field(f['name'], arrow_type(f)) for f in schema]))
+
+
+class LocalBackend(object):
+    '''
+    Queries the crawl output files (Parquet, or the jsonlines feed as fallback) with DuckDB, which only reads the
+    selected columns and pushes the where clause down into the Parquet scan.
+    '''
+
+    def __init__(self, data_dir=None):
+        self.data_dir = data_dir or LOCAL_DATA_DIR
+
+    def source(self, connection, table):
+        # BigQuery table iens.iens_amsterdam_20180123 is crawl output iens_amsterdam_20180123.parquet/.jsonlines
+        name = table.split('.')[-1]
+        path = os.path.join(self.data_dir, name)
+        if os.path.exists(path + '.parquet'):
+            return "read_parquet('{}')".format(path + '.parquet')
+        schema = json.load(open(COMMENTS_SCHEMA if name.startswith('iens_comments') else SCHEMA))
+        connection.register('feed', read_feed(path + '.jsonlines', schema))
+        return 'feed'
+
+    def read(self, table, select, where=None):
+        import duckdb
+        connection = duckdb.connect()
+        query = "SELECT {} FROM {}".format(', '.join(select), self.source(connection, table))
+        if where is not None:
+            query += " WHERE {}".format(where)
+        return connection.execute(query).fetchdf()
+
+
+def get_backend():
+    return {'bigquery': BigQueryBackend, 'local': LocalBackend}[BACKEND]()
+
+
+def restaurant_columns():
+    '''Names of the restaurant columns as BigQuery flattens them: info_id, ..., reviews_rating, ..., tags'''
+    schema = json.load(open(SCHEMA))
+    return ['_'.join([record['name'], field['name']]) for record in schema if record['type'] == 'record'
+            for field in record['fields']] + ['tags']
+
+
+def select_restaurant_columns(columns, backend):
+    '''Select expressions for flattened restaurant columns, one row per tag like BigQuery does for "SELECT tags"'''
+    select = []
+    for column in columns:
+        if column == 'tags' and isinstance(backend, LocalBackend):
+            select.append("UNNEST(CASE WHEN len(tags) = 0 THEN [NULL::VARCHAR] ELSE tags END) AS tags")
+        elif column.startswith('info_') or column.startswith('reviews_'):
+            record, field = column.split('_', 1)
+            select.append("{}.{} AS {}".format(record, field, column))
+        else:
+            select.append(column)
+    return select
+
+
+def load_comments(columns=None, where=None):
     city = 'amsterdam'
     date = '20180123'
     bq_table_comments = '_'.join(['iens.iens_comments', city, date])
-    query = "SELECT * FROM {}".format(bq_table_comments)
-    return gbq.read_gbq(query, project_id=PROJECT_ID, private_key=PRIVATE_KEY)
+    return get_backend().read(bq_table_comments, columns or ['*'], where)
 
 
-def load_restaurants(rename_cols=True):
-    '''To load a BigQuery table into a Pandas dataframe, all you need is a query, the project_id, and a way to authenticate. '''
+def load_restaurants(rename_cols=True, columns=None, where=None):
+    '''
+    To load a BigQuery table into a Pandas dataframe, all you need is a query, the project_id, and a way to authenticate.
+    Only the given (flattened) columns are read, e.g. ['info_name', 'reviews_rating_food'], and where is a condition
+    on the nested fields, e.g. 'info.avg_price < 30'.
+    '''
     city = 'amsterdam'
     date = '20171228'
     bq_table_restaurants = '_'.join(['iens.iens', city, date])
-    query_restaurants = "SELECT info.*, reviews.*, tags FROM {}".format(bq_table_restaurants)
+    # the id, tags and food rating are needed to deduplicate, tag and sort
+    required = ['info_id', 'tags'] + (['reviews_rating_food'] if rename_cols else [])
+    columns = [column for column in restaurant_columns() if column in set(columns or restaurant_columns()) | set(required)]
+    backend = get_backend()
     return deduplicate_and_tag(
-        gbq
-        .read_gbq(query_restaurants, project_id=PROJECT_ID, private_key=PRIVATE_KEY)
+        backend
+        .read(bq_table_restaurants, select_restaurant_columns(columns, backend), where)
         .set_index('info_id'),
         rename_cols
     )
@@ -31,41 +148,37 @@ def load_restaurants(rename_cols=True):
 
 def deduplicate_and_tag(restaurants, rename_cols):
     '''Merge duplicated restaurants (one row for each tag)'''
-    restaurants, existing_tag_ids, elastic_tag_ids, image_tag_ids = tagging(restaurants, rename_cols)
-    return (
-        restaurants
-        .drop('tags', axis=1)
-        .drop_duplicates()
-    ), existing_tag_ids, elastic_tag_ids, image_tag_ids
+    return tagging(restaurants, rename_cols)
 
 
 def tagging(restaurants, rename_cols):
+    '''
+    Collapses the restaurants to one row each and flags the ones with a hamburger tag from the existing tags,
+    elasticsearch and the vision api. The existing flag is the Hamburger column of the tag matrix, the elastic/image
+    flags are hashed lookups of the index.
+    '''
     elastic_tag_ids = (
-        pd.read_csv('../data/elasticsearch_burger_tags.csv', header=None)
+        pd.read_csv(ELASTIC_TAGS, header=None)
         .iloc[:, 0]
     )
 
     image_tag_ids = (
-        pd.read_csv('../data/image_tags.csv', header=None)
+        pd.read_csv(IMAGE_TAGS, header=None)
         .iloc[:, 0]
     )
 
-    existing_tag_ids = (
-        restaurants
-        .loc[lambda r: r['tags'] == 'Hamburger']
-        .index
-    )
-
-    tag_list = (
-        restaurants
-        .groupby('info_id')
-        .agg({'tags': makelist})
-    )
+    # the rows of the matrix are the restaurants in order of their first row, like the collapsed restaurants below
+    matrix, restaurant_ids, tag_names = tag_matrix(restaurants)
+    hamburger = np.flatnonzero(np.asarray(tag_names) == 'Hamburger')
+    existing = (matrix[:, hamburger[0]].toarray().ravel() if len(hamburger)
+                else np.zeros(len(restaurant_ids), dtype=bool))
+    existing_tag_ids = restaurant_ids[existing]
 
     restaurants = (
         restaurants
-        .assign(tags=tag_list)
-        .assign(existing=lambda x: x.index.isin(existing_tag_ids))
+        .loc[lambda x: ~x.index.duplicated()]
+        .drop('tags', axis=1)
+        .assign(existing=existing)
         .assign(elastic=lambda x: x.index.isin(elastic_tag_ids))
         .assign(image=lambda x: x.index.isin(image_tag_ids))
     )
@@ -77,10 +190,23 @@ def tagging(restaurants, rename_cols):
                              'reviews_price_quality': 'Price quality',
                              'reviews_noise_level': 'Noise level',
                              'reviews_waiting_time': 'Waiting time'})
-            .sort_values('Food rating', ascending=False)
+            .sort_values('Food rating', ascending=False, kind='mergesort')
         )
     return restaurants, existing_tag_ids, elastic_tag_ids, image_tag_ids
 
 
-def makelist(x):
-    return list(x)
+def tag_matrix(restaurants):
+    '''
+    Multi-hot matrix of the tags of restaurants with one row per tag (as loaded from BigQuery), built from the
+    categorical codes of the ids and tags. Returns a sparse boolean matrix of restaurants by tags, and the
+    restaurant ids and tag names of its rows and columns.
+    '''
+    from scipy import sparse
+    restaurant_codes, restaurant_ids = pd.factorize(restaurants.index)
+    tag_codes, tag_names = pd.factorize(restaurants['tags'])
+    tagged = tag_codes != -1
+    matrix = sparse.csr_matrix(
+        (np.ones(tagged.sum(), dtype=bool), (restaurant_codes[tagged], tag_codes[tagged])),
+        shape=(len(restaurant_ids), len(tag_names))
+    )
+    return matrix, restaurant_ids, tag_names
@@ -0,0 +1,294 @@
+'''
+Full-text search over the scraped comments, without an Elasticsearch server.
+
+build_index() reads a comments jsonlines feed once and writes an inverted index to a directory. The comments are
+analyzed like the restaurant_comments_analyzer of the elasticsearch notebook: hyphens become spaces, apostrophes are
+removed, and the tokens are lowercased, stripped of Dutch stop words and ascii folded. Next to the word index, with
+the positions needed for phrase queries, an index of the 3 and 4 character n-grams can be built (the ngram_tokenizer
+of the notebook), which also finds partial words like 'burger' in 'hamburgers'.
+
+The postings are numpy arrays that SearchIndex memory-maps, so opening an index only reads its terms, and a query
+only touches the postings of its own terms. Matches are ranked with BM25.
+
+    search.build_index('../dockeroutput/iens_comments_amsterdam_20180123.jsonlines', '../search_index', ngrams=True)
+    index = search.SearchIndex('../search_index')
+    index.search('burger', size=10000, ngrams=True)
+    index.search('niet lekker', phrase=True)
+'''
+
+import array
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+
+
+# the _dutch_ stop words of Elasticsearch
+DUTCH_STOP_WORDS = frozenset('''
+    de en van ik te dat die in een hij het niet zijn is was op aan met als voor had er maar om hem dan zou of wat
+    mijn men dit zo door over ze zich bij ook tot je mij uit der daar haar naar heb hoe heeft hebben deze u want nog
+    zal me zij nu ge geen omdat iets worden toch al waren veel meer doen toen moet ben zonder kan hun dus alles onder
+    ja eens hier wie werd altijd doch wordt wezen kunnen ons zelf tegen na reeds wil kon niets uw iemand geweest andere
+'''.split())
+
+WORD = re.compile(r'\w+')
+NON_ASCII = re.compile(r'[^\x00-\x7f]')
+MIN_GRAM = 3
+MAX_GRAM = 4
+
+# BM25 parameters, the defaults of Elasticsearch
+K1 = 1.2
+B = 0.75
+
+
+def normalize(text):
+    '''The hyphens_and_apostrophes_strip char filter: hyphens become spaces and apostrophes are removed'''
+    return (text or '').replace('-', ' ').replace("'", '')
+
+
+def fold(token):
+    '''asciifolding: removes the accents, e.g. café -> cafe'''
+    if not NON_ASCII.search(token):
+        return token
+    return ''.join(c for c in unicodedata.normalize('NFKD', token) if not unicodedata.combining(c))
+
+
+def analyze(text):
+    '''
+    Positions and terms of the words of a text. Stop words are removed but still take up a position, so a phrase
+    query knows how far apart its words should be.
+    '''
+    for position, match in enumerate(WORD.finditer(normalize(text).lower())):
+        token = match.group()
+        if token not in DUTCH_STOP_WORDS:
+            yield position, fold(token)
+
+
+def analyze_ngrams(text):
+    '''The 3 and 4 character n-grams of a text, including the spaces and punctuation between words'''
+    text = normalize(text).lower()
+    grams = [text[start:start + n] for n in range(MIN_GRAM, MAX_GRAM + 1) for start in range(len(text) - n + 1)]
+    if NON_ASCII.search(text):
+        return [fold(gram) for gram in grams if gram not in DUTCH_STOP_WORDS]
+    return [gram for gram in grams if gram not in DUTCH_STOP_WORDS]
+
+
+class PostingsWriter(object):
+    '''Collects the postings of one inverted index (words or n-grams) in memory and writes them as numpy arrays'''
+
+    def __init__(self, positions):
+        self.with_positions = positions
+        self.postings = defaultdict(lambda: (array.array('i'), array.array('i'), array.array('i')))
+        self.lengths = array.array('i')
+
+    def add(self, doc, terms):
+        '''Adds a document as a dict of term -> list of positions (or number of occurrences without positions)'''
+        length = 0
+        for term, occurrences in terms.items():
+            docs, frequencies, positions = self.postings[term]
+            docs.append(doc)
+            if self.with_positions:
+                frequencies.append(len(occurrences))
+                positions.extend(occurrences)
+                length += len(occurrences)
+            else:
+                frequencies.append(occurrences)
+                length += occurrences
+        self.lengths.append(length)
+
+    def write(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        terms = sorted(self.postings)
+        sizes = np.array([len(self.postings[term][0]) for term in terms], dtype=np.int64)
+        np.save(os.path.join(directory, 'offsets.npy'), np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64))
+        np.save(os.path.join(directory, 'lengths.npy'), np.frombuffer(self.lengths, dtype=np.intc).astype(np.int32))
+        for name, i in [('docs', 0), ('frequencies', 1)] + ([('positions', 2)] if self.with_positions else []):
+            np.save(os.path.join(directory, name + '.npy'), concatenate([self.postings[term][i] for term in terms]))
+        if self.with_positions:
+            frequencies = np.load(os.path.join(directory, 'frequencies.npy'))
+            np.save(os.path.join(directory, 'position_offsets.npy'),
+                    np.concatenate([[0], np.cumsum(frequencies, dtype=np.int64)]).astype(np.int64))
+        with open(os.path.join(directory, 'terms.json'), 'w') as f:
+            json.dump(terms, f, ensure_ascii=False)
+
+
+def concatenate(arrays):
+    if not arrays:
+        return np.zeros(0, dtype=np.int32)
+    return np.concatenate([np.frombuffer(a, dtype=np.intc) for a in arrays]).astype(np.int32)
+
+
+def build_index(comments, directory, ngrams=False):
+    '''
+    Builds the search index of a comments jsonlines feed in directory. With ngrams=True an n-gram index is built as
+    well, which makes the index a lot larger.
+    '''
+    words = PostingsWriter(positions=True)
+    grams = PostingsWriter(positions=False) if ngrams else None
+    line_offsets = array.array('q')
+    restaurant_ids = array.array('q')
+    with open(comments, 'rb') as f:
+        offset = 0
+        for line in f:
+            if line.strip():
+                review = json.loads(line.decode('utf-8'))
+                doc = len(line_offsets)
+                line_offsets.append(offset)
+                restaurant_ids.append(int(review.get('id') or -1))
+                terms = defaultdict(list)
+                for position, term in analyze(review.get('comment')):
+                    terms[term].append(position)
+                words.add(doc, terms)
+                if grams is not None:
+                    grams.add(doc, Counter(analyze_ngrams(review.get('comment'))))
+            offset += len(line)
+
+    os.makedirs(directory, exist_ok=True)
+    words.write(os.path.join(directory, 'words'))
+    if grams is not None:
+        grams.write(os.path.join(directory, 'ngrams'))
+    np.save(os.path.join(directory, 'line_offsets.npy'), np.frombuffer(line_offsets, dtype=np.int64))
+    np.save(os.path.join(directory, 'restaurant_ids.npy'), np.frombuffer(restaurant_ids, dtype=np.int64))
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump({'source': os.path.abspath(comments), 'documents': len(line_offsets), 'ngrams': ngrams}, f)
+
+
+def gather(values, starts, ends):
+    '''Concatenation of values[start:end] for all start, end without a python loop'''
+    counts = ends - starts
+    indices = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    return values[indices], counts
+
+
+class Postings(object):
+    '''One inverted index (words or n-grams) of a search index, with memory-mapped postings'''
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'terms.json')) as f:
+            self.terms = {term: i for i, term in enumerate(json.load(f))}
+        load = lambda name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+        self.offsets = load('offsets')
+        self.docs = load('docs')
+        self.frequencies = load('frequencies')
+        self.lengths = load('lengths')
+        self.average_length = float(self.lengths.mean()) if len(self.lengths) else 0.0
+        if os.path.exists(os.path.join(directory, 'positions.npy')):
+            self.positions = load('positions')
+            self.position_offsets = load('position_offsets')
+
+    def range(self, term):
+        i = self.terms.get(term)
+        if i is None:
+            return 0, 0
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+    def postings(self, term):
+        '''Sorted ids of the documents with the term, and the number of occurrences in each'''
+        start, end = self.range(term)
+        return np.asarray(self.docs[start:end]), np.asarray(self.frequencies[start:end])
+
+    def idf(self, term):
+        start, end = self.range(term)
+        return math.log(1 + (len(self.lengths) - (end - start) + 0.5) / ((end - start) + 0.5))
+
+    def bm25(self, docs, frequencies, idf):
+        frequencies = frequencies.astype(np.float64)
+        norms = K1 * (1 - B + B * self.lengths[docs] / self.average_length)
+        return idf * frequencies * (K1 + 1) / (frequencies + norms)
+
+    def match(self, terms):
+        '''Documents with any of the terms, and their BM25 scores'''
+        docs, scores = [], []
+        for term, count in Counter(terms).items():
+            term_docs, frequencies = self.postings(term)
+            docs.append(term_docs)
+            scores.append(count * self.bm25(term_docs, frequencies, self.idf(term)))
+        if not docs:
+            return np.zeros(0, dtype=np.int32), np.zeros(0)
+        docs, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+        return docs, np.bincount(inverse.ravel(), weights=np.concatenate(scores), minlength=len(docs))
+
+    def phrase(self, terms):
+        '''
+        Documents with the terms at the given relative positions, given as (position, term), and the number of times
+        the phrase occurs in them
+        '''
+        if not terms:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)
+        candidates = None
+        for _, term in terms:
+            docs, _ = self.postings(term)
+            candidates = docs if candidates is None else np.intersect1d(candidates, docs, assume_unique=True)
+        matches = None
+        first = terms[0][0]
+        for position, term in terms:
+            start, end = self.range(term)
+            postings = start + np.searchsorted(self.docs[start:end], candidates)
+            positions, counts = gather(self.positions, self.position_offsets[postings],
+                                       self.position_offsets[postings + 1])
+            # a match is a (document, start of the phrase) that all terms agree on
+            keys = np.repeat(candidates.astype(np.int64) << 32, counts) + positions - (position - first)
+            keys = keys[positions >= position - first]
+            matches = keys if matches is None else np.intersect1d(matches, keys)
+        return np.unique(matches >> 32, return_counts=True)
+
+
+class SearchIndex(object):
+    '''A search index written by build_index'''
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.words = Postings(os.path.join(directory, 'words'))
+        self.ngrams = Postings(os.path.join(directory, 'ngrams')) if self.meta['ngrams'] else None
+        self.line_offsets = np.load(os.path.join(directory, 'line_offsets.npy'), mmap_mode='r')
+        self.restaurant_ids = np.load(os.path.join(directory, 'restaurant_ids.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return self.meta['documents']
+
+    def match(self, query, ngrams=False):
+        '''Documents that match any term of the query, and their BM25 scores'''
+        if ngrams:
+            if self.ngrams is None:
+                raise ValueError('The index was built without ngrams=True')
+            return self.ngrams.match(list(analyze_ngrams(query)))
+        return self.words.match([term for _, term in analyze(query)])
+
+    def phrase(self, query):
+        '''Documents that contain the words of the query in this order, and their BM25 scores'''
+        terms = list(analyze(query))
+        docs, frequencies = self.words.phrase(terms)
+        idf = sum(self.words.idf(term) for _, term in terms)
+        return docs, self.words.bm25(docs, frequencies, idf)
+
+    def count(self, word):
+        '''Documents with the (analyzed) word and the number of times it occurs in them'''
+        terms = [term for _, term in analyze(word)]
+        if len(terms) != 1:
+            raise ValueError('%r is not a single (non stop) word' % word)
+        return self.words.postings(terms[0])
+
+    def documents(self, docs):
+        '''The reviews of the documents, as they are in the comments feed'''
+        reviews = []
+        with open(self.meta['source'], 'rb') as f:
+            for doc in docs:
+                f.seek(int(self.line_offsets[doc]))
+                reviews.append(json.loads(f.readline().decode('utf-8')))
+        return reviews
+
+    def search(self, query, size=10, phrase=False, ngrams=False):
+        '''
+        The best matching reviews of a query as a dataframe with their score, like the results of the match query of
+        the elasticsearch notebook. With phrase=True only the reviews that contain the query as a phrase match.
+        '''
+        docs, scores = self.phrase(query) if phrase else self.match(query, ngrams)
+        order = np.argsort(-scores, kind='mergesort')[:size]
+        results = pd.DataFrame(self.documents(docs[order]))
+        return results.assign(score=scores[order])
@@ -0,0 +1,251 @@
+'''
+Differences between two snapshots of a table (two daily crawls of a city), as a delta feed of the added, removed and
+changed restaurants or reviews, with the fields that changed.
+
+A restaurant is identified by its id, a review by the restaurant id, reviewer, date and comment (the TABLE_KEYS of
+the scraper schemas, which the uploads deduplicate on as well). Both snapshots are first
+split by a hash of the key into partitions on disk, after which one partition of each snapshot at a time is compared
+in memory. So the memory a diff takes is that of a partition, whatever the size of the snapshots. Snapshots are
+jsonlines feeds or Parquet files of the crawl (see the scraper pipelines).
+
+    snapshot_diff.diff('../dockeroutput/iens_amsterdam_20180122.jsonlines',
+                       '../dockeroutput/iens_amsterdam_20180123.jsonlines',
+                       '../dockeroutput/iens_delta_amsterdam_20180123.jsonlines')
+
+or from the command line:
+
+    $ python snapshot_diff.py OLD NEW DELTA [--partitions 64]
+
+Every row of the delta has an op (added, removed or changed), the table, the key and the restaurant id. An added row
+has the record, a changed row the changes: the field (info.avg_price, tags, ...) with its old and new value, as json,
+and whether the field was removed (then it has no new value). A field that wasn't in the old record has no old value.
+Removed and changed rows have the sha1 hash of the old record. The delta can be loaded into BigQuery with the schema
+data/iens_delta_schema.json, and apply_delta() turns the old snapshot and the delta into the new snapshot again.
+'''
+
+import argparse
+import datetime as dt
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import zlib
+from collections import Counter
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scraper'))
+
+from scraper.schemas import TABLE_KEYS
+
+
+def record_table(record):
+    '''iens for restaurants, iens_comments for reviews'''
+    return 'iens' if 'info' in record else 'iens_comments'
+
+
+def record_key(table, record):
+    '''The values of the key fields of a record (TABLE_KEYS), or the value itself for a key of one field'''
+    values = []
+    for field in TABLE_KEYS[table]:
+        value = record
+        for name in field.split('.'):
+            value = value[name]
+        values.append(value)
+    return values[0] if len(values) == 1 else values
+
+
+def restaurant_id(record):
+    return record['info']['id'] if 'info' in record else record['id']
+
+
+def to_json(value):
+    return json.dumps(value, sort_keys=True, ensure_ascii=False)
+
+
+def normalize(value):
+    # dates of a Parquet file as the strings of the jsonlines feed, also when pandas wrote them as timestamps
+    if isinstance(value, dict):
+        return dict((name, normalize(v)) for name, v in value.items())
+    if isinstance(value, list):
+        return [normalize(v) for v in value]
+    if isinstance(value, dt.datetime) and value.time() == dt.time():
+        return value.date().isoformat()
+    if isinstance(value, dt.date):
+        return value.isoformat()
+    return value
+
+
+def read_snapshot(path):
+    '''The records of a jsonlines feed or Parquet file, one at a time'''
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        for i in range(parquet_file.num_row_groups):
+            columns = parquet_file.read_row_group(i).to_pydict()
+            names = list(columns)
+            for values in zip(*[columns[name] for name in names]):
+                yield normalize(dict(zip(names, values)))
+    else:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def record_hash(line):
+    return hashlib.sha1(line.encode('utf-8')).hexdigest()
+
+
+def partition(path, directory, partitions):
+    '''
+    Writes the records of a snapshot to a file per partition in directory, as a line with the table, key and record
+    in canonical json (sorted keys), so the same record gives the same line in both snapshots
+    '''
+    files = [open(os.path.join(directory, '%d.jsonlines' % i), 'w', encoding='utf-8') for i in range(partitions)]
+    try:
+        for record in read_snapshot(path):
+            table = record_table(record)
+            key = to_json(record_key(table, record))
+            files[zlib.crc32(key.encode('utf-8')) % partitions].write(
+                '%s\t%s\t%s\n' % (table, key, to_json(record)))
+    finally:
+        for f in files:
+            f.close()
+
+
+def read_partition(path):
+    '''The distinct records of a partition by (table, key), as their canonical json lines'''
+    records = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            table, key, record = line.rstrip('\n').split('\t', 2)
+            records.setdefault((table, key), {})[record] = None
+    return records
+
+
+def flatten(record, prefix=''):
+    '''The fields of a nested record by their path, e.g. info.avg_price'''
+    fields = {}
+    for name, value in record.items():
+        if isinstance(value, dict):
+            fields.update(flatten(value, prefix + name + '.'))
+        else:
+            fields[prefix + name] = value
+    return fields
+
+
+def changes(old, new):
+    '''
+    The fields that differ between two records, with their old and new value as json. A field that isn't in the new
+    record is removed, with no new value, which is something else than a new value of null. Likewise a field that
+    isn't in the old record has no old value.
+    '''
+    old, new = flatten(old), flatten(new)
+    return [{'field': field, 'old': to_json(old[field]) if field in old else None,
+             'new': to_json(new[field]) if field in new else None, 'removed': field not in new}
+            for field in sorted(set(old) | set(new)) if field not in old or field not in new or old[field] != new[field]]
+
+
+def diff_partition(old_path, new_path):
+    '''The delta rows of a partition of both snapshots'''
+    old_records, new_records = read_partition(old_path), read_partition(new_path)
+    for table, key in sorted(set(old_records) | set(new_records)):
+        old = [record for record in old_records.get((table, key), ()) if record not in new_records.get((table, key), ())]
+        new = [record for record in new_records.get((table, key), ()) if record not in old_records.get((table, key), ())]
+        # records with the same key that didn't stay the same: the first ones changed, the rest came or went
+        for old_record, new_record in zip(old, new):
+            old_values, new_values = json.loads(old_record), json.loads(new_record)
+            yield {'op': 'changed', 'table': table, 'key': key, 'id': restaurant_id(new_values),
+                   'hash': record_hash(old_record), 'changes': changes(old_values, new_values)}
+        for new_record in new[len(old):]:
+            yield {'op': 'added', 'table': table, 'key': key, 'id': restaurant_id(json.loads(new_record)),
+                   'record': new_record}
+        for old_record in old[len(new):]:
+            yield {'op': 'removed', 'table': table, 'key': key, 'id': restaurant_id(json.loads(old_record)),
+                   'hash': record_hash(old_record)}
+
+
+def diff(old_path, new_path, delta_path, partitions=64):
+    '''Writes the delta between two snapshots to delta_path as jsonlines, returns the number of rows of each op'''
+    directory = tempfile.mkdtemp()
+    try:
+        for name, path in [('old', old_path), ('new', new_path)]:
+            os.makedirs(os.path.join(directory, name))
+            partition(path, os.path.join(directory, name), partitions)
+        counts = Counter()
+        with open(delta_path, 'w', encoding='utf-8') as f:
+            for i in range(partitions):
+                for row in diff_partition(os.path.join(directory, 'old', '%d.jsonlines' % i),
+                                          os.path.join(directory, 'new', '%d.jsonlines' % i)):
+                    f.write(to_json(row) + '\n')
+                    counts[row['op']] += 1
+        return counts
+    finally:
+        shutil.rmtree(directory)
+
+
+def apply_changes(record, changes):
+    for change in changes:
+        *path, name = change['field'].split('.')
+        fields = record
+        for part in path:
+            fields = fields.setdefault(part, {})
+        if change.get('removed'):
+            fields.pop(name, None)
+        else:
+            fields[name] = json.loads(change['new'])
+    return record
+
+
+def apply_delta(snapshot_path, delta_path, output_path, partitions=64):
+    '''
+    Writes the snapshot the delta was taken to, from the old snapshot (the delta is kept in memory). The old snapshot
+    is split into partitions like in diff, so only a partition of it is in memory at a time.
+    '''
+    # the removed and changed records by (table, key, hash of the old record)
+    rows = {}
+    added = []
+    with open(delta_path, encoding='utf-8') as f:
+        for line in f:
+            row = json.loads(line)
+            if row['op'] == 'added':
+                added.append(row['record'])
+            else:
+                rows.setdefault((row['table'], row['key'], row['hash']), []).append(row)
+    directory = tempfile.mkdtemp()
+    try:
+        partition(snapshot_path, directory, partitions)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            for i in range(partitions):
+                # the distinct records, so a record that is in the snapshot twice is there once after applying the
+                # delta, as diff compared it once
+                for (table, key), records in read_partition(os.path.join(directory, '%d.jsonlines' % i)).items():
+                    for line in records:
+                        matching = rows.get((table, key, record_hash(line)))
+                        if not matching:
+                            f.write(line + '\n')
+                            continue
+                        row = matching.pop()
+                        if row['op'] == 'changed':
+                            f.write(to_json(apply_changes(json.loads(line), row['changes'])) + '\n')
+            for line in added:
+                f.write(line + '\n')
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Writes the delta between two snapshots of a table')
+    parser.add_argument('old', help='jsonlines or Parquet file of the old snapshot')
+    parser.add_argument('new', help='jsonlines or Parquet file of the new snapshot')
+    parser.add_argument('delta', help='jsonlines file to write the delta to')
+    parser.add_argument('--partitions', type=int, default=64,
+                        help='number of partitions, the memory a diff takes is that of one partition')
+    args = parser.parse_args()
+    counts = diff(args.old, args.new, args.delta, args.partitions)
+    print(', '.join('%d %s' % (counts[op], op) for op in ['added', 'removed', 'changed']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+'''
+Counts of words in the comments, for exploring many keywords at once.
+
+The comments are tokenized once into a sparse document-term matrix, after which the counts of any word are a column
+lookup instead of a regex over every comment. Words are the case-sensitive \\w+ tokens of the comments, so the
+count of a word is the number of matches of r"\\b" + re.escape(word) + r"\\b", as search_for_word in the analysis
+notebook counts them. Words that aren't a single token (like 'à-la-carte') are still counted with that regex.
+
+    word_counts = WordCounts(load_data.load_comments(), cache='../word_counts.npz')
+    word_counts.counts(['slecht', 'lekker'])
+    word_counts.search_for_word('slecht', minimum_number_of_occurences=2)
+    word_counts.restaurant_counts(['slecht', 'lekker'])
+'''
+
+import hashlib
+import itertools
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+TOKEN = re.compile(r'\w+')
+
+
+def fingerprint(comments):
+    '''Hash of the comment texts, to know if a cached matrix belongs to them'''
+    hashes = pd.util.hash_pandas_object(comments['comment'].fillna(''), index=False).values
+    return hashlib.sha1(hashes.tobytes()).hexdigest()
+
+
+def document_term_matrix(comments):
+    '''Sparse matrix of the number of times each token occurs in each comment, and the tokens of its columns'''
+    tokens = [TOKEN.findall(comment) if isinstance(comment, str) else [] for comment in comments['comment']]
+    lengths = np.fromiter((len(t) for t in tokens), dtype=np.int64, count=len(tokens))
+    codes, vocabulary = pd.factorize(np.array(list(itertools.chain.from_iterable(tokens)), dtype=object))
+    matrix = sparse.csr_matrix(
+        (np.ones(len(codes), dtype=np.int32), (np.repeat(np.arange(len(tokens)), lengths), codes)),
+        shape=(len(tokens), len(vocabulary))
+    )
+    # column slices are what the counts of words are read from
+    return matrix.tocsc(), np.asarray(vocabulary, dtype=str)
+
+
+class WordCounts(object):
+
+    def __init__(self, comments, cache=None):
+        '''
+        Tokenizes the comments (a dataframe with the comment and id columns, as load_data.load_comments gives), or
+        loads the matrix from the cache file when it was saved there for the same comments.
+        '''
+        self.comments = comments
+        key = fingerprint(comments)
+        # np.savez adds the extension when the file name doesn't have it
+        if cache is not None and not cache.endswith('.npz'):
+            cache += '.npz'
+        if cache is not None and os.path.exists(cache):
+            saved = np.load(cache)
+            if str(saved['fingerprint']) == key:
+                self.matrix = sparse.csc_matrix((saved['data'], saved['indices'], saved['indptr']),
+                                                shape=tuple(saved['shape']))
+                self.vocabulary = saved['vocabulary']
+                self.columns = {word: i for i, word in enumerate(self.vocabulary)}
+                return
+        self.matrix, self.vocabulary = document_term_matrix(comments)
+        self.columns = {word: i for i, word in enumerate(self.vocabulary)}
+        if cache is not None:
+            np.savez(cache, data=self.matrix.data, indices=self.matrix.indices, indptr=self.matrix.indptr,
+                     shape=self.matrix.shape, vocabulary=self.vocabulary, fingerprint=key)
+
+    def count(self, word):
+        '''Number of times the word occurs in each comment, as a numpy array'''
+        return self.counts([word])[word].values
+
+    def counts(self, words):
+        '''Dataframe with the number of times each of the words occurs in each comment, a column per distinct word'''
+        words = list(dict.fromkeys(words))
+        counts = pd.DataFrame(0, index=self.comments.index, columns=words, dtype=np.int32)
+        tokens = [word for word in words if TOKEN.fullmatch(word) and word in self.columns]
+        if tokens:
+            counts[tokens] = self.matrix[:, [self.columns[word] for word in tokens]].toarray()
+        for word in words:
+            if not TOKEN.fullmatch(word):
+                pattern = re.compile(r"\b" + re.escape(word) + r"\b")
+                counts[word] = [len(pattern.findall(comment)) if isinstance(comment, str) else 0
+                                for comment in self.comments['comment']]
+        return counts
+
+    def search_for_word(self, word, minimum_number_of_occurences=1):
+        '''The comments with at least minimum_number_of_occurences times the word, with its count in a column'''
+        count = self.count(word)
+        return self.comments.assign(**{word: count})[count >= minimum_number_of_occurences]
+
+    def restaurant_counts(self, words, minimum_number_of_occurences=None):
+        '''
+        Per restaurant id the total number of times each of the words occurs in its comments, or, given
+        minimum_number_of_occurences, the number of its comments with at least that many times the word.
+        '''
+        counts = self.counts(words)
+        if minimum_number_of_occurences is not None:
+            counts = (counts >= minimum_number_of_occurences).astype(int)
+        return counts.groupby(self.comments['id'].values).sum().rename_axis('id')
+
+    def word_totals(self, minimum_number_of_occurences=1):
+        '''Total number of times each word occurs in all comments, for the words that occur often enough'''
+        totals = pd.Series(np.asarray(self.matrix.sum(axis=0)).ravel(), index=self.vocabulary)
+        return totals[totals >= minimum_number_of_occurences].sort_values(ascending=False)
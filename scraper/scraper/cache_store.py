@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# Content-addressed store for the response bodies of the conditional-GET cache (see middlewares.py)
+#
+# Bodies are saved zlib compressed under their sha1, so pages with the same content are only stored once. A SQLite
+# index keeps per url the validators (ETag, Last-Modified) to revalidate with, and per body its size and last use,
+# which is what the store is evicted on when it grows over its size limit.
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+
+
+class ResponseStore(object):
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(directory, 'bodies'), exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(directory, 'index.sqlite'))
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS entries (
+                url_hash TEXT PRIMARY KEY,
+                url TEXT,
+                status INTEGER,
+                headers TEXT,
+                body_hash TEXT,
+                etag TEXT,
+                last_modified TEXT
+            );
+            CREATE TABLE IF NOT EXISTS bodies (
+                hash TEXT PRIMARY KEY,
+                size INTEGER,
+                last_used REAL
+            );
+            CREATE INDEX IF NOT EXISTS bodies_last_used ON bodies (last_used);
+        ''')
+        self.size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM bodies').fetchone()[0]
+
+    def body_path(self, body_hash):
+        return os.path.join(self.directory, 'bodies', body_hash[:2], body_hash + '.z')
+
+    def get(self, url_hash):
+        '''Cached entry of a url as a dict, or None when it isn't in the store'''
+        row = self.connection.execute('SELECT status, headers, body_hash, etag, last_modified FROM entries '
+                                      'WHERE url_hash = ?', (url_hash,)).fetchone()
+        if row is None:
+            return None
+        return {'status': row[0], 'headers': json.loads(row[1]), 'body_hash': row[2], 'etag': row[3],
+                'last_modified': row[4]}
+
+    def read_body(self, body_hash):
+        with open(self.body_path(body_hash), 'rb') as f:
+            body = zlib.decompress(f.read())
+        self.connection.execute('UPDATE bodies SET last_used = ? WHERE hash = ?', (time.time(), body_hash))
+        return body
+
+    def put(self, url_hash, url, status, headers, body, etag, last_modified):
+        '''Stores a response and returns the hash of its body'''
+        body_hash = hashlib.sha1(body).hexdigest()
+        if not os.path.exists(self.body_path(body_hash)):
+            os.makedirs(os.path.dirname(self.body_path(body_hash)), exist_ok=True)
+            compressed = zlib.compress(body)
+            with open(self.body_path(body_hash), 'wb') as f:
+                f.write(compressed)
+            self.connection.execute('INSERT OR REPLACE INTO bodies (hash, size, last_used) VALUES (?, ?, ?)',
+                                    (body_hash, len(compressed), time.time()))
+            self.size += len(compressed)
+        else:
+            self.connection.execute('UPDATE bodies SET last_used = ? WHERE hash = ?', (time.time(), body_hash))
+        self.connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                (url_hash, url, status, json.dumps(headers), body_hash, etag, last_modified))
+        return body_hash
+
+    def evict(self):
+        '''Removes the least recently used bodies (and the urls pointing to them) until the store fits its limit'''
+        evicted = 0
+        while self.size > self.max_bytes:
+            row = self.connection.execute('SELECT hash, size FROM bodies ORDER BY last_used LIMIT 1').fetchone()
+            if row is None:
+                break
+            body_hash, size = row
+            if os.path.exists(self.body_path(body_hash)):
+                os.remove(self.body_path(body_hash))
+            self.connection.execute('DELETE FROM bodies WHERE hash = ?', (body_hash,))
+            self.connection.execute('DELETE FROM entries WHERE body_hash = ?', (body_hash,))
+            self.size -= size
+            evicted += 1
+        return evicted
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
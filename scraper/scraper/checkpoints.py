@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+# State of a crawl in its JOBDIR that the pipelines share with the frontier (see frontier.py)
+#
+# Before every commit of a checkpoint, the frontier sends the frontier_checkpoint signal with a state dict, to which
+# the pipelines add what has to be committed together with the queue, like the size of the feeds they write. The
+# state is stored in the same SQLite transaction as the queue, and a crawl that resumes the JOBDIR reads it back with
+# checkpoint_state, so it can throw away what was written after the checkpoint that it continues from.
+
+import json
+import os
+import sqlite3
+
+FRONTIER_FILE = 'frontier.sqlite'
+
+# sent by the frontier before it commits a checkpoint, with a state dict to add json values to
+frontier_checkpoint = object()
+
+
+def frontier_path(settings):
+    directory = settings.get('JOBDIR')
+    return os.path.join(directory, FRONTIER_FILE) if directory else None
+
+
+def is_resumed(settings):
+    '''Whether the crawl continues a crawl of the same JOBDIR, so the output of that crawl should be appended to'''
+    path = frontier_path(settings)
+    return path is not None and os.path.exists(path)
+
+
+def checkpoint_state(settings):
+    '''The state the pipelines added to the last checkpoint of the crawl that is resumed, empty for a new crawl'''
+    if not is_resumed(settings):
+        return {}
+    connection = sqlite3.connect(frontier_path(settings))
+    try:
+        row = connection.execute("SELECT value FROM state WHERE name = 'checkpoint'").fetchone()
+    except sqlite3.OperationalError:
+        # the crawl was killed before the frontier created its tables
+        row = None
+    finally:
+        connection.close()
+    return json.loads(row[0]) if row else {}
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+# Persistent index of what earlier crawls have seen, used by the spiders in incremental mode
+#
+# The index is a SQLite file that keeps per restaurant id the number of reviews of the previous run, a fingerprint of
+# every review that has been scraped and a hash of the body of every page that has been parsed. All of it is
+# committed together when a crawl finishes, so a page only counts as unchanged when its items were exported by a
+# finished run.
+
+import hashlib
+import os
+import sqlite3
+
+from scraper.schemas import parse_count
+
+
+def review_fingerprint(review):
+    '''Fingerprint of a scraped review, as reviews don't have an id of their own'''
+    key = '\x1f'.join([str(review['id']), review['reviewer'], review['date'], review['comment']])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def page_hash(body):
+    return hashlib.sha1(body).hexdigest()
+
+
+class CrawlIndex(object):
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS restaurants (
+                id INTEGER PRIMARY KEY,
+                nr_reviews INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS reviews (
+                fingerprint TEXT PRIMARY KEY,
+                restaurant_id INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                body_hash TEXT
+            );
+        ''')
+
+    def nr_reviews(self, restaurant_id):
+        '''Number of reviews of the restaurant in the previous run, None if it hasn't been seen before'''
+        row = self.connection.execute('SELECT nr_reviews FROM restaurants WHERE id = ?', (restaurant_id,)).fetchone()
+        return row[0] if row else None
+
+    def is_unchanged(self, restaurant_id, nr_reviews):
+        return nr_reviews is not None and self.nr_reviews(restaurant_id) == nr_reviews
+
+    def update_restaurant(self, restaurant_id, nr_reviews):
+        self.connection.execute('INSERT OR IGNORE INTO restaurants (id) VALUES (?)', (restaurant_id,))
+        self.connection.execute('UPDATE restaurants SET nr_reviews = ? WHERE id = ?', (nr_reviews, restaurant_id))
+
+    def has_review(self, review):
+        return self.connection.execute('SELECT 1 FROM reviews WHERE fingerprint = ?',
+                                       (review_fingerprint(review),)).fetchone() is not None
+
+    def add_reviews(self, restaurant_id, fingerprints):
+        self.connection.executemany('INSERT OR IGNORE INTO reviews (fingerprint, restaurant_id) VALUES (?, ?)',
+                                    [(fingerprint, restaurant_id) for fingerprint in fingerprints])
+
+    def page_unchanged(self, url, body, keep=True):
+        '''
+        Whether a page has the same body as when it was parsed in a previous run, and keeps its hash for the next
+        unless keep is False (then add_pages keeps it later)
+        '''
+        body_hash = page_hash(body)
+        row = self.connection.execute('SELECT body_hash FROM pages WHERE url = ?', (url,)).fetchone()
+        if row is not None and row[0] == body_hash:
+            return True
+        if keep:
+            self.add_pages([(url, body_hash)])
+        return False
+
+    def add_pages(self, pages):
+        '''Keeps the hashes of (url, page_hash) pairs'''
+        self.connection.executemany('INSERT OR REPLACE INTO pages (url, body_hash) VALUES (?, ?)', pages)
+
+    def close(self, commit=True):
+        '''Only commit when the crawl finished, otherwise the next run would skip what this run didn't export'''
+        if commit:
+            self.connection.commit()
+        self.connection.close()
+
+
+def get_listing_counts(link):
+    '''Restaurant id and number of reviews of a restaurant link on a listings page'''
+    restaurant_id = link.xpath('@href').extract_first().split('/')[-1].split('?')[0]
+    nr_reviews_text = link.xpath('ancestor::li[@class="resultItem"][1]/descendant::*[contains(concat(" ", '
+                                 'normalize-space(@class), " "), " reviewsCount ")]/a/text()').extract_first()
+    return int(restaurant_id), parse_count(nr_reviews_text)
+
+
+def open_index(spider, incremental, index, placename):
+    '''Opens the crawl index when the spider runs with -a incremental=true'''
+    if str(incremental).lower() != 'true':
+        return None
+    return CrawlIndex(index or os.path.join('index', '%s_%s.sqlite' % (spider.name, placename)))
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+# Define here your item exporters
+#
+# See documentation in:
+# http://doc.scrapy.org/en/latest/topics/exporters.html
+#
+# The json exporters of Scrapy only write dicts and BaseItems as json objects, these also write the nested records of
+# items.py. They are the exporters of the json and jsonlines feeds (FEED_EXPORTERS in settings.py), and the
+# SplitFeedPipeline (see pipelines.py) writes its feeds with them too.
+
+from scrapy.exporters import JsonItemExporter, JsonLinesItemExporter
+
+from scraper.items import Record
+
+
+class RecordSerializer(object):
+
+    def serialize_field(self, field, name, value):
+        if isinstance(value, Record):
+            value = value.to_dict()
+        return super(RecordSerializer, self).serialize_field(field, name, value)
+
+
+class RecordJsonItemExporter(RecordSerializer, JsonItemExporter):
+    pass
+
+
+class RecordJsonLinesItemExporter(RecordSerializer, JsonLinesItemExporter):
+    pass
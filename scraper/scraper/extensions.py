@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+# Define here your extensions
+#
+# See documentation in:
+# http://doc.scrapy.org/en/latest/topics/extensions.html
+
+import json
+import logging
+import os
+import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.reactor import listen_tcp
+from twisted.internet import task
+from twisted.web import server
+
+from scraper.metrics import CProfiler, MetricsResource, StackSampler, crawler_metrics, hottest
+
+logger = logging.getLogger(__name__)
+
+# sent by the AdaptiveConcurrencyMiddleware for a request that failed to download, with request, exception and spider
+download_error = object()
+
+
+class AdaptiveConcurrency(object):
+    # AIMD congestion control of the number of requests in flight per download slot (host).
+    #
+    # A slot starts at CONCURRENT_REQUESTS_PER_DOMAIN (or _PER_IP) and is kept within ADAPTIVE_CONCURRENCY_MIN and
+    # ADAPTIVE_CONCURRENCY_MAX, which is also capped by CONCURRENT_REQUESTS.
+    #
+    # The latencies and statuses of the responses of a slot are collected in windows of ADAPTIVE_CONCURRENCY_WINDOW
+    # responses. After a healthy window (p95 latency within ADAPTIVE_CONCURRENCY_TARGET_LATENCY and an error rate
+    # within ADAPTIVE_CONCURRENCY_MAX_ERROR_RATE) the concurrency of the slot goes up by one, after an unhealthy
+    # window it is multiplied by ADAPTIVE_CONCURRENCY_BACKOFF. A 429 or 503 backs off right away, unless the request
+    # was sent before the previous back off, so a burst of them only halves the concurrency once. As a rate limit
+    # can't be solved by concurrency alone, a 429 or 503 also doubles the download delay of the slot (up to
+    # ADAPTIVE_CONCURRENCY_MAX_DELAY), and every healthy window halves it again.
+    #
+    # Requests that didn't get a response at all (timeouts, refused or lost connections) count as errors of the
+    # window too, with the time until they failed as latency. Only responses pass the response_downloaded signal,
+    # so these come from the AdaptiveConcurrencyMiddleware (see middlewares.py) by the download_error signal.
+
+    THROTTLE_STATUSES = (429, 503)
+    MIN_DELAY = 0.05
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('ADAPTIVE_CONCURRENCY_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.min_concurrency = settings.getint('ADAPTIVE_CONCURRENCY_MIN')
+        self.max_concurrency = settings.getint('ADAPTIVE_CONCURRENCY_MAX')
+        self.target_latency = settings.getfloat('ADAPTIVE_CONCURRENCY_TARGET_LATENCY')
+        self.max_error_rate = settings.getfloat('ADAPTIVE_CONCURRENCY_MAX_ERROR_RATE')
+        self.window_size = settings.getint('ADAPTIVE_CONCURRENCY_WINDOW')
+        self.backoff = settings.getfloat('ADAPTIVE_CONCURRENCY_BACKOFF')
+        self.max_delay = settings.getfloat('ADAPTIVE_CONCURRENCY_MAX_DELAY')
+        self.windows = {}
+        self.last_backoff = {}
+        crawler.signals.connect(self.response_downloaded, signal=signals.response_downloaded)
+        crawler.signals.connect(self.download_error, signal=download_error)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def get_slot(self, request):
+        key = request.meta.get('download_slot')
+        return key, self.crawler.engine.downloader.slots.get(key)
+
+    def response_downloaded(self, response, request, spider):
+        key, slot = self.get_slot(request)
+        latency = request.meta.get('download_latency')
+        if slot is None or latency is None:
+            return
+        if response.status in self.THROTTLE_STATUSES:
+            if time.time() - latency > self.last_backoff.get(key, 0):
+                self.windows[key] = []
+                self.set_concurrency(key, slot, int(slot.concurrency * self.backoff), 'throttled')
+                self.set_delay(key, slot, min(self.max_delay, max(2 * slot.delay, self.MIN_DELAY)))
+            return
+        self.add_to_window(key, slot, latency, response.status >= 500)
+
+    def download_error(self, request, exception, spider):
+        key, slot = self.get_slot(request)
+        sent = request.meta.get('adaptive_concurrency_sent')
+        if slot is None or sent is None:
+            return
+        self.stats.inc_value('adaptive_concurrency/download_errors')
+        self.add_to_window(key, slot, time.time() - sent, True)
+
+    def add_to_window(self, key, slot, latency, error):
+        window = self.windows.setdefault(key, [])
+        window.append((latency, error))
+        if len(window) < self.window_size:
+            return
+        latencies = sorted(latency for latency, _ in window)
+        p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+        error_rate = sum(error for _, error in window) / float(len(window))
+        self.windows[key] = []
+        self.stats.set_value('adaptive_concurrency/%s/p95_latency' % key, p95)
+        if error_rate > self.max_error_rate:
+            self.set_concurrency(key, slot, int(slot.concurrency * self.backoff), 'errors')
+        elif p95 > self.target_latency:
+            self.set_concurrency(key, slot, int(slot.concurrency * self.backoff), 'latency')
+        else:
+            self.set_concurrency(key, slot, slot.concurrency + 1, 'healthy')
+            self.set_delay(key, slot, slot.delay / 2 if slot.delay > self.MIN_DELAY else 0)
+
+    def set_delay(self, key, slot, delay):
+        slot.delay = delay
+        self.stats.set_value('adaptive_concurrency/%s/delay' % key, delay)
+
+    def set_concurrency(self, key, slot, concurrency, reason):
+        concurrency = max(self.min_concurrency, min(self.max_concurrency, concurrency))
+        if concurrency != slot.concurrency:
+            direction = 'increase' if concurrency > slot.concurrency else 'decrease'
+            if direction == 'decrease':
+                self.last_backoff[key] = time.time()
+            self.stats.inc_value('adaptive_concurrency/%s' % direction)
+            self.stats.inc_value('adaptive_concurrency/%s/%s' % (direction, reason))
+            logger.debug('Concurrency of %s: %d -> %d (%s)', key, slot.concurrency, concurrency, reason)
+            slot.concurrency = concurrency
+        self.stats.set_value('adaptive_concurrency/%s/concurrency' % key, concurrency)
+        self.stats.max_value('adaptive_concurrency/%s/max_concurrency' % key, concurrency)
+
+
+class CrawlMetrics(object):
+    # Histograms of the download latency, the response size and the depth of the queues of the crawl, next to the
+    # parse time and items per response of every callback that the CallbackMetricsMiddleware records (see
+    # middlewares.py and metrics.py).
+    #
+    # During the crawl they are served on METRICS_HOST at the first free port of METRICS_PORT, at /metrics in the
+    # Prometheus text format and at /metrics.json. The depth of the scheduler queue and the number of requests in
+    # the downloader and responses in the spider are sampled every METRICS_INTERVAL seconds. When the spider closes,
+    # a summary is logged and written to METRICS_REPORT (which can contain %(name)s and other spider attributes).
+    #
+    # METRICS_PROFILER = 'sampler' also reports the hottest functions of the crawl from a sample of the stack of the
+    # reactor every METRICS_PROFILER_INTERVAL seconds, 'cprofile' from cProfile, which is exact but slows the crawl
+    # down. The cProfile stats are written to METRICS_PROFILE_FILE when it is set.
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        self.metrics = crawler_metrics(crawler)
+        self.port_range = [int(port) for port in settings.getlist('METRICS_PORT')]
+        self.host = settings.get('METRICS_HOST')
+        self.interval = settings.getfloat('METRICS_INTERVAL')
+        self.report_uri = settings.get('METRICS_REPORT')
+        self.profiler = {
+            None: lambda: None,
+            'sampler': lambda: StackSampler(settings.getfloat('METRICS_PROFILER_INTERVAL')),
+            'cprofile': lambda: CProfiler(settings.get('METRICS_PROFILE_FILE')),
+        }[settings.get('METRICS_PROFILER') or None]()
+        self.listening_port = None
+        self.sampling = task.LoopingCall(self.sample_queues)
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(self.response_downloaded, signal=signals.response_downloaded)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def spider_opened(self, spider):
+        if self.port_range:
+            site = server.Site(MetricsResource(self.metrics, self.crawler.stats))
+            self.listening_port = listen_tcp(self.port_range, self.host, site)
+            address = self.listening_port.getHost()
+            logger.info('Metrics at http://%s:%d/metrics', address.host, address.port)
+        self.sampling.start(self.interval)
+        if self.profiler is not None:
+            self.profiler.start()
+
+    def response_downloaded(self, response, request, spider):
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            self.metrics.histogram('download_latency_seconds').record(latency)
+        self.metrics.histogram('response_bytes').record(len(response.body))
+
+    def sample_queues(self):
+        engine = self.crawler.engine
+        if engine is None or engine.slot is None:
+            return
+        scheduled = len(engine.slot.scheduler)
+        self.metrics.histogram('scheduler_queue_depth').record(scheduled)
+        self.metrics.set_gauge('scheduler_queue_depth', scheduled)
+        self.metrics.set_gauge('downloader_active', len(engine.downloader.active))
+        self.metrics.set_gauge('scraper_active', len(engine.scraper.slot.active) if engine.scraper.slot else 0)
+
+    def spider_closed(self, spider, reason):
+        if self.sampling.running:
+            self.sampling.stop()
+        if self.listening_port is not None:
+            self.listening_port.stopListening()
+        report = self.metrics.to_json()
+        if self.profiler is not None:
+            self.profiler.stop()
+            report['hottest_functions'] = hottest(self.profiler.functions(), 20)
+        logger.info('Crawl metrics:\n%s', format_report(report))
+        if self.report_uri:
+            path = self.report_uri % dict(vars(spider), name=spider.name)
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+
+
+def format_report(report):
+    '''The histograms and the hottest functions of a report of the CrawlMetrics as a table'''
+    lines = ['%-40s %8s %10s %10s %10s %10s %10s' % ('', 'count', 'mean', 'p50', 'p90', 'p99', 'max')]
+    for histogram in report['histograms']:
+        name = histogram['name'] + ''.join(' %s' % value for value in histogram['labels'].values())
+        lines.append('%-40s %8d %s' % (name, histogram['count'], ' '.join(
+            '%10.4g' % histogram[key] if histogram[key] is not None else '%10s' % '-'
+            for key in ['mean', 'p50', 'p90', 'p99', 'max'])))
+    for kind, functions in sorted(report.get('hottest_functions', {}).items()):
+        lines.append('hottest functions (%s):' % ('own time' if kind == 'own' else 'scraper package, total time'))
+        for function in functions[:10]:
+            lines.append('  %8.2fs %8.2fs  %s' % (function['own_seconds'], function['total_seconds'],
+                                                  function['function']))
+    return '\n'.join(lines)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+# Persistent request frontier, so a crawl that dies halfway can be resumed instead of starting over
+#
+# Enabled by setting JOBDIR, like Scrapy's own persistence: scrapy crawl comments_spider -s JOBDIR=jobs/amsterdam
+# Running the same command again resumes the crawl. Without JOBDIR the default Scrapy scheduler is used.
+#
+# The pending requests are kept in a SQLite file in the JOBDIR instead of in memory, so the frontier of a large crawl
+# (all review pages of a city) takes no memory. The fingerprints of the requests that were scheduled are kept in a
+# Bloom filter, a fixed size bit array instead of a set of every fingerprint: FRONTIER_BLOOM_CAPACITY fingerprints at
+# a false positive rate of FRONTIER_BLOOM_ERROR_RATE (a false positive is a request that is dropped as duplicate).
+#
+# Every FRONTIER_CHECKPOINT_INTERVAL seconds the queue, the Bloom filter and the requests that are being downloaded at
+# that moment are committed in one SQLite transaction, together with the size of the feeds (see checkpoints.py). The
+# checkpoint waits for a moment that no response is being parsed and no item is in the pipelines, so every item in
+# the feeds comes from a request that the checkpoint counts as done, and none from a request in flight. A crawl that
+# is killed resumes from its last checkpoint: the requests that were in flight then are put back in the queue, the
+# requests that were done since are in the queue still, and the feeds are cut back to their size at the checkpoint,
+# so the items of all of these requests are only written again once. A crawl that is stopped with Ctrl-C finishes the
+# requests in flight first and resumes without downloading anything twice.
+
+import json
+import logging
+import math
+import os
+import pickle
+import sqlite3
+import weakref
+
+from scrapy.core.scheduler import Scheduler
+from scrapy.utils.job import job_dir
+from scrapy.utils.reqser import request_to_dict, request_from_dict
+from scrapy.utils.request import request_fingerprint
+from twisted.internet import reactor, task
+
+from scraper.checkpoints import FRONTIER_FILE, frontier_checkpoint
+
+logger = logging.getLogger(__name__)
+
+# seconds between the tries of a checkpoint that waits for the responses that are being parsed
+CHECKPOINT_RETRY_DELAY = 0.01
+
+
+class BloomFilter(object):
+    '''Set of fingerprints in a bit array, with k bit positions per fingerprint from two hashes (double hashing)'''
+
+    def __init__(self, capacity, error_rate, bits=None):
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray(bits) if bits is not None else bytearray((self.size + 7) // 8)
+        if len(self.bits) != (self.size + 7) // 8:
+            raise ValueError('Bloom filter of %d bytes doesn\'t match a capacity of %d at an error rate of %s' %
+                             (len(self.bits), capacity, error_rate))
+
+    def positions(self, fingerprint):
+        # the fingerprint is a sha1 hex digest already, so its bytes are uniform hashes
+        digest = bytes.fromhex(fingerprint)
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, fingerprint):
+        '''Adds the fingerprint and returns whether it was (probably) added before'''
+        seen = True
+        for position in self.positions(fingerprint):
+            byte, bit = position >> 3, 1 << (position & 7)
+            if not self.bits[byte] & bit:
+                self.bits[byte] |= bit
+                seen = False
+        return seen
+
+
+class FrontierScheduler(object):
+
+    def __init__(self, crawler, path, bloom_capacity, bloom_error_rate, checkpoint_interval):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.path = path
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        self.checkpoint_interval = checkpoint_interval
+        # requests that can't be pickled (like Scrapy's scheduler, they are kept in memory and lost when killed)
+        self.memory = []
+        # requests handed to the engine from disk, to tell them apart from other requests in flight (robots.txt)
+        self.dequeued = weakref.WeakSet()
+        self.closed = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        directory = job_dir(settings)
+        if not directory:
+            return Scheduler.from_crawler(crawler)
+        return cls(crawler, os.path.join(directory, FRONTIER_FILE),
+                   settings.getint('FRONTIER_BLOOM_CAPACITY'),
+                   settings.getfloat('FRONTIER_BLOOM_ERROR_RATE'),
+                   settings.getfloat('FRONTIER_CHECKPOINT_INTERVAL'))
+
+    def open(self, spider):
+        self.spider = spider
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS requests (
+                id INTEGER PRIMARY KEY,
+                priority INTEGER,
+                request BLOB
+            );
+            CREATE INDEX IF NOT EXISTS requests_order ON requests (priority, id);
+            CREATE TABLE IF NOT EXISTS in_flight (
+                priority INTEGER,
+                request BLOB
+            );
+            CREATE TABLE IF NOT EXISTS state (
+                name TEXT PRIMARY KEY,
+                value BLOB
+            );
+        ''')
+        row = self.connection.execute("SELECT value FROM state WHERE name = 'bloom'").fetchone()
+        self.bloom = BloomFilter(self.bloom_capacity, self.bloom_error_rate, row[0] if row else None)
+        # requests that were in flight at the last checkpoint are downloaded again
+        resumed = self.connection.execute('INSERT INTO requests (priority, request) '
+                                          'SELECT priority, request FROM in_flight').rowcount
+        self.connection.execute('DELETE FROM in_flight')
+        self.connection.commit()
+        self.pending = self.connection.execute('SELECT COUNT(*) FROM requests').fetchone()[0]
+        if self.pending:
+            logger.info('Resuming crawl from %s: %d requests pending, of which %d were in flight',
+                        self.path, self.pending, resumed)
+            self.stats.set_value('frontier/resumed', self.pending)
+        self.checkpoints = task.LoopingCall(self.checkpoint)
+        self.checkpoints.start(self.checkpoint_interval, now=False)
+
+    def close(self, reason):
+        if self.checkpoints.running:
+            self.checkpoints.stop()
+        # the engine closes the scheduler once the responses in flight have been parsed
+        self.commit()
+        self.closed = True
+        self.connection.close()
+
+    def checkpoint(self):
+        '''Commits the frontier at the first moment that no response is being parsed'''
+        if self.closed:
+            return
+        scraper = self.crawler.engine.scraper
+        if scraper.slot is not None and not scraper.slot.is_idle():
+            # the LoopingCall waits for the deferred, so the checkpoints don't pile up
+            self.stats.inc_value('frontier/checkpoint_retries')
+            return task.deferLater(reactor, CHECKPOINT_RETRY_DELAY, self.checkpoint)
+        self.commit()
+
+    def commit(self):
+        '''Commits the queue, the Bloom filter and the checkpoint state, with the requests that are in flight now'''
+        state = {}
+        self.crawler.signals.send_catch_log(frontier_checkpoint, state=state)
+        slot = self.crawler.engine.slot
+        in_flight = [request for request in (slot.inprogress if slot is not None else ()) if request in self.dequeued]
+        self.connection.execute('DELETE FROM in_flight')
+        self.connection.executemany('INSERT INTO in_flight VALUES (?, ?)',
+                                    ((request.priority, self.serialize(request)) for request in in_flight))
+        self.connection.execute("INSERT OR REPLACE INTO state VALUES ('bloom', ?)", (bytes(self.bloom.bits),))
+        self.connection.execute("INSERT OR REPLACE INTO state VALUES ('checkpoint', ?)", (json.dumps(state),))
+        self.connection.commit()
+        self.stats.inc_value('frontier/checkpoints')
+
+    def serialize(self, request):
+        return sqlite3.Binary(pickle.dumps(request_to_dict(request, self.spider), protocol=2))
+
+    def deserialize(self, data):
+        return request_from_dict(pickle.loads(data), self.spider)
+
+    def has_pending_requests(self):
+        return len(self) > 0
+
+    def __len__(self):
+        return self.pending + len(self.memory)
+
+    def enqueue_request(self, request):
+        if not request.dont_filter and self.bloom.add(request_fingerprint(request)):
+            logger.debug('Filtered duplicate request: %(request)s', {'request': request}, extra={'spider': self.spider})
+            self.stats.inc_value('frontier/filtered')
+            return False
+        try:
+            data = self.serialize(request)
+        except (ValueError, pickle.PicklingError, AttributeError, TypeError) as e:
+            logger.warning('Unable to serialize request %(request)s (%(reason)s), keeping it in memory',
+                           {'request': request, 'reason': e}, extra={'spider': self.spider})
+            self.memory.append(request)
+            self.stats.inc_value('scheduler/enqueued/memory')
+        else:
+            self.connection.execute('INSERT INTO requests (priority, request) VALUES (?, ?)', (request.priority, data))
+            self.pending += 1
+            self.stats.inc_value('scheduler/enqueued/disk')
+        self.stats.inc_value('scheduler/enqueued')
+        return True
+
+    def next_request(self):
+        if self.memory:
+            request = self.memory.pop()
+            self.stats.inc_value('scheduler/dequeued/memory')
+        elif self.pending:
+            # highest priority first and the newest request first within a priority (depth first, like Scrapy)
+            row_id, data = self.connection.execute('SELECT id, request FROM requests '
+                                                   'ORDER BY priority DESC, id DESC LIMIT 1').fetchone()
+            self.connection.execute('DELETE FROM requests WHERE id = ?', (row_id,))
+            self.pending -= 1
+            request = self.deserialize(data)
+            self.dequeued.add(request)
+            self.stats.inc_value('scheduler/dequeued/disk')
+        else:
+            return None
+        self.stats.inc_value('scheduler/dequeued')
+        return request
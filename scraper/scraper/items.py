@@ -4,11 +4,136 @@
 #
 # See documentation in:
 # http://doc.scrapy.org/en/latest/topics/items.html
+#
+# The items are records with a fixed set of fields instead of ad-hoc nested dicts. The nested records of a restaurant
+# (info and reviews) keep their values in a slot per field, so a restaurant doesn't carry two dicts with a hash table
+# each. They read like dicts (item['info']['id'], 'info' in item, dict(item['info'])) and have no __dict__. The items
+# the spiders yield are ItemRecords, dicts with a key per field, as Scrapy 1.4 only takes dicts and BaseItems (and a
+# BaseItem has a __dict__ per instance). Scrapy's json encoder doesn't know the nested records, so the json feeds are
+# written by the exporters of exporters.py. A field that isn't on the page is None. The fields are in the order of
+# the dicts the spiders used to yield, so the feeds keep their order; the BigQuery schemas in the data folder have
+# the fields of info and reviews in another order, which doesn't matter as their columns are matched by name.
+
+import pprint
+from abc import ABCMeta
+from collections.abc import Mapping
+from typing import List, Optional
 
 import scrapy
 
 
-class IensScraperItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+class RecordMeta(ABCMeta):
+    # gives a record class a Field for every annotated attribute, in the order they are annotated, and a slot for each
+    # when it keeps its values in slots (a Record) rather than in the dict it is (an ItemRecord)
+
+    def __new__(mcs, class_name, bases, attrs):
+        annotations = attrs.get('__annotations__', {})
+        in_slots = not any(issubclass(base, dict) for base in bases)
+        attrs['__slots__'] = tuple(annotations) if in_slots else ()
+        attrs['fields'] = dict((name, scrapy.Field(type=field_type)) for name, field_type in annotations.items())
+        return super(RecordMeta, mcs).__new__(mcs, class_name, bases, attrs)
+
+
+class Fields(object):
+    # what records and item records have in common
+    __slots__ = ()
+
+    def check_fields(self, values):
+        unknown = set(values) - set(self.fields)
+        if unknown:
+            raise TypeError('%s has no fields %s' % (type(self).__name__, ', '.join(sorted(unknown))))
+
+    def to_dict(self):
+        '''The record as nested dicts'''
+        return dict((name, value.to_dict() if isinstance(value, Record) else value) for name, value in self.items())
+
+    def __repr__(self):
+        return pprint.pformat(self.to_dict())
+
+
+class Record(Fields, Mapping, metaclass=RecordMeta):
+
+    def __init__(self, **values):
+        self.check_fields(values)
+        for name in self.fields:
+            setattr(self, name, values.get(name))
+
+    def __getitem__(self, name):
+        if name not in self.fields:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    # compared by value like a dict, so it can't be hashed either
+    __hash__ = None
+
+
+class ItemRecord(Fields, dict, metaclass=RecordMeta):
+
+    def __init__(self, **values):
+        self.check_fields(values)
+        super(ItemRecord, self).__init__((name, values.get(name)) for name in self.fields)
+
+    def __setitem__(self, name, value):
+        if name not in self.fields:
+            raise KeyError('%s has no field %s' % (type(self).__name__, name))
+        super(ItemRecord, self).__setitem__(name, value)
+
+
+class RestaurantInfo(Record):
+    id: int
+    name: Optional[str]
+    lat: float
+    lon: float
+    street: Optional[str]
+    house_number: Optional[str]
+    postal_code: Optional[str]
+    city: Optional[str]
+    country: Optional[str]
+    avg_price: Optional[int]
+    nr_tags: int
+    nr_images: int
+
+
+class RestaurantReviews(Record):
+    distinction: str
+    rating: Optional[float]
+    nr_ratings: Optional[int]
+    nr_10ratings: Optional[int]
+    nr_9ratings: Optional[int]
+    nr_8ratings: Optional[int]
+    nr_7ratings: Optional[int]
+    nr_7min_ratings: Optional[int]
+    rating_food: Optional[float]
+    rating_service: Optional[float]
+    rating_decor: Optional[float]
+    price_quality: Optional[str]
+    noise_level: Optional[str]
+    waiting_time: Optional[str]
+
+
+class Restaurant(ItemRecord):
+    # a row of the iens table
+    info: RestaurantInfo
+    reviews: RestaurantReviews
+    tags: List[str]
+    image_urls: List[str]
+
+
+class Review(ItemRecord):
+    # a row of the iens_comments table
+    id: int
+    name: Optional[str]
+    comment: str
+    reviewer: str
+    date: str
+    reserved_online: bool
+    rating: float
+    rating_food: Optional[int]
+    rating_service: Optional[int]
+    rating_decor: Optional[int]
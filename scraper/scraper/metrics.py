@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+# Histograms of a crawl, recorded by the CrawlMetrics extension (see extensions.py) and the CallbackMetricsMiddleware
+# (see middlewares.py), the formats they are served in, and the profilers that find the hottest functions of a crawl
+#
+# A Histogram counts values in log-linear buckets like an HDR histogram: every power of two is split into SUB_BUCKETS
+# buckets, so a quantile is within 1% of the recorded values whatever their magnitude (microseconds of parsing or
+# megabytes of a response), and recording a value takes constant time and memory.
+
+import cProfile
+import json
+import math
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+from twisted.web.resource import Resource
+
+SUB_BUCKETS = 64
+QUANTILES = (0.5, 0.9, 0.99)
+
+# files of the scraper package, of which the profilers report the hottest functions separately
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Histogram(object):
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        if value > 0:
+            mantissa, exponent = math.frexp(value)
+            self.buckets[exponent * SUB_BUCKETS + int((mantissa - 0.5) * 2 * SUB_BUCKETS)] += 1
+        else:
+            self.zeros += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        '''The value below which a fraction q of the recorded values lies, the middle of its bucket'''
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = self.zeros
+        if seen >= rank and seen:
+            return 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                exponent, sub_bucket = divmod(index, SUB_BUCKETS)
+                width = math.ldexp(1.0, exponent) / (2 * SUB_BUCKETS)
+                middle = math.ldexp(0.5, exponent) + (sub_bucket + 0.5) * width
+                return min(self.max, max(self.min, middle))
+        return self.max
+
+    def summary(self):
+        summary = {'count': self.count, 'sum': self.total, 'min': self.min, 'max': self.max,
+                   'mean': self.total / self.count if self.count else None}
+        for q in QUANTILES:
+            summary['p%g' % (100 * q)] = self.quantile(q)
+        return summary
+
+
+class Metrics(object):
+    '''The histograms and gauges of a crawl, by name and labels'''
+
+    def __init__(self):
+        self.histograms = {}
+        self.gauges = {}
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        return self.histograms[key]
+
+    def set_gauge(self, name, value):
+        self.gauges[name] = value
+
+    def to_json(self):
+        return {
+            'histograms': [dict(name=name, labels=dict(labels), **histogram.summary())
+                           for (name, labels), histogram in sorted(self.histograms.items())],
+            'gauges': dict(self.gauges),
+        }
+
+    def to_prometheus(self, stats=None, prefix='scrapy_'):
+        '''The histograms as summaries, the gauges and the numeric stats of the crawl in the Prometheus text format'''
+        lines = []
+        for name in sorted(set(name for name, _ in self.histograms)):
+            lines.append('# TYPE %s%s summary' % (prefix, name))
+            for (other, labels), histogram in sorted(self.histograms.items()):
+                if other != name:
+                    continue
+                for q in QUANTILES:
+                    lines.append('%s%s%s %s' % (prefix, name, format_labels(labels + (('quantile', q),)),
+                                                format_value(histogram.quantile(q))))
+                lines.append('%s%s_sum%s %s' % (prefix, name, format_labels(labels), format_value(histogram.total)))
+                lines.append('%s%s_count%s %d' % (prefix, name, format_labels(labels), histogram.count))
+        for name, value in sorted(self.gauges.items()):
+            lines.append('# TYPE %s%s gauge' % (prefix, name))
+            lines.append('%s%s %s' % (prefix, name, format_value(value)))
+        if stats:
+            lines.append('# TYPE %sstat gauge' % prefix)
+            for key, value in sorted(stats.items()):
+                if isinstance(value, (int, float)):
+                    lines.append('%sstat%s %s' % (prefix, format_labels((('key', key),)), format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in labels)
+
+
+def format_value(value):
+    return 'NaN' if value is None else repr(float(value))
+
+
+def crawler_metrics(crawler):
+    '''The Metrics of a crawl, shared by the extension and the middleware that record them'''
+    if not hasattr(crawler, 'metrics'):
+        crawler.metrics = Metrics()
+    return crawler.metrics
+
+
+class MetricsResource(Resource):
+    # /metrics in the Prometheus text format, /metrics.json as json
+
+    isLeaf = True
+
+    def __init__(self, metrics, stats):
+        Resource.__init__(self)
+        self.metrics = metrics
+        self.stats = stats
+
+    def render_GET(self, request):
+        if request.path.endswith(b'.json'):
+            request.setHeader(b'Content-Type', b'application/json')
+            return json.dumps(dict(self.metrics.to_json(), stats=self.stats.get_stats()), default=str).encode('utf-8')
+        request.setHeader(b'Content-Type', b'text/plain; version=0.0.4')
+        return self.metrics.to_prometheus(self.stats.get_stats()).encode('utf-8')
+
+
+def function_name(code_key):
+    filename, line, name = code_key
+    if filename.startswith(PACKAGE_DIR):
+        filename = os.path.relpath(filename, os.path.dirname(PACKAGE_DIR))
+    return '%s (%s:%d)' % (name, filename, line)
+
+
+def hottest(functions, top):
+    '''
+    The top functions by their own time, and the top functions of the scraper package by their time including what
+    they call, from a dict of (filename, line, name) to (own seconds, total seconds)
+    '''
+    def rows(keys, index):
+        return [{'function': function_name(key), 'own_seconds': functions[key][0], 'total_seconds': functions[key][1]}
+                for key in sorted(keys, key=lambda key: -functions[key][index])[:top]]
+    return {
+        'own': rows(functions, 0),
+        'scraper': rows([key for key in functions if key[0].startswith(PACKAGE_DIR)], 1),
+    }
+
+
+class CProfiler(object):
+    '''cProfile of the thread that starts it (the reactor), optionally dumped to a file for pstats or snakeviz'''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        if self.path:
+            self.profile.dump_stats(self.path)
+
+    def functions(self):
+        stats = pstats.Stats(self.profile).stats
+        return dict((key, (own, total)) for key, (_, _, own, total, _) in stats.items())
+
+
+class StackSampler(object):
+    '''
+    Takes the stack of the thread that starts it (the reactor) every interval seconds from a background thread, and
+    adds the time since the previous sample to the functions on it. Much cheaper than cProfile, so it can run during
+    a real crawl. As the sampler has to wait for the GIL, a sample can come later than the interval, which is why it
+    counts the time that passed rather than the samples.
+    '''
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.own = Counter()
+        self.total = Counter()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, args=(threading.current_thread().ident,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self, thread_id):
+        previous = time.perf_counter()
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            now = time.perf_counter()
+            seconds, previous = now - previous, now
+            if frame is None:
+                continue
+            code = frame.f_code
+            self.own[(code.co_filename, code.co_firstlineno, code.co_name)] += seconds
+            on_stack = set()
+            while frame is not None:
+                code = frame.f_code
+                on_stack.add((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            for key in on_stack:
+                self.total[key] += seconds
+
+    def functions(self):
+        return dict((key, (self.own[key], total)) for key, total in self.total.items())
@@ -1,11 +1,25 @@
 # -*- coding: utf-8 -*-
 
-# Define here the models for your spider middleware
+# Define here the models for your spider and downloader middleware
 #
 # See documentation in:
 # http://doc.scrapy.org/en/latest/topics/spider-middleware.html
+# http://doc.scrapy.org/en/latest/topics/downloader-middleware.html
+
+import hashlib
+import time
 
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import Headers, Request
+from scrapy.responsetypes import responsetypes
+from twisted.internet import reactor
+from twisted.internet.task import deferLater
+from w3lib.url import canonicalize_url
+
+from scraper.cache_store import ResponseStore
+from scraper.extensions import download_error
+from scraper.metrics import crawler_metrics
 
 
 class IensScraperSpiderMiddleware(object):
@@ -54,3 +68,193 @@ class IensScraperSpiderMiddleware(object):
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
+
+
+class CallbackMetricsMiddleware(object):
+    # Records the time every callback of the spider takes to parse a response and the number of items it gives, in
+    # the histograms of the CrawlMetrics extension (see extensions.py and metrics.py).
+    #
+    # As the spider middleware closest to the spider, the time is that of the callback itself: the time spent in its
+    # generator for each of its results, without the time the other middlewares and the pipelines take for them.
+    # Callbacks that return a list instead of being a generator only get the items counted.
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+        return cls(crawler_metrics(crawler))
+
+    def process_spider_output(self, response, result, spider):
+        callback = getattr(response.request.callback, '__name__', 'parse')
+        return self.measure(result, callback)
+
+    def measure(self, result, callback):
+        seconds = 0.0
+        nr_items = 0
+        results = iter(result)
+        while True:
+            start = time.perf_counter()
+            try:
+                output = next(results)
+            except StopIteration:
+                break
+            finally:
+                seconds += time.perf_counter() - start
+            if not isinstance(output, Request):
+                nr_items += 1
+            yield output
+        self.metrics.histogram('callback_seconds', callback=callback).record(seconds)
+        self.metrics.histogram('callback_items', callback=callback).record(nr_items)
+
+
+class ConditionalCacheMiddleware(object):
+    # Revalidates earlier responses with conditional GETs instead of always downloading them again.
+    #
+    # Responses are kept in a ResponseStore. A request for a url that is in the store gets If-None-Match and
+    # If-Modified-Since headers from the stored validators, and a 304 is answered with the stored response.
+    # Responses that didn't change (a 304, or a 200 with the same body hash) get meta['cache_unchanged']. The store
+    # is shared by all spiders and runs, so the spiders don't skip pages on it: in incremental mode that is up to the
+    # crawl index, which only counts pages of finished runs.
+
+    def __init__(self, store, stats):
+        self.store = store
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('CONDITIONAL_CACHE_ENABLED'):
+            raise NotConfigured
+        store = ResponseStore(settings.get('CONDITIONAL_CACHE_DIR'), settings.getint('CONDITIONAL_CACHE_MAX_BYTES'))
+        s = cls(store, crawler.stats)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    @staticmethod
+    def url_hash(request):
+        return hashlib.sha1(canonicalize_url(request.url).encode('utf-8')).hexdigest()
+
+    def process_request(self, request, spider):
+        if request.method != 'GET' or request.meta.get('conditional_cache_refetch'):
+            return None
+        entry = self.store.get(self.url_hash(request))
+        if entry is None:
+            return None
+        if entry['etag']:
+            request.headers.setdefault('If-None-Match', entry['etag'])
+        if entry['last_modified']:
+            request.headers.setdefault('If-Modified-Since', entry['last_modified'])
+        request.meta['conditional_cache_entry'] = entry
+        return None
+
+    def process_response(self, request, response, spider):
+        if request.method != 'GET':
+            return response
+        entry = request.meta.pop('conditional_cache_entry', None)
+
+        if response.status == 304 and entry is not None:
+            try:
+                body = self.store.read_body(entry['body_hash'])
+            except FileNotFoundError:
+                # evicted since the request was sent, download it again without the validators
+                self.stats.inc_value('conditional_cache/refetched')
+                headers = request.headers.copy()
+                headers.pop('If-None-Match', None)
+                headers.pop('If-Modified-Since', None)
+                return request.replace(headers=headers, dont_filter=True,
+                                       meta=dict(request.meta, conditional_cache_refetch=True))
+            self.stats.inc_value('conditional_cache/hit')
+            self.stats.inc_value('conditional_cache/bytes_saved', len(body))
+            headers = Headers(entry['headers'])
+            respcls = responsetypes.from_args(headers=headers, url=response.url, body=body)
+            request.meta['cache_unchanged'] = True
+            return respcls(url=response.url, status=entry['status'], headers=headers, body=body,
+                           flags=response.flags + ['cached'], request=request)
+
+        if response.status != 200:
+            return response
+        self.stats.inc_value('conditional_cache/miss')
+        headers = dict((key.decode('latin1'), [value.decode('latin1') for value in values])
+                       for key, values in response.headers.items())
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        body_hash = self.store.put(self.url_hash(request), response.url, response.status, headers, response.body,
+                                   etag.decode('latin1') if etag else None,
+                                   last_modified.decode('latin1') if last_modified else None)
+        if entry is not None and entry['body_hash'] == body_hash:
+            self.stats.inc_value('conditional_cache/unchanged')
+            request.meta['cache_unchanged'] = True
+        evicted = self.store.evict()
+        if evicted:
+            self.stats.inc_value('conditional_cache/evicted', evicted)
+        self.stats.set_value('conditional_cache/stored_bytes', self.store.size)
+        return response
+
+    def spider_closed(self, spider):
+        self.store.close()
+
+
+class AdaptiveConcurrencyMiddleware(object):
+    # Reports the requests that failed to download (timeouts, refused or lost connections) to the
+    # AdaptiveConcurrency extension, which only sees the responses, so they count as errors of their download slot.
+    #
+    # It sits next to the downloader, after the PolitenessBudgetMiddleware has let the request through and before
+    # the RetryMiddleware turns the exception into a retry.
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('ADAPTIVE_CONCURRENCY_ENABLED'):
+            raise NotConfigured
+        return cls(crawler)
+
+    def process_request(self, request, spider):
+        request.meta['adaptive_concurrency_sent'] = time.time()
+
+    def process_exception(self, request, exception, spider):
+        if not isinstance(exception, IgnoreRequest):
+            self.crawler.signals.send_catch_log(download_error, request=request, exception=exception, spider=spider)
+
+
+class PolitenessBudgetMiddleware(object):
+    # Holds every request until it fits in the POLITENESS_BUDGET, which the crawl processes of the scheduler share
+    # (see scheduler.py), so together they stay within one limit of requests in flight and request rate to iens.nl.
+    #
+    # A request takes its place in the budget on the way to the downloader and gives it back when its response or
+    # exception comes back. Requests that have to wait are tried again every POLITENESS_BUDGET_POLL_INTERVAL
+    # seconds, without blocking the reactor.
+
+    def __init__(self, budget, poll_interval, stats):
+        self.budget = budget
+        self.poll_interval = poll_interval
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        budget = crawler.settings.get('POLITENESS_BUDGET')
+        if budget is None:
+            raise NotConfigured
+        return cls(budget, crawler.settings.getfloat('POLITENESS_BUDGET_POLL_INTERVAL'), crawler.stats)
+
+    def process_request(self, request, spider):
+        if self.budget.try_acquire():
+            request.meta['politeness_budget'] = True
+            return None
+        self.stats.inc_value('politeness_budget/waits')
+        return deferLater(reactor, self.poll_interval, self.process_request, request, spider)
+
+    def process_response(self, request, response, spider):
+        self.release(request)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self.release(request)
+
+    def release(self, request):
+        if request.meta.pop('politeness_budget', False):
+            self.budget.release()
@@ -5,7 +5,327 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: http://doc.scrapy.org/en/latest/topics/item-pipeline.html
 
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.misc import load_object
+from scrapy.utils.serialize import ScrapyJSONEncoder
+from twisted.internet import defer, reactor, task
+
+from scraper.checkpoints import checkpoint_state, frontier_checkpoint, is_resumed
+from scraper.exporters import RecordJsonLinesItemExporter
+from scraper.schemas import SCHEMA_FILES, TABLE_KEYS, coerce_item, item_table, table_schema, to_arrow_schema
+from scraper.store import ColumnStore
+from scraper.uploads import batch_id, write_batch
+
+logger = logging.getLogger(__name__)
+
 
 class IensScraperPipeline(object):
     def process_item(self, item, spider):
         return item
+
+
+def output_path(uri, spider, table):
+    '''Path of the output file of a table, of which the uri can contain %(table)s, %(name)s and spider attributes'''
+    path = uri % dict(vars(spider), name=spider.name, table=table)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+class SplitFeedPipeline(object):
+    # Writes the restaurants and the comments to a jsonlines feed each, so a spider that scrapes both (iens_spider)
+    # gives the same files as the restaurant and comments spiders, which are loaded into their own BigQuery tables.
+    #
+    # Enabled by setting SPLIT_FEED_URI, which should contain %(table)s (iens or iens_comments):
+    # scrapy crawl iens_spider -s SPLIT_FEED_URI=output/%(table)s_%(placename)s.jsonlines
+    # A crawl that resumes a JOBDIR appends to the feeds of the crawl it continues. The size of the feeds is committed
+    # with every checkpoint of the frontier (see frontier.py), and a resumed crawl first cuts the feeds back to that
+    # size, as the requests that gave the items after it are done again.
+
+    def __init__(self, uri, offsets=None):
+        self.uri = uri
+        # size of every feed at the last checkpoint of the crawl that is resumed, None for a new crawl
+        self.offsets = offsets
+        self.files = {}
+        self.exporters = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        uri = crawler.settings.get('SPLIT_FEED_URI')
+        if not uri:
+            raise NotConfigured
+        offsets = checkpoint_state(crawler.settings).get('feed_offsets', {}) if is_resumed(crawler.settings) else None
+        pipeline = cls(uri, offsets)
+        crawler.signals.connect(pipeline.frontier_checkpoint, signal=frontier_checkpoint)
+        return pipeline
+
+    def open_feed(self, path):
+        if self.offsets is None:
+            return open(path, 'wb')
+        offset = min(self.offsets.get(path, 0), os.path.getsize(path) if os.path.exists(path) else 0)
+        f = open(path, 'ab')
+        f.truncate(offset)
+        f.seek(offset)
+        return f
+
+    def frontier_checkpoint(self, state):
+        offsets = state.setdefault('feed_offsets', {})
+        # the feeds of the resumed crawl that didn't get an item yet keep their size
+        offsets.update(self.offsets or {})
+        for f in self.files.values():
+            f.flush()
+            offsets[f.name] = f.tell()
+
+    def process_item(self, item, spider):
+        table = item_table(item)
+        if table not in self.exporters:
+            self.files[table] = self.open_feed(output_path(self.uri, spider, table))
+            self.exporters[table] = RecordJsonLinesItemExporter(self.files[table])
+            self.exporters[table].start_exporting()
+        self.exporters[table].export_item(item)
+        return item
+
+    def close_spider(self, spider):
+        for table, exporter in self.exporters.items():
+            exporter.finish_exporting()
+            self.files[table].close()
+
+
+def previous_path(path):
+    return path + '.previous'
+
+
+class ParquetExportPipeline(object):
+    # Streams the items into a Parquet file next to the jsonlines feed, with the nested info/reviews records and
+    # repeated tags/image_urls of the BigQuery schema. Items are collected in a ColumnStore and written as one row
+    # group per PARQUET_BATCH_SIZE items, so memory stays bounded by the batch size.
+    #
+    # Enabled by setting PARQUET_EXPORT_URI, which can contain %(name)s and other spider attributes like the
+    # FEED_URI: scrapy crawl restaurant_spider -s PARQUET_EXPORT_URI=output/%(name)s_%(placename)s.parquet
+    # The restaurants and comments of iens_spider go to a file each, so its uri should contain %(table)s.
+    # A crawl that resumes a JOBDIR starts the file with the row groups of the crawl it continues, as a Parquet file
+    # can't be appended to. The file of a crawl that was killed has no footer and can't be read, in which case its
+    # rows are only in the jsonlines feed.
+
+    def __init__(self, uri, batch_size, append=False, schema_dir=None):
+        self.uri = uri
+        self.batch_size = batch_size
+        self.append = append
+        self.schema_dir = schema_dir
+        self.tables = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        uri = crawler.settings.get('PARQUET_EXPORT_URI')
+        if not uri:
+            raise NotConfigured
+        return cls(uri, crawler.settings.getint('PARQUET_BATCH_SIZE'), is_resumed(crawler.settings),
+                   crawler.settings.get('SCHEMA_DIR'))
+
+    def open_table(self, spider, table):
+        import pyarrow.parquet as pq
+        schema = table_schema(table, self.schema_dir)
+        arrow_schema = to_arrow_schema(schema)
+        path = output_path(self.uri, spider, table)
+        if any(other['path'] == path for other in self.tables.values()):
+            raise ValueError('PARQUET_EXPORT_URI %s should contain %%(table)s for %s' % (self.uri, spider.name))
+        previous = self.previous_rows(path) if self.append else None
+        writer = pq.ParquetWriter(path, arrow_schema, compression='snappy')
+        if previous is not None:
+            for i in range(previous.num_row_groups):
+                writer.write_table(previous.read_row_group(i))
+            os.remove(previous_path(path))
+        return {'arrow_schema': arrow_schema, 'path': path, 'writer': writer, 'store': ColumnStore(schema)}
+
+    def previous_rows(self, path):
+        '''The Parquet file at the path, moved out of the way, or None when there is no readable file'''
+        import pyarrow.parquet as pq
+        if not os.path.exists(path):
+            return None
+        try:
+            previous = pq.ParquetFile(path)
+        except Exception as e:
+            logger.warning('Can\'t continue %s of the resumed crawl (%s), its rows are only in the jsonlines feed',
+                           path, e)
+            return None
+        os.replace(path, previous_path(path))
+        return pq.ParquetFile(previous_path(path))
+
+    def process_item(self, item, spider):
+        table = item_table(item)
+        if table not in self.tables:
+            self.tables[table] = self.open_table(spider, table)
+        store = self.tables[table]['store']
+        store.append(item)
+        if len(store) >= self.batch_size:
+            self.write_batch(self.tables[table])
+        return item
+
+    def write_batch(self, table):
+        table['writer'].write_table(table['store'].to_arrow(table['arrow_schema']))
+        table['store'].clear()
+
+    def close_spider(self, spider):
+        for table in self.tables.values():
+            if len(table['store']):
+                self.write_batch(table)
+            table['writer'].close()
+
+
+class UploadPipeline(object):
+    # Uploads the items to BigQuery while the crawl runs, instead of loading the whole feed once the crawl finished.
+    #
+    # The items of each table are collected in batches of UPLOAD_BATCH_SIZE items, or fewer once the first item of a
+    # batch waited UPLOAD_BATCH_SECONDS. The batches are uploaded by UPLOAD_THREADS threads, and a failed upload is
+    # tried again up to UPLOAD_RETRIES times after UPLOAD_RETRY_DELAY seconds (doubled every try). Batch ids are a
+    # hash of their contents, so a try of a batch that did get loaded doesn't load it twice. When a crawl that resumed
+    # an earlier one closes, the sink deduplicates the tables it uploaded to on their key, so the items that it scraped
+    # again aren't in them twice (see uploads.py). Items are converted to their schema before they are batched. When
+    # UPLOAD_MAX_PENDING batches are waiting or being uploaded, items wait for one of them to finish, which bounds
+    # the memory. A batch that can't be uploaded is saved in UPLOAD_FAILED_DIR to load it later.
+    #
+    # Enabled by setting UPLOAD_SINK to a sink of uploads.py and UPLOAD_TABLE to the destination table, which can
+    # contain %(table)s (iens or iens_comments) and spider attributes:
+    # scrapy crawl iens_spider -s UPLOAD_SINK=scraper.uploads.BigQuerySink -s UPLOAD_TABLE=iens.%(table)s_%(placename)s
+    # The FileSink writes the batches to files in UPLOAD_FILE_DIR instead, to try the pipeline without BigQuery.
+
+    def __init__(self, sink, table, stats, settings, resumed=False):
+        self.sink = sink
+        self.table = table
+        self.stats = stats
+        self.resumed = resumed
+        self.batch_size = settings.getint('UPLOAD_BATCH_SIZE')
+        self.batch_seconds = settings.getfloat('UPLOAD_BATCH_SECONDS')
+        self.threads = settings.getint('UPLOAD_THREADS')
+        self.retries = settings.getint('UPLOAD_RETRIES')
+        self.retry_delay = settings.getfloat('UPLOAD_RETRY_DELAY')
+        self.max_pending = settings.getint('UPLOAD_MAX_PENDING')
+        self.failed_dir = settings.get('UPLOAD_FAILED_DIR')
+        self.encoder = ScrapyJSONEncoder(ensure_ascii=False)
+        self.schemas = dict((table, table_schema(table, settings.get('SCHEMA_DIR'))) for table in SCHEMA_FILES)
+        self.batches = {}
+        # the key of every table that was uploaded to
+        self.destinations = {}
+        self.pending = set()
+        self.waiting = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.get('UPLOAD_SINK'):
+            raise NotConfigured
+        return cls(load_object(settings.get('UPLOAD_SINK'))(settings), settings.get('UPLOAD_TABLE'), crawler.stats,
+                   settings, is_resumed(settings))
+
+    def open_spider(self, spider):
+        self.spider = spider
+        self.executor = ThreadPoolExecutor(self.threads)
+        self.flushes = task.LoopingCall(self.flush_expired)
+        self.flushes.start(min(1.0, self.batch_seconds), now=False)
+
+    def process_item(self, item, spider):
+        table = item_table(item)
+        if table not in self.batches:
+            self.batches[table] = {'lines': [], 'started': time.time()}
+        # the values are checked against the schema here, instead of failing the load job of the batch
+        row = coerce_item(item, self.schemas[table])
+        self.batches[table]['lines'].append((self.encoder.encode(row) + '\n').encode('utf-8'))
+        if len(self.batches[table]['lines']) >= self.batch_size:
+            self.submit(table)
+        if len(self.pending) < self.max_pending:
+            return item
+        # too many batches wait for an upload, the item goes on once one of them is done
+        waiter = defer.Deferred()
+        waiter.addCallback(lambda _: item)
+        self.waiting.append(waiter)
+        return waiter
+
+    def flush_expired(self):
+        for table, batch in list(self.batches.items()):
+            if time.time() - batch['started'] >= self.batch_seconds:
+                self.submit(table)
+
+    def submit(self, table):
+        lines = self.batches.pop(table)['lines']
+        destination = self.table % dict(vars(self.spider), name=self.spider.name, table=table)
+        data = b''.join(lines)
+        self.destinations[destination] = TABLE_KEYS[table]
+        done = self.in_thread(self.upload, destination, data, self.schemas[table])
+        done.addCallback(self.uploaded, destination, data, len(lines))
+        done.addBoth(self.release, done)
+        self.pending.add(done)
+
+    def in_thread(self, function, *args):
+        '''Calls function in a thread of the pool, returns a deferred that fires with its future'''
+        future = self.executor.submit(function, *args)
+        done = defer.Deferred()
+        future.add_done_callback(lambda future: reactor.callFromThread(done.callback, future))
+        return done
+
+    def upload(self, table, data, schema):
+        '''Uploads a batch to the sink (in a thread of the pool), returns its id and the number of retries'''
+        batch = batch_id(table, data)
+        return batch, self.retry('Upload of batch %s' % batch, self.sink.upload, table, batch, data, schema)
+
+    def retry(self, description, function, *args):
+        '''Calls function, up to UPLOAD_RETRIES times again when it fails, returns the number of retries'''
+        for attempt in range(self.retries + 1):
+            try:
+                function(*args)
+                return attempt
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning('%s failed (%r), trying again', description, e)
+                time.sleep(self.retry_delay * 2 ** attempt)
+
+    def uploaded(self, future, table, data, nr_items):
+        if future.exception() is not None:
+            path = write_batch(self.failed_dir, table, batch_id(table, data), data)
+            logger.error('Upload of %d items to %s failed (%r), saved them in %s', nr_items, table,
+                         future.exception(), path)
+            self.stats.inc_value('upload/failed_batches')
+            self.stats.inc_value('upload/failed_items', nr_items)
+            return
+        batch, retries = future.result()
+        self.stats.inc_value('upload/batches')
+        self.stats.inc_value('upload/items', nr_items)
+        self.stats.inc_value('upload/retries', retries)
+
+    def release(self, result, done):
+        self.pending.discard(done)
+        while self.waiting and len(self.pending) < self.max_pending:
+            self.waiting.pop(0).callback(None)
+        return result
+
+    def close_spider(self, spider):
+        if self.flushes.running:
+            self.flushes.stop()
+        for table in list(self.batches):
+            self.submit(table)
+        finished = defer.DeferredList(list(self.pending))
+        if self.resumed:
+            finished.addCallback(self.deduplicate)
+        finished.addBoth(lambda _: self.executor.shutdown())
+        return finished
+
+    def deduplicate(self, _):
+        '''Has the sink deduplicate the tables of a resumed crawl, once all its batches are uploaded'''
+        done = []
+        for table, key in sorted(self.destinations.items()):
+            done.append(self.in_thread(self.retry, 'Deduplicating %s' % table, self.sink.deduplicate, table, key))
+            done[-1].addCallback(self.deduplicated, table)
+        return defer.DeferredList(done)
+
+    def deduplicated(self, future, table):
+        if future.exception() is not None:
+            logger.error('Rows of %s that the resumed crawl uploaded again weren\'t removed (%r)', table,
+                         future.exception())
+            self.stats.inc_value('upload/failed_deduplications')
+            return
+        self.stats.inc_value('upload/deduplicated_tables')
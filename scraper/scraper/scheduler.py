@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+'''
+Crawls a batch of cities with iens_spider, spread over a pool of processes:
+$ python -m scraper.scheduler amsterdam utrecht diemen --processes 3 --output dockeroutput
+
+Every city is crawled in a process of its own (a Twisted reactor can't be restarted) into its own files:
+dockeroutput/iens_<city>_<date>.jsonlines, dockeroutput/iens_comments_<city>_<date>.jsonlines and their .parquet
+and .log files. As all crawls go to iens.nl, the processes share one politeness budget: at most --concurrency
+requests in flight and --delay seconds between requests, over all processes together.
+
+The progress of the batch is kept in dockeroutput/scheduler_<date>.json. Running the same batch again (with the same
+--date) only crawls the cities that didn't finish, so a run that was killed picks up where it left off. The crawl of
+every city has a JOBDIR in dockeroutput/jobs, so a city that was killed halfway resumes its own crawl (see
+frontier.py). A crawl process that dies (killed, or out of memory) counts as a failed crawl of its city, and the
+places it held in the politeness budget are given back to the other processes.
+'''
+
+import argparse
+import datetime as dt
+import json
+import logging
+import multiprocessing
+import os
+import time
+from contextlib import contextmanager
+from multiprocessing.connection import wait
+
+logger = logging.getLogger(__name__)
+
+
+class PolitenessBudget(object):
+    '''
+    Limit of requests in flight and time between requests, shared by processes (see PolitenessBudgetMiddleware).
+    Every place in use keeps the pid of its process, so the places of a process that died can be reclaimed.
+    '''
+
+    def __init__(self, concurrency, delay):
+        self.lock = multiprocessing.Lock()
+        # pid of the process that holds the lock, 0 when nobody does
+        self.owner = multiprocessing.RawValue('i', 0)
+        # pid of the process of every place in use, 0 for a free place
+        self.places = multiprocessing.RawArray('i', concurrency)
+        self.last_request = multiprocessing.RawValue('d', 0.0)
+        self.delay = delay
+
+    def __deepcopy__(self, memo):
+        # the crawl settings are copied, but the budget has to stay the one that is shared
+        return self
+
+    @contextmanager
+    def locked(self):
+        self.lock.acquire()
+        self.owner.value = os.getpid()
+        try:
+            yield
+        finally:
+            self.owner.value = 0
+            self.lock.release()
+
+    def try_acquire(self):
+        pid = os.getpid()
+        with self.locked():
+            now = time.time()
+            if now - self.last_request.value < self.delay:
+                return False
+            for i, place in enumerate(self.places):
+                if place == 0:
+                    self.places[i] = pid
+                    self.last_request.value = now
+                    return True
+        return False
+
+    def release(self):
+        pid = os.getpid()
+        with self.locked():
+            for i, place in enumerate(self.places):
+                if place == pid:
+                    self.places[i] = 0
+                    return
+
+    def reclaim(self, pid):
+        '''Gives back the places (and the lock) a process that ended held, returns the number of places'''
+        # the lock is held for microseconds, so one that is still held by the process after a second never comes back
+        if not self.lock.acquire(timeout=1.0):
+            if self.owner.value not in (pid, 0):
+                self.lock.acquire()
+        self.owner.value = os.getpid()
+        try:
+            reclaimed = 0
+            for i, place in enumerate(self.places):
+                if place == pid:
+                    self.places[i] = 0
+                    reclaimed += 1
+            return reclaimed
+        finally:
+            self.owner.value = 0
+            self.lock.release()
+
+
+class JobState(object):
+    '''Status of every city of a batch in a json file, written after every city that finishes'''
+
+    def __init__(self, path, cities):
+        self.path = path
+        self.cities = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.cities = json.load(f)['cities']
+        for city in cities:
+            self.cities.setdefault(city, {'status': 'pending', 'attempts': 0})
+        self.save()
+
+    def pending(self, cities):
+        return [city for city in cities if self.cities[city]['status'] != 'done']
+
+    def update(self, city, **values):
+        self.cities[city].update(values)
+        self.save()
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({'cities': self.cities}, f, indent=2, sort_keys=True)
+        os.replace(self.path + '.tmp', self.path)
+
+
+# the politeness budget of the worker processes, set when they start
+budget = None
+
+
+def init_worker(politeness_budget):
+    global budget
+    budget = politeness_budget
+
+
+def crawl_worker(politeness_budget, task, connection):
+    '''Runs in a process of its own, which sends the outcome of the crawl back over the connection'''
+    init_worker(politeness_budget)
+    connection.send(crawl_city(task))
+    connection.close()
+
+
+def crawl_city(task):
+    '''Crawls one city in the current (worker) process and returns the city and the outcome of its crawl'''
+    city, output, date, spider, spider_args, settings = task
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    crawl_settings = get_project_settings()
+    crawl_settings.set('SPLIT_FEED_URI', os.path.join(output, '%%(table)s_%s_%s.jsonlines' % (city, date)))
+    crawl_settings.set('PARQUET_EXPORT_URI', os.path.join(output, '%%(table)s_%s_%s.parquet' % (city, date)))
+    crawl_settings.set('LOG_FILE', os.path.join(output, 'iens_%s_%s.log' % (city, date)))
+    # the SQLite index of the conditional cache can't be shared by processes
+    crawl_settings.set('CONDITIONAL_CACHE_DIR', os.path.join(crawl_settings.get('CONDITIONAL_CACHE_DIR'), city))
+    crawl_settings.set('JOBDIR', os.path.join(output, 'jobs', '%s_%s' % (city, date)))
+    crawl_settings.set('POLITENESS_BUDGET', budget)
+    for name, value in settings.items():
+        crawl_settings.set(name, value, priority='cmdline')
+
+    start = time.time()
+    try:
+        process = CrawlerProcess(crawl_settings)
+        crawler = process.create_crawler(spider)
+        process.crawl(crawler, placename=city, index=os.path.join(output, 'index', 'iens_%s.sqlite' % city),
+                      **spider_args)
+        process.start()
+    except Exception as e:
+        logger.exception('Crawl of %s failed', city)
+        return city, {'status': 'failed', 'error': repr(e), 'seconds': time.time() - start}
+    stats = crawler.stats.get_stats()
+    return city, {
+        'status': 'done' if stats.get('finish_reason') == 'finished' else 'failed',
+        'finish_reason': stats.get('finish_reason'),
+        'items': stats.get('item_scraped_count', 0),
+        'requests': stats.get('downloader/request_count', 0),
+        'seconds': time.time() - start,
+    }
+
+
+def run(cities, output, date, processes=None, concurrency=8, delay=0.0, spider='iens_spider', spider_args=None,
+        settings=None, state=None):
+    '''
+    Crawls the cities that didn't finish yet in earlier runs of the batch, returns the job state. The spider is the
+    name of a spider like iens_spider, which gets the placename, index and spider_args as arguments.
+    '''
+    job_state = JobState(state or os.path.join(output, 'scheduler_%s.json' % date), cities)
+    pending = job_state.pending(cities)
+    if not pending:
+        return job_state
+    processes = min(processes or multiprocessing.cpu_count(), len(pending))
+    tasks = [(city, output, date, spider, spider_args or {}, settings or {}) for city in pending]
+    politeness_budget = PolitenessBudget(concurrency, delay)
+    # the process, city and end of the connection it sends its outcome to, by the sentinel of the process
+    running = {}
+    try:
+        while tasks or running:
+            # a fresh process for every city, as the Twisted reactor of a crawl can't be restarted
+            while tasks and len(running) < processes:
+                task = tasks.pop(0)
+                receiver, sender = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(target=crawl_worker, args=(politeness_budget, task, sender))
+                process.start()
+                sender.close()
+                running[process.sentinel] = (process, task[0], receiver)
+            for sentinel in wait(list(running)):
+                process, city, receiver = running.pop(sentinel)
+                process.join()
+                try:
+                    _, outcome = receiver.recv()
+                except EOFError:
+                    # the process died before it could send the outcome of its crawl
+                    outcome = {'status': 'failed', 'error': 'crawl process exited with code %s' % process.exitcode}
+                receiver.close()
+                reclaimed = politeness_budget.reclaim(process.pid)
+                if reclaimed:
+                    logger.warning('%s: reclaimed %d places of the politeness budget', city, reclaimed)
+                outcome['attempts'] = job_state.cities[city]['attempts'] + 1
+                job_state.update(city, **outcome)
+                logger.info('%s: %s', city, outcome)
+    finally:
+        for process, _, _ in running.values():
+            process.terminate()
+            process.join()
+    return job_state
+
+
+def parse_setting(text):
+    name, _, value = text.partition('=')
+    return name, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('cities', nargs='+')
+    parser.add_argument('--output', default='output', help='directory for the output files and the job state')
+    parser.add_argument('--date', default=dt.date.today().strftime('%Y%m%d'), help='date in the file names')
+    parser.add_argument('--processes', type=int, default=None, help='defaults to the number of cores')
+    parser.add_argument('--concurrency', type=int, default=8, help='requests in flight over all processes')
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds between requests over all processes')
+    parser.add_argument('--spider', default='iens_spider')
+    parser.add_argument('--comments', default='true', help='also scrape the comments (true/false)')
+    parser.add_argument('--incremental', default='false', help='incremental crawls (true/false)')
+    parser.add_argument('-s', dest='settings', action='append', default=[], metavar='NAME=VALUE',
+                        help='scrapy setting for all crawls')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    job_state = run(args.cities, args.output, args.date, args.processes, args.concurrency, args.delay, args.spider,
+                    {'comments': args.comments, 'incremental': args.incremental},
+                    dict(parse_setting(setting) for setting in args.settings))
+    failed = [city for city in args.cities if job_state.cities[city]['status'] != 'done']
+    if failed:
+        raise SystemExit('Crawls that didn\'t finish: %s' % ', '.join(failed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+# Helpers for the BigQuery schemas in the data folder (iens_schema.json and iens_comments_schema.json)
+#
+# The schemas are the single definition of what the scraped items look like, and are used to upload to BigQuery
+# and to write the items to columnar files.
+
+import datetime as dt
+import json
+import os
+import re
+
+# the data folder of the repository, the SCHEMA_DIR setting points elsewhere when the schemas aren't there (like in
+# the Docker image, which has them in /app)
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+
+# schema file of the items of each BigQuery table
+SCHEMA_FILES = {
+    'iens': 'iens_schema.json',
+    'iens_comments': 'iens_comments_schema.json',
+}
+
+# a number of which a . is a thousands separator, like in "1.234 reviews"
+COUNT = re.compile(r'\d{1,3}(?:\.\d{3})+(?!\d)|\d+')
+
+# the fields that identify a row of each table, as the id of the restaurant (reviews don't have an id of their own)
+TABLE_KEYS = {
+    'iens': ['info.id'],
+    'iens_comments': ['id', 'reviewer', 'date', 'comment'],
+}
+
+
+def item_table(item):
+    '''BigQuery table of a scraped item: iens for restaurants, iens_comments for comments'''
+    return 'iens' if 'info' in item else 'iens_comments'
+
+
+def load_schema(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def table_schema(table, schema_dir=None):
+    '''Schema of the items of a BigQuery table, from schema_dir or else the data folder'''
+    return load_schema(os.path.join(schema_dir or DATA_DIR, SCHEMA_FILES[table]))
+
+
+def to_arrow_type(field):
+    import pyarrow as pa
+    if field['type'] == 'record':
+        arrow_type = pa.struct([pa.field(f['name'], to_arrow_type(f)) for f in field['fields']])
+    else:
+        arrow_type = {
+            'integer': pa.int64(),
+            'float': pa.float64(),
+            'string': pa.string(),
+            'boolean': pa.bool_(),
+            'date': pa.date32(),
+        }[field['type']]
+    if field.get('mode', '').lower() == 'repeated':
+        return pa.list_(arrow_type)
+    return arrow_type
+
+
+def to_arrow_schema(schema):
+    import pyarrow as pa
+    return pa.schema([pa.field(field['name'], to_arrow_type(field)) for field in schema])
+
+
+def to_bigquery_schema(schema):
+    from google.cloud import bigquery
+    return [bigquery.SchemaField(field['name'], field['type'].upper(), field.get('mode', 'nullable').upper(),
+                                 fields=to_bigquery_schema(field.get('fields', [])))
+            for field in schema]
+
+
+def parse_count(text):
+    '''The first number in a text as an int, for the integer fields, read with . as thousands separator'''
+    match = COUNT.search(text) if text is not None else None
+    return int(match.group().replace('.', '')) if match else None
+
+
+def coerce_value(value, field):
+    '''
+    Converts a scraped value to the python type of its schema field: a date string to a date, and a whole float of an
+    integer field to an int. A float with a fraction in an integer field is a count that wasn't read with parse_count
+    and raises a ValueError, as rounding it would turn a count like "1.234" into 1.
+    '''
+    if value is None:
+        return None
+    if field['type'] == 'date':
+        return dt.datetime.strptime(value, '%Y-%m-%d').date()
+    if field['type'] == 'integer' and isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError('%s is an integer field, but got %r' % (field['name'], value))
+        return int(value)
+    return value
+
+
+def coerce_item(item, schema):
+    '''The fields of the schema of an item, converted with coerce_value (also in records and repeated fields)'''
+    return dict((field['name'], coerce_field(item.get(field['name']), field)) for field in schema)
+
+
+def coerce_field(value, field):
+    if value is None:
+        return None
+    if field.get('mode', '').lower() == 'repeated':
+        return [coerce_field(v, dict(field, mode='nullable')) for v in value]
+    if field['type'] == 'record':
+        return coerce_item(value, field['fields'])
+    return coerce_value(value, field)
@@ -27,13 +27,27 @@ LOG_LEVEL = 'WARNING'
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
 #CONCURRENT_REQUESTS = 32
 
+# The number of requests in flight per host is managed by the AdaptiveConcurrency extension (see EXTENSIONS below):
+# it starts at CONCURRENT_REQUESTS_PER_DOMAIN, goes up while the p95 latency and error rate are healthy, and backs
+# off on 429/503s and latency spikes. On 429/503s it also raises the download delay of the host. Timeouts and other
+# failed downloads count as errors by the AdaptiveConcurrencyMiddleware. Its decisions are counted in the
+# adaptive_concurrency/* stats.
+CONCURRENT_REQUESTS_PER_DOMAIN = 4
+ADAPTIVE_CONCURRENCY_ENABLED = True
+ADAPTIVE_CONCURRENCY_MIN = 1
+ADAPTIVE_CONCURRENCY_MAX = 16
+ADAPTIVE_CONCURRENCY_TARGET_LATENCY = 2.0
+ADAPTIVE_CONCURRENCY_MAX_ERROR_RATE = 0.05
+ADAPTIVE_CONCURRENCY_WINDOW = 20
+ADAPTIVE_CONCURRENCY_BACKOFF = 0.5
+ADAPTIVE_CONCURRENCY_MAX_DELAY = 10.0
+
+# Retry requests that were rate limited as well
+RETRY_HTTP_CODES = [500, 502, 503, 504, 408, 429]
+
 # Configure a delay for requests for the same website (default: 0)
 # See http://scrapy.readthedocs.org/en/latest/topics/settings.html#download-delay
-# See also autothrottle settings and docs
 #DOWNLOAD_DELAY = 3
-# The download delay setting will honor only one of:
-#CONCURRENT_REQUESTS_PER_DOMAIN = 16
-#CONCURRENT_REQUESTS_PER_IP = 16
 
 # Disable cookies (enabled by default)
 #COOKIES_ENABLED = False
@@ -49,29 +63,98 @@ LOG_LEVEL = 'WARNING'
 
 # Enable or disable spider middlewares
 # See http://scrapy.readthedocs.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
-#    'iens_scraper.middlewares.IensScraperSpiderMiddleware': 543,
-#}
+# The callback metrics come after the built in middlewares (up to 900), closest to the spider
+SPIDER_MIDDLEWARES = {
+    'scraper.middlewares.CallbackMetricsMiddleware': 1000,
+}
 
 # Enable or disable downloader middlewares
 # See http://scrapy.readthedocs.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    'iens_scraper.middlewares.MyCustomDownloaderMiddleware': 543,
-#}
+# The conditional cache has to come before HttpCompressionMiddleware (590) to store decompressed bodies, the
+# politeness budget comes last so requests only take their place in it right before they are downloaded
+DOWNLOADER_MIDDLEWARES = {
+    'scraper.middlewares.ConditionalCacheMiddleware': 585,
+    'scraper.middlewares.PolitenessBudgetMiddleware': 950,
+    'scraper.middlewares.AdaptiveConcurrencyMiddleware': 960,
+}
+
+# Seconds between tries of a request that waits for the politeness budget of the scheduler (see scheduler.py)
+POLITENESS_BUDGET_POLL_INTERVAL = 0.05
+
+# Keep the pending requests and the fingerprints of the seen requests on disk when JOBDIR is set, so a crawl can be
+# resumed (see frontier.py). Without JOBDIR it is Scrapy's default scheduler.
+SCHEDULER = 'scraper.frontier.FrontierScheduler'
+#JOBDIR = 'jobs/amsterdam'
+# Number of fingerprints the Bloom filter is sized for (1M at 1 in 10,000 false positives takes 2.4MB)
+FRONTIER_BLOOM_CAPACITY = 1000000
+FRONTIER_BLOOM_ERROR_RATE = 0.0001
+# Seconds between commits of the frontier, which is how much work is redone when a crawl is killed
+FRONTIER_CHECKPOINT_INTERVAL = 30
 
 # Enable or disable extensions
 # See http://scrapy.readthedocs.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    'scrapy.extensions.telnet.TelnetConsole': None,
-#}
+EXTENSIONS = {
+    'scraper.extensions.AdaptiveConcurrency': 500,
+    'scraper.extensions.CrawlMetrics': 510,
+}
+
+# Histograms of the parse time per callback, download latency, response size and queue depth (see extensions.py),
+# served at http://127.0.0.1:<first free port>/metrics (Prometheus) and /metrics.json during the crawl
+METRICS_ENABLED = True
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = [6080, 6130]
+# Seconds between samples of the queue depths
+METRICS_INTERVAL = 1.0
+# Where the summary of the metrics is written when the spider closes
+#METRICS_REPORT = 'output/metrics_%(name)s_%(placename)s.json'
+# 'sampler' or 'cprofile' to report the hottest functions of the crawl as well
+#METRICS_PROFILER = 'sampler'
+METRICS_PROFILER_INTERVAL = 0.005
+#METRICS_PROFILE_FILE = 'output/crawl.pstats'
 
 # Configure item pipelines
 # See http://scrapy.readthedocs.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    'iens_scraper.pipelines.IensScraperPipeline': 300,
-#}
-
-# Enable and configure the AutoThrottle extension (disabled by default)
+ITEM_PIPELINES = {
+    'scraper.pipelines.SplitFeedPipeline': 700,
+    'scraper.pipelines.ParquetExportPipeline': 800,
+    'scraper.pipelines.UploadPipeline': 900,
+}
+
+# Exporters of the json feeds (-o) that also write the nested records of the items (see exporters.py)
+FEED_EXPORTERS = {
+    'json': 'scraper.exporters.RecordJsonItemExporter',
+    'jsonlines': 'scraper.exporters.RecordJsonLinesItemExporter',
+    'jl': 'scraper.exporters.RecordJsonLinesItemExporter',
+}
+
+# Write the restaurants and comments of iens_spider to a jsonlines feed each (disabled when not set)
+#SPLIT_FEED_URI = 'output/%(table)s_%(placename)s.jsonlines'
+
+# Folder of the BigQuery schemas (iens_schema.json and iens_comments_schema.json) that the Parquet export and the
+# uploads write the items by, the data folder of the repository when not set
+#SCHEMA_DIR = '/app'
+
+# Also write the items to a Parquet file, next to the jsonlines feed (disabled when not set)
+#PARQUET_EXPORT_URI = 'output/%(name)s_%(placename)s.parquet'
+# Number of items per row group, which bounds the memory used by the export
+PARQUET_BATCH_SIZE = 1000
+
+# Upload the items in batches while crawling (disabled when not set), to BigQuery with scraper.uploads.BigQuerySink
+# or to files in UPLOAD_FILE_DIR with scraper.uploads.FileSink. UPLOAD_TABLE is the table, like the feed uris.
+#UPLOAD_SINK = 'scraper.uploads.BigQuerySink'
+#UPLOAD_TABLE = 'iens.%(table)s_%(placename)s'
+#UPLOAD_PROJECT = 'my-project'
+UPLOAD_FILE_DIR = 'uploads'
+UPLOAD_BATCH_SIZE = 500
+UPLOAD_BATCH_SECONDS = 30
+UPLOAD_THREADS = 4
+UPLOAD_RETRIES = 3
+UPLOAD_RETRY_DELAY = 2.0
+UPLOAD_MAX_PENDING = 8
+# Batches that can't be uploaded are saved here
+UPLOAD_FAILED_DIR = 'failed_uploads'
+
+# Enable and configure the AutoThrottle extension (disabled by default, AdaptiveConcurrency is used instead)
 # See http://doc.scrapy.org/en/latest/topics/autothrottle.html
 #AUTOTHROTTLE_ENABLED = True
 # The initial download delay
@@ -91,3 +174,9 @@ LOG_LEVEL = 'WARNING'
 #HTTPCACHE_DIR = 'httpcache'
 #HTTPCACHE_IGNORE_HTTP_CODES = []
 #HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
+
+# Revalidate earlier responses with ETag/Last-Modified instead of downloading them again (disabled by default)
+# Stored bodies are evicted least recently used first when the store grows over CONDITIONAL_CACHE_MAX_BYTES
+CONDITIONAL_CACHE_ENABLED = False
+CONDITIONAL_CACHE_DIR = 'conditionalcache'
+CONDITIONAL_CACHE_MAX_BYTES = 500 * 1024 * 1024
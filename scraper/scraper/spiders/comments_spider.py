@@ -1,6 +1,12 @@
 '''
 In terminal call as follows to save results in jsonlines file:
 $ scrapy crawl comments_spider -a placename=amsterdam -o output/comments_spider.jsonlines -s LOG_FILE=output/scrapy_comments.log
+
+Add -a incremental=true to only scrape reviews that weren't scraped in a previous incremental run: restaurants whose
+number of reviews didn't change are skipped, and the review pages of a restaurant are walked one at a time, newest
+first, until a known review is reached. The reviews, pages and number of reviews of a restaurant are only added to
+the index once the walk reached a known review or the last page, so a restaurant of which a page failed is walked
+again in the next run. The index is kept in index/comments_spider_<placename>.sqlite, or at -a index=<path>.
 '''
 
 import scrapy
@@ -10,6 +16,9 @@ import datetime as dt
 import re
 import json
 
+from scraper.crawl_index import get_listing_counts, open_index, page_hash, review_fingerprint
+from scraper.items import Review
+
 
 months = {
     'jan': '1',
@@ -74,6 +83,15 @@ def get_nr_of_pages(xml):
   return xml[start:start+end]
 
 
+def get_restaurant_id(url):
+  return int(url.split('/')[-1].split('?')[0])
+
+
+def get_page_number(url):
+  match = re.search(r'[?&]page=(\d+)', url)
+  return int(match.group(1)) if match else 1
+
+
 def get_contents(response, tag, review_item_type):
   '''
   Function to get review text based on an xpath expression
@@ -83,47 +101,171 @@ def get_contents(response, tag, review_item_type):
   return response.xpath('//' + tag + '[@class="reviewItem-' + review_item_type + '"]/text()').extract()
 
 
+# (item key, label text) of the sub ratings shown in each review block
+SUB_RATINGS = (('rating_food', 'Eten'), ('rating_service', 'Service'), ('rating_decor', 'Decor'))
+
+
+def first_text(element):
+  '''
+  Returns the first text node of an element, which is what xpath's contains(text(), ...) looks at
+  '''
+  if element.text is not None:
+    return element.text
+  for child in element:
+    if child.tail is not None:
+      return child.tail
+  return None
+
+
+def is_descendant(element, ancestor):
+  for parent in element.iterancestors():
+    if parent is ancestor:
+      return True
+  return False
+
+
+def get_sub_ratings(block):
+  '''
+  Collects the sub ratings of a review block in a single walk over its elements. For each label the first
+  span containing it is taken, and its score is the data-score of the first element that follows the span.
+  Labels whose score isn't found within the block are left out.
+  '''
+  ratings = {}
+  label_spans = {}
+  for element in block.iterdescendants():
+    if not isinstance(element.tag, str):
+      continue
+    if element.get('data-score') is not None:
+      for key, label_span in list(label_spans.items()):
+        if key not in ratings and not is_descendant(element, label_span):
+          ratings[key] = element.get('data-score')
+    if element.tag == 'span':
+      text = first_text(element)
+      for key, label in SUB_RATINGS:
+        if text is not None and label in text and key not in label_spans:
+          label_spans[key] = element
+  return ratings
+
+
+def parse_score(score):
+  '''
+  Returns a data-score as an int, or None for a sub rating the review doesn't have
+  '''
+  return int(score) if score is not None else None
+
+
+def parse_review_block(comment_block, restaurant_id, restaurant_name):
+  '''
+  Parses all fields of one review block. The block is serialized only once for the string based helpers and
+  the sub ratings come from one walk over the block instead of a following::* xpath per rating.
+  '''
+  xml = comment_block.extract()
+  comment = get_comment(xml)
+  comment = re.sub('\n', ' ', comment)
+  comment = re.sub('<br>', ' ', comment).strip()
+  sub_ratings = get_sub_ratings(comment_block.root)
+  for key, label in SUB_RATINGS:
+    if key not in sub_ratings:
+      # score lies outside the block, fall back to searching the rest of the document
+      sub_ratings[key] = comment_block.xpath('descendant::span[contains(text(), "' + label + '")]/' +
+                                             'following::*/@data-score').extract_first()
+  return Review(id=restaurant_id, name=restaurant_name, comment=comment,
+                reviewer=get_reviewer(xml).strip(), date=get_date(xml), reserved_online=is_certified(xml),
+                rating=float(get_rating(xml).replace(',', '.')),
+                rating_food=parse_score(sub_ratings['rating_food']),
+                rating_service=parse_score(sub_ratings['rating_service']),
+                rating_decor=parse_score(sub_ratings['rating_decor']))
+
+
 # scrape all restaurants given a listings page
 class CommentsSpider(scrapy.Spider):
     name = "comments_spider"
 
+    def __init__(self, placename='amsterdam', incremental='false', index=None, *args, **kwargs):
+        super(CommentsSpider, self).__init__(*args, **kwargs)
+        self.placename = placename
+        self.index = open_index(self, incremental, index, placename)
+
+    def closed(self, reason):
+        if self.index is not None:
+            self.index.close(commit=reason == 'finished')
+
     def start_requests(self):
         yield scrapy.Request('https://www.iens.nl/restaurant+%s' % self.placename)
 
     def parse_restaurant(self, response):
-        restaurant_id = response.url.split('/')[-1]
-        pos = restaurant_id.find('?')
-        restaurant_id = int(restaurant_id) if pos == -1 else int(restaurant_id[:pos])
+        return self.parse_reviews(response)
+
+    # get the reviews of a restaurant page or one of its review pages
+    def parse_reviews(self, response):
+        # in incremental mode a page that didn't change since the previous run was scraped then, by a walk that
+        # finished, so this walk is caught up too
+        if self.index is not None and self.index.page_unchanged(response.url, response.body, keep=False):
+            self.walk_finished(response, get_restaurant_id(response.url), [], [])
+            return
+        for result in self.parse_review_page(response):
+            yield result
+
+    def parse_review_page(self, response):
+        restaurant_id = get_restaurant_id(response.url)
         restaurant_name = response.xpath('//h1[@class="restaurantSummary-name"]/text()').extract_first()
+        # the reviews and pages of the walk so far, which only go into the index when the walk finishes
+        if self.index is not None:
+            fingerprints = list(response.meta.get('fingerprints', []))
+            pages = list(response.meta.get('pages', [])) + [(response.url, page_hash(response.body))]
 
         for comment_block in response.xpath('//div[@class="reviewItem reviewItem--mainCustomer"]'):
-            comment = get_comment(comment_block.extract())
-            comment = re.sub('\n', ' ', comment)
-            comment = re.sub('<br>', ' ', comment).strip()
-            certified = is_certified(comment_block.extract())
-            date = get_date(comment_block.extract())
-            reviewer = get_reviewer(comment_block.extract()).strip()
-            rating = float(get_rating(comment_block.extract()).replace(',', '.'))
-            yield {'id': restaurant_id, 'name': restaurant_name, 'comment': comment,
-                   'reviewer': reviewer, 'date': date, 'reserved_online': certified, 'rating': rating,
-                   'rating_food': int(comment_block.xpath('descendant::span[contains(text(), "Eten")]/' +
-                                                          'following::*/@data-score').extract_first()),
-                   'rating_service': int(comment_block.xpath('descendant::span[contains(text(), "Service")]/' +
-                                                             'following::*/@data-score').extract_first()),
-                   'rating_decor': int(comment_block.xpath('descendant::span[contains(text(), "Decor")]/' +
-                                                           'following::*/@data-score').extract_first())
-            }
+            review = parse_review_block(comment_block, restaurant_id, restaurant_name)
+            if self.index is not None:
+                fingerprint = review_fingerprint(review)
+                # pushed to the next page by a review that was posted during the walk
+                if fingerprint in fingerprints:
+                    continue
+                # reviews are newest first, so the rest of them were scraped in a previous run
+                if self.index.has_review(review):
+                    self.walk_finished(response, restaurant_id, fingerprints, pages)
+                    return
+                fingerprints.append(fingerprint)
+            yield review
+
+        if self.index is not None:
+            # walk the review pages one at a time, newest first, so the walk stops at the first known review
+            next_page = get_page_number(response.url) + 1
+            for link in response.xpath('//ul[@class="pagination oneline text_right"]/li/a'):
+                if get_page_number(link.xpath('@href').extract_first() or '') == next_page:
+                    yield response.follow(link, callback=self.parse_reviews, meta={
+                        'nr_reviews': response.meta.get('nr_reviews'), 'fingerprints': fingerprints, 'pages': pages})
+                    return
+            self.walk_finished(response, restaurant_id, fingerprints, pages)
+            return
 
         # loop over all review data-page-numbers
         for link in response.xpath('//ul[@class="pagination oneline text_right"]/li/a'):
-            yield response.follow(link, callback=self.parse_restaurant)
+            yield response.follow(link, callback=self.parse_reviews)
+
+    def walk_finished(self, response, restaurant_id, fingerprints, pages):
+        '''
+        Adds the reviews and pages of a walk and the number of reviews of the listing to the index, once the walk over
+        the review pages of the restaurant reached a known review or the last page. A walk of which a page failed
+        never gets here, so the next run walks the restaurant again.
+        '''
+        self.index.add_reviews(restaurant_id, fingerprints)
+        self.index.add_pages(pages)
+        if response.meta.get('nr_reviews') is not None:
+            self.index.update_restaurant(restaurant_id, response.meta['nr_reviews'])
 
     # get all restaurant links from all listings pages
     def parse(self, response):
 
         # loop over all restaurant links and parse info from restaurant page
         for link in response.xpath('//li[@class="resultItem"]/div/h3/a'):
-            yield response.follow(link, callback=self.parse_restaurant)
+            if self.index is None:
+                yield response.follow(link, callback=self.parse_restaurant)
+                continue
+            # in incremental mode skip restaurants that didn't get new reviews since the previous run
+            restaurant_id, nr_reviews = get_listing_counts(link)
+            if not self.index.is_unchanged(restaurant_id, nr_reviews):
+                yield response.follow(link, callback=self.parse_restaurant, meta={'nr_reviews': nr_reviews})
 
         # Loop over all listings. response.follow uses href attribute to automatically follow url of <a> tags
         for a in response.xpath('//div[@class="pagination"]/ul/li[@class="next"]/a'):
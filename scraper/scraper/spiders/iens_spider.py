@@ -0,0 +1,41 @@
+'''
+Scrapes both the restaurants and their comments in one crawl, so every restaurant page is only downloaded once: it
+gives the restaurant item and the first page of reviews, after which only the review pages are followed.
+
+The restaurants and comments are written to separate feeds (the tables in BigQuery) by the SplitFeedPipeline:
+$ scrapy crawl iens_spider -a placename=amsterdam -s SPLIT_FEED_URI=output/%(table)s_%(placename)s.jsonlines -s LOG_FILE=output/scrapy.log
+
+which writes output/iens_amsterdam.jsonlines and output/iens_comments_amsterdam.jsonlines. Add -a comments=false to
+only scrape the restaurants, and -a incremental=true as for the comments spider. The index is kept in
+index/iens_spider_<placename>.sqlite, or at -a index=<path>.
+'''
+
+from scraper.spiders.comments_spider import CommentsSpider, get_restaurant_id
+from scraper.spiders.restaurant_spider import parse_restaurant_info
+
+
+# scrape all restaurants and their comments given a listings page
+class IensSpider(CommentsSpider):
+    name = "iens_spider"
+
+    def __init__(self, placename='amsterdam', incremental='false', index=None, comments='true', *args, **kwargs):
+        super(IensSpider, self).__init__(placename, incremental, index, *args, **kwargs)
+        self.comments = str(comments).lower() == 'true'
+
+    def parse_restaurant(self, response):
+        # in incremental mode a page that didn't change since the previous run was scraped then, and so were its
+        # reviews when the page is kept by a walk over them that finished (see CommentsSpider.walk_finished)
+        if self.index is not None and self.index.page_unchanged(response.url, response.body, keep=not self.comments):
+            if self.comments:
+                self.walk_finished(response, get_restaurant_id(response.url), [], [])
+            return
+        restaurant = parse_restaurant_info(response)
+        yield restaurant
+
+        if not self.comments:
+            if self.index is not None:
+                self.index.update_restaurant(restaurant['info']['id'], restaurant['reviews']['nr_ratings'])
+            return
+        # the restaurant page is also the first page of its reviews
+        for result in self.parse_review_page(response):
+            yield result
@@ -1,13 +1,67 @@
 '''
 In terminal call as follows to save results in jsonlines file:
 $ scrapy crawl restaurant_spider -a placename=amsterdam -o output/restaurant_spider.jsonlines -s LOG_FILE=output/scrapy.log
+
+Add -a incremental=true to skip restaurants whose number of reviews didn't change since the previous incremental
+run. The index of the previous run is kept in index/restaurant_spider_<placename>.sqlite, or at -a index=<path>.
 '''
 
 import re
 import scrapy
+from lxml import etree
+
+from scraper.crawl_index import get_listing_counts, open_index
+from scraper.items import Restaurant, RestaurantInfo, RestaurantReviews
+from scraper.schemas import parse_count
+
+
+def compile_xpath(expression):
+    return etree.XPath(expression, smart_strings=False)
+
+
+# precompiled xpath expressions, evaluated on the lxml root of the response
+XPATHS = {
+    'name': compile_xpath('//h1[@class="restaurantSummary-name"]/text()'),
+    'lat': compile_xpath('//div[@class="restaurant-map"]/div/@data-gps-lat'),
+    'lon': compile_xpath('//div[@class="restaurant-map"]/div/@data-gps-lng'),
+    'avg_price': compile_xpath('//div[contains(concat(" ", normalize-space(@class), " "), '
+                               '"restaurantSummary-price")]/text()'),
+    'nr_reviews': compile_xpath('descendant::*[contains(concat(" ", normalize-space(@class), " "), '
+                                '"reviewsCount")]/text()'),
+    'address': compile_xpath('descendant::*[@class="restaurantSummary-address"]/text()'),
+    'image_urls': compile_xpath('//div[@class="carousel"]/ul/li/img/@src'),
+    'lazy_image_urls': compile_xpath('//div[@class="carousel"]/ul/li/img/@data-lazy'),
+    'tags': compile_xpath('//ul[@id="restaurantTagContainer"]/descendant::*/text()'),
+    'distinction': compile_xpath('//div[@class="reviewSummary-distinction"]/text()'),
+    'rating': compile_xpath('//div[@class="rating rating--big"]/span[@class="rating-ratingValue"]/text()'),
+    'review_summary_labels': compile_xpath('//span[@class="reviewSummary-rangeLabel"] | '
+                                           '//span[@class="reviewSummary-avgRatingLabel"] | '
+                                           '//div[@class="reviewSummary-reviewStatLabel"]'),
+    'following_text': compile_xpath('following::*/text()'),
+}
+
+# (tag, review summary type, label) of the review summary statistics ("Eten", "Decor", ..., "< 7")
+REVIEW_STATS = {
+    'nr_10ratings': ('span', 'rangeLabel', '10'),
+    'nr_9ratings': ('span', 'rangeLabel', '9'),
+    'nr_8ratings': ('span', 'rangeLabel', '8'),
+    'nr_7ratings': ('span', 'rangeLabel', '7'),
+    'nr_7min_ratings': ('span', 'rangeLabel', '< 7'),
+    'rating_food': ('span', 'avgRatingLabel', 'Eten'),
+    'rating_service': ('span', 'avgRatingLabel', 'Service'),
+    'rating_decor': ('span', 'avgRatingLabel', 'Decor'),
+    'price_quality': ('div', 'reviewStatLabel', 'Prijs-kwaliteit'),
+    'noise_level': ('div', 'reviewStatLabel', 'Geluidsniveau'),
+    'waiting_time': ('div', 'reviewStatLabel', 'Wachttijd'),
+}
+
 
+def extract_first(root, name):
+    results = XPATHS[name](root)
+    return results[0] if results else None
 
-# parse int or float (when it contains a ',', '.')
+
+# parse int or float (when it contains a ',', '.'), None when there is no text
 def parse_digit(text):
     if text is not None:
         if text.find(',') != -1:
@@ -17,114 +71,184 @@ def parse_digit(text):
         else:
             return int(text)
     else:
-        return -1
+        return None
+
+
+# first text node of an element, which is what xpath's contains(text(), ...) looks at
+def first_text(element):
+    if element.text is not None:
+        return element.text
+    for child in element:
+        if child.tail is not None:
+            return child.tail
+    return None
+
+
+def common_ancestor(elements):
+    ancestors = [elements[0]] + list(elements[0].iterancestors())
+    for element in elements[1:]:
+        own_ancestors = set([element] + list(element.iterancestors()))
+        ancestors = [ancestor for ancestor in ancestors if ancestor in own_ancestors]
+    return ancestors[0]
+
+
+# get the first text node that follows each of the label elements (like following::*/text()) in one walk
+def get_following_texts(labels):
+    texts = {}
+    armed = []  # labels that ended, with their ancestors, waiting for the next text node
+    label_set = set(labels)
+    for event, element in etree.iterwalk(common_ancestor(labels), events=('start', 'end')):
+        if event == 'start':
+            # the text of an element that starts after a label is the first text node following it
+            if isinstance(element.tag, str) and element.text is not None:
+                for label, _ in armed:
+                    texts[label] = element.text
+                armed = []
+            continue
+        # the tail of an element belongs to its parent, which only follows labels that aren't its descendants
+        if element.tail is not None and armed:
+            parent = element.getparent()
+            for label, ancestors in list(armed):
+                if parent not in ancestors:
+                    texts[label] = element.tail
+                    armed.remove((label, ancestors))
+        if element in label_set:
+            armed.append((element, set(element.iterancestors())))
+            label_set.remove(element)
+            if not label_set and not armed:
+                break
+    # the review summary section ended before a text node was found: search the rest of the document
+    for label, _ in armed:
+        following_texts = XPATHS['following_text'](label)
+        texts[label] = following_texts[0] if following_texts else None
+    return texts
 
 
-# function to get review summary statistic for a specific label ("Eten", "Decor", ..., "< 7")
-def get_review_stat(response, tag, review_summary_type, label):
-    # lookup tag with rating label in the text of the element, then look up following nodes and get text from them
-    return response.xpath('//' + tag + '[@class="reviewSummary-' + review_summary_type + '"][contains(text(),"' +
-                          label + '")]/following::*/text()').extract_first()
+# get all review summary statistics by locating the labels once and harvesting their values in a single traversal
+def get_review_stats(root):
+    labels = XPATHS['review_summary_labels'](root)
+    texts = get_following_texts(labels) if labels else {}
+    stats = {}
+    for field, (tag, review_summary_type, label) in REVIEW_STATS.items():
+        # like the xpath [contains(text(), label)], the first matching label element in the document wins
+        stats[field] = next((texts[element] for element in labels
+                             if element.tag == tag and element.get('class') == 'reviewSummary-' + review_summary_type
+                             and label in (first_text(element) or '')), None)
+    return stats
+
+
+# get info from restaurant page
+def parse_restaurant_info(response):
+    root = response.selector.root
+
+    avg_price = None
+    avg_price_text = extract_first(root, 'avg_price')
+    if avg_price_text is not None:
+        avg_price_numbers = re.findall(r'\d+', avg_price_text)
+        if avg_price_numbers:
+            avg_price = int(avg_price_numbers[-1])
+
+    nr_reviews = parse_count(extract_first(root, 'nr_reviews'))
+
+    street = None
+    house_number = None
+    postal_code = None
+    city = None
+    country = None
+    address = extract_first(root, 'address')
+    if address is not None:
+        address = [s.strip() for s in address.splitlines()]
+        street = address[1].split(' ')[0]
+        house_number = address[1].split(' ')[1]
+        postal_code = address[2]
+        city = address[3]
+        country = address[4]
+
+    # get active image and lazy images (not displayed at time of visit)
+    image_urls = XPATHS['image_urls'](root) + XPATHS['lazy_image_urls'](root)
+    # don't select the last tag as it is always "..."
+    tags = XPATHS['tags'](root)[0:-1]
+
+    review_stats = get_review_stats(root)
+
+    return Restaurant(
+        # restaurant info data
+        info=RestaurantInfo(
+            # get id from the url, other info from the webpage
+            id=int(response.url.split('/')[-1]),
+            name=extract_first(root, 'name'),
+            lat=float(extract_first(root, 'lat')),
+            lon=float(extract_first(root, 'lon')),
+            street=street,
+            house_number=house_number,
+            postal_code=postal_code,
+            city=city,
+            country=country,
+            avg_price=avg_price,
+            nr_tags=len(tags),
+            nr_images=len(image_urls)
+        ),
+
+        # collect review data
+        reviews=RestaurantReviews(
+            # annoying cases wherein there is no distinction lead to error for .strip() - 'or' is ugly fix
+            distinction=(extract_first(root, 'distinction') or '').strip(),
+            rating=parse_digit(extract_first(root, 'rating')),
+            nr_ratings=nr_reviews,
+            # counts have a . as thousands separator, not as decimal point
+            nr_10ratings=parse_count(review_stats['nr_10ratings']),
+            nr_9ratings=parse_count(review_stats['nr_9ratings']),
+            nr_8ratings=parse_count(review_stats['nr_8ratings']),
+            nr_7ratings=parse_count(review_stats['nr_7ratings']),
+            nr_7min_ratings=parse_count(review_stats['nr_7min_ratings']),
+
+            rating_food=parse_digit(review_stats['rating_food']),
+            rating_service=parse_digit(review_stats['rating_service']),
+            rating_decor=parse_digit(review_stats['rating_decor']),
+
+            price_quality=review_stats['price_quality'],
+            noise_level=review_stats['noise_level'],
+            waiting_time=review_stats['waiting_time']
+        ),
+
+        # tag data and image_urls in list format.
+        tags=tags,
+        image_urls=image_urls
+    )
 
 
 # scrape all restaurants given a listings page
 class RestaurantSpider(scrapy.Spider):
     name = "restaurant_spider"
 
-    def __init__(self, placename='amsterdam', *args, **kwargs):
+    def __init__(self, placename='amsterdam', incremental='false', index=None, *args, **kwargs):
         super(RestaurantSpider, self).__init__(*args, **kwargs)
+        self.placename = placename
         self.start_urls = ['https://www.iens.nl/restaurant+%s' % placename]
+        self.index = open_index(self, incremental, index, placename)
+
+    def closed(self, reason):
+        if self.index is not None:
+            self.index.close(commit=reason == 'finished')
+
+    def parse_restaurant(self, response):
+        # in incremental mode a page that didn't change since the previous run was scraped then
+        if self.index is not None and self.index.page_unchanged(response.url, response.body):
+            return
+        restaurant = parse_restaurant_info(response)
+        yield restaurant
 
-    # get info from restaurant page
-    @staticmethod
-    def parse_restaurant(response):
-        avg_price = -1
-        avg_price_text = response.xpath('//div[contains(concat(" ", normalize-space(@class), " "), ' +
-                                        '"restaurantSummary-price")]/text()').extract_first()
-        if avg_price_text is not None:
-            avg_price_numbers = re.findall(r'\d+', avg_price_text)
-            if avg_price_numbers:
-                avg_price = int(avg_price_numbers[-1])
-
-        nr_reviews = -1
-        nr_reviews_text = response.xpath('descendant::*[contains(concat(" ", normalize-space(@class), " "), ' +
-                                         '"reviewsCount")]/text()').extract_first()
-        if nr_reviews_text is not None:
-            nr_reviews_numbers = re.findall(r'\d+', nr_reviews_text)
-            if nr_reviews_numbers:
-                nr_reviews = int(nr_reviews_numbers[0])
-
-        street = -1
-        house_number = -1
-        postal_code = -1
-        city = -1
-        country = -1
-        address = response.xpath('descendant::*[@class="restaurantSummary-address"]/text()').extract_first()
-        if address is not None:
-            address = [s.strip() for s in address.splitlines()]
-            street = address[1].split(' ')[0]
-            house_number = address[1].split(' ')[1]
-            postal_code = address[2]
-            city = address[3]
-            country = address[4]
-
-        # get active image and lazy images (not displayed at time of visit)
-        image_urls = response.xpath('//div[@class="carousel"]/ul/li/img/@src').extract() + \
-                     response.xpath('//div[@class="carousel"]/ul/li/img/@data-lazy').extract()
-        # don't select the last tag as it is always "..."
-        tags = response.xpath('//ul[@id="restaurantTagContainer"]/descendant::*/text()').extract()[0:-1]
-
-        yield {
-            # restaurant info data
-            'info': {
-                # get id from the url, other info from the webpage
-                'id': int(response.url.split('/')[-1]),
-                'name': response.xpath('//h1[@class="restaurantSummary-name"]/text()').extract_first(),
-                'lat': float(response.xpath('//div[@class="restaurant-map"]/div/@data-gps-lat').extract_first()),
-                'lon': float(response.xpath('//div[@class="restaurant-map"]/div/@data-gps-lng').extract_first()),
-                'street': street,
-                'house_number': house_number,
-                'postal_code': postal_code,
-                'city': city,
-                'country': country,
-                'avg_price': avg_price,
-                'nr_tags': len(tags),
-                'nr_images': len(image_urls)
-            },
-
-            # collect review data
-            'reviews': {
-                # annoying cases wherein there is no distinction lead to error for .strip() - 'or' is ugly fix
-                'distinction': (response.xpath('//div[@class="reviewSummary-distinction"]/text()').
-                                extract_first() or '').strip(),
-                'rating': parse_digit(response.xpath('//div[@class="rating rating--big"]/' +
-                                                     'span[@class="rating-ratingValue"]/text()').extract_first()),
-                'nr_ratings': nr_reviews,
-                'nr_10ratings': parse_digit(get_review_stat(response, 'span', 'rangeLabel', '10')),
-                'nr_9ratings': parse_digit(get_review_stat(response, 'span', 'rangeLabel', '9')),
-                'nr_8ratings': parse_digit(get_review_stat(response, 'span', 'rangeLabel', '8')),
-                'nr_7ratings': parse_digit(get_review_stat(response, 'span', 'rangeLabel', '7')),
-                'nr_7min_ratings': parse_digit(get_review_stat(response, 'span', 'rangeLabel', '< 7')),
-
-                'rating_food': parse_digit(get_review_stat(response, 'span', 'avgRatingLabel', 'Eten')),
-                'rating_service': parse_digit(get_review_stat(response, 'span', 'avgRatingLabel', 'Service')),
-                'rating_decor': parse_digit(get_review_stat(response, 'span', 'avgRatingLabel', 'Decor')),
-
-                'price_quality': get_review_stat(response, 'div', 'reviewStatLabel', 'Prijs-kwaliteit'),
-                'noise_level': get_review_stat(response, 'div', 'reviewStatLabel', 'Geluidsniveau'),
-                'waiting_time': get_review_stat(response, 'div', 'reviewStatLabel', 'Wachttijd')
-            },
-
-            # tag data and image_urls in list format.
-            'tags': tags,
-            'image_urls': image_urls
-        }
+        if self.index is not None:
+            self.index.update_restaurant(restaurant['info']['id'], restaurant['reviews']['nr_ratings'])
 
     # get all restaurant links from all listings pages
     def parse(self, response):
 
         # loop over all restaurant links and parse info from restaurant page
         for link in response.xpath('//li[@class="resultItem"]/div/h3/a'):
+            # in incremental mode skip restaurants that didn't get new reviews since the previous run
+            if self.index is not None and self.index.is_unchanged(*get_listing_counts(link)):
+                continue
             yield response.follow(link, callback=self.parse_restaurant)
 
         # Loop over all listings. response.follow uses href attribute to automatically follow url of <a> tags
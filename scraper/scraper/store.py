@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+# Column oriented store of scraped items, that pipelines append the items to and take batches from
+#
+# The store has a column per field of the BigQuery schema of the table. Numbers and booleans are packed in an array,
+# 8 bytes per value (1 for a boolean) instead of a python object each, with a byte per value that tells whether it is
+# None. Strings and dates are kept in a list, nested records as a column per field, and a repeated field as the offsets
+# where the values of each item start in a column of its values. A batch is turned into an Arrow table column by
+# column, without walking the items again.
+
+from array import array
+
+from scraper.schemas import coerce_value, to_arrow_type
+
+# array typecodes of the numeric BigQuery types, the other types are kept as python objects
+TYPECODES = {'integer': 'q', 'float': 'd', 'boolean': 'b'}
+
+
+class NumberColumn(object):
+
+    def __init__(self, field):
+        self.field = field
+        self.values = array(TYPECODES[field['type']])
+        self.valid = bytearray()
+
+    def append(self, value):
+        self.values.append(0 if value is None else coerce_value(value, self.field))
+        self.valid.append(value is not None)
+
+    def to_arrow(self):
+        import numpy as np
+        import pyarrow as pa
+        values = np.frombuffer(self.values, dtype=self.values.typecode)
+        if self.field['type'] == 'boolean':
+            values = values.astype(bool)
+        mask = np.frombuffer(self.valid, dtype=np.uint8) == 0
+        return pa.array(values, mask=mask if mask.any() else None, type=to_arrow_type(self.field))
+
+
+class ObjectColumn(object):
+
+    def __init__(self, field):
+        self.field = field
+        self.values = []
+
+    def append(self, value):
+        self.values.append(coerce_value(value, self.field))
+
+    def to_arrow(self):
+        import pyarrow as pa
+        return pa.array(self.values, type=to_arrow_type(self.field))
+
+
+class RecordColumn(object):
+
+    def __init__(self, field):
+        self.names = [f['name'] for f in field['fields']]
+        self.columns = [make_column(f) for f in field['fields']]
+
+    def append(self, value):
+        # a missing record gets a record of missing fields
+        for name, column in zip(self.names, self.columns):
+            column.append(value.get(name) if value is not None else None)
+
+    def to_arrow(self):
+        import pyarrow as pa
+        return pa.StructArray.from_arrays([column.to_arrow() for column in self.columns], self.names)
+
+
+class RepeatedColumn(object):
+
+    def __init__(self, field):
+        self.offsets = array('i', [0])
+        self.values = make_column(dict(field, mode='nullable'))
+
+    def append(self, value):
+        for v in value or []:
+            self.values.append(v)
+        self.offsets.append(self.offsets[-1] + len(value or []))
+
+    def to_arrow(self):
+        import numpy as np
+        import pyarrow as pa
+        return pa.ListArray.from_arrays(pa.array(np.frombuffer(self.offsets, dtype=np.int32)),
+                                        self.values.to_arrow())
+
+
+def make_column(field):
+    if field.get('mode', '').lower() == 'repeated':
+        return RepeatedColumn(field)
+    if field['type'] == 'record':
+        return RecordColumn(field)
+    if field['type'] in TYPECODES:
+        return NumberColumn(field)
+    return ObjectColumn(field)
+
+
+class ColumnStore(object):
+    '''The items of a table as a column per field of its schema (see schemas.py)'''
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.clear()
+
+    def clear(self):
+        self.columns = [make_column(field) for field in self.schema]
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, item):
+        '''Adds an item (a record of items.py or a dict) with None for fields it doesn't have'''
+        for field, column in zip(self.schema, self.columns):
+            column.append(item.get(field['name']))
+        self.size += 1
+
+    def to_arrow(self, arrow_schema):
+        '''The items as an Arrow table with the arrow_schema of the schema (see schemas.to_arrow_schema)'''
+        import pyarrow as pa
+        return pa.Table.from_arrays([column.to_arrow() for column in self.columns], schema=arrow_schema)
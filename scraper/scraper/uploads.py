@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# Sinks that the UploadPipeline (see pipelines.py) loads batches of items into
+#
+# A batch is newline delimited json of the items of one table. Its id is a hash of the table and the contents, so a
+# retry of a batch (after a time out) can be recognized by the sink and doesn't add the rows twice. A crawl that is
+# resumed redoes the requests since its last checkpoint (see frontier.py), whose items come in other batches, so once
+# a resumed crawl closes, the UploadPipeline has the sink deduplicate its tables on their key (TABLE_KEYS in
+# schemas.py). That is one query per table for the whole crawl, instead of one per batch. The FileSink doesn't, its
+# files can have rows of such requests twice. Sinks are called from the threads of the upload pipeline and have to be
+# thread safe.
+
+import hashlib
+import io
+import itertools
+import os
+import re
+import threading
+
+from scraper.schemas import to_bigquery_schema
+
+
+def batch_id(table, data):
+    '''Id of a batch, which only contains letters, digits and underscores like BigQuery job ids have to'''
+    return '%s_%s' % (re.sub(r'\W', '_', table), hashlib.sha1(table.encode('utf-8') + b'\n' + data).hexdigest())
+
+
+def write_batch(directory, table, batch, data):
+    '''Writes a batch to <directory>/<table>/<batch id>.jsonlines, unless it is there already'''
+    path = os.path.join(directory, table, batch + '.jsonlines')
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # written under a temporary name first, so a batch is either there completely or not at all
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+class FileSink(object):
+    '''Writes every batch to <directory>/<table>/<batch id>.jsonlines, a local stand-in for BigQuery'''
+
+    def __init__(self, settings):
+        self.directory = settings.get('UPLOAD_FILE_DIR')
+
+    def upload(self, table, batch, data, schema):
+        write_batch(self.directory, table, batch, data)
+
+    def deduplicate(self, table, key):
+        # the batch files are kept as they were uploaded
+        pass
+
+
+class BigQuerySink(object):
+    '''
+    Loads every batch with a BigQuery load job, of which the job id is the batch id and the number of the try. As
+    BigQuery refuses a second job with the same id, a retry first looks up the jobs of the earlier tries: when one of
+    them loaded the batch (or still runs) there is nothing left to do, and only when they all failed a new job is
+    started. Deduplicating a table overwrites it with a query that keeps one row of every key.
+    '''
+
+    DEDUPLICATE = '''
+        SELECT * EXCEPT(row_number) FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY TO_JSON_STRING(STRUCT({key}))) row_number FROM `{table}`
+        ) WHERE row_number = 1
+    '''
+
+    def __init__(self, settings):
+        self.project = settings.get('UPLOAD_PROJECT')
+        self.local = threading.local()
+
+    def client(self):
+        # a client per thread, as the http session of a client isn't thread safe
+        if not hasattr(self.local, 'client'):
+            from google.cloud import bigquery
+            self.local.client = bigquery.Client(project=self.project)
+        return self.local.client
+
+    def upload(self, table, batch, data, schema):
+        from google.api_core.exceptions import Conflict
+        from google.cloud import bigquery
+        client = self.client()
+        dataset, _, table_id = table.rpartition('.')
+        job_config = bigquery.LoadJobConfig()
+        job_config.source_format = 'NEWLINE_DELIMITED_JSON'
+        job_config.schema = to_bigquery_schema(schema)
+        for attempt in itertools.count():
+            job_id = '%s_%d' % (batch, attempt)
+            try:
+                job = client.load_table_from_file(io.BytesIO(data), client.dataset(dataset).table(table_id),
+                                                  job_id=job_id, job_config=job_config)
+            except Conflict:
+                job = client.get_job(job_id)
+                if job.error_result is not None:
+                    continue
+            job.result()
+            return
+
+    def deduplicate(self, table, key):
+        '''Removes the rows of which another row has the same key, only safe when nothing else loads into the table'''
+        from google.cloud import bigquery
+        client = self.client()
+        dataset, _, table_id = table.rpartition('.')
+        job_config = bigquery.QueryJobConfig()
+        job_config.use_legacy_sql = False
+        job_config.destination = client.dataset(dataset).table(table_id)
+        job_config.write_disposition = 'WRITE_TRUNCATE'
+        client.query(self.DEDUPLICATE.format(table='%s.%s.%s' % (client.project, dataset, table_id),
+                                             key=', '.join(key)), job_config=job_config).result()